@@ -0,0 +1,387 @@
+import paho.mqtt.client as mqtt
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import db_utils
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+AGGREGATOR_DB_FILE = "aggregated_plates.db"
+MQTT_BROKER_HOST = "192.168.3.169"
+MQTT_BROKER_PORT = 1883
+CLIENT_ID = "laptop_plate_aggregator" # Must stay the same across restarts: the broker keeps the session under it
+DEVICE_TOPICS = ("rpi/plate_detection/plate", "rpi/plate_detection/+/plate") # Shared topic and per-device topics
+QOS = 1
+BATCH_SIZE = 1000 # Messages per transaction at most
+MAX_QUEUE = 20000 # Messages received but not yet written; on_message waits when full
+STATS_LOG_INTERVAL = 30 # seconds between stats log lines when run standalone
+# --- End Defaults ---
+
+_STOP = object()
+
+
+class StreamState:
+    """Sequence tracking for one (device, boot): the next expected seq and the open gaps as [first, last]."""
+
+    __slots__ = ("next_seq", "gaps")
+
+    def __init__(self, next_seq=1):
+        self.next_seq = next_seq
+        self.gaps = []
+
+
+class Aggregator:
+    """
+    Durable laptop-side ingestion of plate events from many Pis.
+
+    The MQTT client uses a fixed client id with clean_session=False and QoS 1,
+    so the broker keeps messages for the aggregator while it is down, and it
+    acknowledges a message only after the transaction holding it has
+    committed (manual acks): a crash or restart redelivers instead of losing.
+    on_message only parses and queues; a writer thread takes whatever is
+    queued (up to batch_size) and writes it in one transaction, so batches
+    grow with the load and an idle feed is written immediately.
+
+    Pis tag every event with "device", "boot" (an id for the process run) and
+    "seq" (1, 2, 3, ... per boot). Rows go into a WITHOUT ROWID table keyed by
+    (device, boot, seq), which keeps each device's rows together on disk and
+    makes redelivered duplicates free to ignore. A seq that skips ahead opens
+    a gap (recorded in the gaps table); a late message inside a gap closes
+    that part of it. Events without a seq (older Pis) are stored with boot 0
+    and a local counter, without gap tracking; a unique index on their
+    (device, timestamp, plate) makes redeliveries of those free to ignore too.
+    """
+
+    def __init__(self, db_file=AGGREGATOR_DB_FILE, topics=DEVICE_TOPICS, host=MQTT_BROKER_HOST, port=MQTT_BROKER_PORT,
+                 client_id=CLIENT_ID, qos=QOS, batch_size=BATCH_SIZE, max_queue=MAX_QUEUE, data_queue=None):
+        self.db_file = db_file
+        self.topics = list(topics)
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.batch_size = batch_size
+        self.data_queue = data_queue # Optional: committed events are also offered to the Tk dashboard
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._ready = threading.Event()
+        self._connected_db = False
+        self._streams = {}
+        self._local_seq = {}
+
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, clean_session=False,
+                                  manual_ack=True)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.connected = False
+
+        self._stats_lock = threading.Lock()
+        self.messages_received = 0
+        self.invalid = 0
+        self.rows_written = 0
+        self.duplicates = 0
+        self.gaps_opened = 0
+        self.gap_messages = 0 # Messages missing when their gap was detected
+        self.late_filled = 0 # Messages that later arrived inside a gap
+        self.batches = 0
+        self.commit_time_total = 0.0
+        self.dashboard_dropped = 0
+
+    # --- MQTT callbacks (paho network thread) ---
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error(f"Aggregator failed to connect to MQTT: {reason_code}")
+            self.connected = False
+            return
+        self.connected = True
+        logger.info(f"Aggregator connected to {self.host}:{self.port} (session present: {flags.session_present}).")
+        client.subscribe([(topic, self.qos) for topic in self.topics])
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.connected = False
+        logger.warning(f"Aggregator disconnected from MQTT: {reason_code}")
+
+    def on_message(self, client, userdata, msg):
+        """Parses one message and queues it for the writer; waits for room rather than dropping it."""
+        received_ms = int(time.time() * 1000)
+        try:
+            data = json.loads(msg.payload)
+        except (ValueError, UnicodeDecodeError):
+            data = None
+        events = data if isinstance(data, list) else [data]
+        events = [e for e in events if isinstance(e, dict) and e.get("plate")]
+        if not events:
+            with self._stats_lock:
+                self.invalid += 1
+            logger.warning(f"Aggregator: ignoring malformed message on {msg.topic}.")
+            self.client.ack(msg.mid, msg.qos)
+            return
+        # Blocking here pushes back on the broker, which holds the rest in our session
+        self._queue.put((msg.mid, msg.qos, msg.topic, received_ms, events))
+
+    # --- Lifecycle ---
+
+    def start(self, timeout=10.0):
+        """Opens the store, starts the writer and connects; returns False if the store can't be opened."""
+        self._thread = threading.Thread(target=self._run, name="aggregator-writer", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        if not self._connected_db:
+            return False
+        try:
+            self.client.connect(self.host, self.port, 60)
+            logger.info(f"Aggregator connecting to MQTT broker at {self.host}:{self.port}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Aggregator could not reach MQTT broker at {self.host}:{self.port}: {e}; retrying.")
+            self.client.connect_async(self.host, self.port, 60)
+        self.client.loop_start()
+        return True
+
+    def stop(self, timeout=10.0):
+        """Disconnects, then writes everything already received. Acks that can no longer be sent only
+        mean the broker redelivers those messages next time, where they are ignored as duplicates."""
+        self.client.disconnect()
+        self.client.loop_stop()
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info(f"Aggregator stopped: {self.stats()}")
+
+    # --- Writer thread ---
+
+    def _open_store(self):
+        conn = db_utils.create_connection(self.db_file)
+        if not conn:
+            return None
+        db_utils.configure_connection(conn)
+        conn.execute("""CREATE TABLE IF NOT EXISTS readings (
+                            device TEXT NOT NULL,
+                            boot INTEGER NOT NULL,
+                            seq INTEGER NOT NULL,
+                            plate_number TEXT NOT NULL,
+                            timestamp TEXT,
+                            confidence REAL,
+                            received_ms INTEGER NOT NULL,
+                            PRIMARY KEY (device, boot, seq)) WITHOUT ROWID""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS gaps (
+                            device TEXT NOT NULL,
+                            boot INTEGER NOT NULL,
+                            first_seq INTEGER NOT NULL,
+                            last_seq INTEGER NOT NULL,
+                            detected_ms INTEGER NOT NULL,
+                            PRIMARY KEY (device, boot, first_seq)) WITHOUT ROWID""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_received ON readings (received_ms)")
+        legacy_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_readings_legacy'").fetchone()
+        if not legacy_index:
+            # Stores from before the index may hold redelivered copies of seq-less events; keep the first
+            removed = conn.execute("""DELETE FROM readings WHERE boot = 0 AND (device, seq) NOT IN (
+                                          SELECT device, MIN(seq) FROM readings WHERE boot = 0
+                                          GROUP BY device, timestamp, plate_number)""").rowcount
+            if removed:
+                logger.info(f"Aggregator: removed {removed} duplicate rows of events without a seq.")
+            conn.execute("""CREATE UNIQUE INDEX idx_readings_legacy ON readings (device, timestamp, plate_number)
+                            WHERE boot = 0""")
+        conn.commit()
+        self._load_streams(conn)
+        return conn
+
+    def _load_streams(self, conn):
+        """Resumes sequence tracking from the store (at start, and after a failed transaction)."""
+        self._streams, self._local_seq = {}, {}
+        for device, boot, max_seq in conn.execute("SELECT device, boot, MAX(seq) FROM readings GROUP BY device, boot"):
+            if boot:
+                self._streams[(device, boot)] = StreamState(max_seq + 1)
+            else:
+                self._local_seq[device] = max_seq
+        for device, boot, first, last in conn.execute(
+                "SELECT device, boot, first_seq, last_seq FROM gaps ORDER BY device, boot, first_seq"):
+            self._streams.setdefault((device, boot), StreamState(last + 1)).gaps.append([first, last])
+
+    def _run(self):
+        conn = self._open_store()
+        self._connected_db = conn is not None
+        self._ready.set()
+        if conn is None:
+            logger.error(f"Aggregator: could not open {self.db_file}.")
+            return
+        logger.info(f"Aggregator writing to {self.db_file} ({len(self._streams)} known device streams).")
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            while item is not None:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if sum(len(events) for *_, events in batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            while batch and not self._write(conn, batch):
+                time.sleep(1.0) # Retry the same messages; meanwhile on_message waits and the broker holds the rest
+        while True: # Messages that arrived after the stop request
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP and not self._write(conn, [item]):
+                break
+        conn.close()
+
+    def _write(self, conn, batch):
+        """Writes one batch of messages in a transaction, then acknowledges them; False if the write failed."""
+        start = time.perf_counter()
+        rows = []
+        for _, _, topic, received_ms, events in batch:
+            for event in events:
+                row = self._row(topic, received_ms, event)
+                if row is not None:
+                    rows.append(row)
+        rows.sort(key=lambda r: r[:3]) # Key order: each device's rows land in neighbouring pages
+        gap_inserts, gap_deletes, fresh = [], [], []
+        duplicates = gaps_opened = gap_messages = late_filled = 0
+        for row in rows:
+            device, boot, seq = row[:3]
+            if not boot:
+                fresh.append(row)
+                continue
+            stream = self._streams.get((device, boot))
+            if stream is None:
+                stream = self._streams[(device, boot)] = StreamState()
+            if seq == stream.next_seq:
+                stream.next_seq += 1
+            elif seq > stream.next_seq:
+                gap = [stream.next_seq, seq - 1]
+                stream.gaps.append(gap)
+                gap_inserts.append((device, boot, gap[0], gap[1], row[6]))
+                gaps_opened += 1
+                gap_messages += seq - stream.next_seq
+                logger.warning(f"Aggregator: gap in {device} (boot {boot}): seq {gap[0]}..{gap[1]} missing.")
+                stream.next_seq = seq + 1
+            else:
+                gap = next((g for g in stream.gaps if g[0] <= seq <= g[1]), None)
+                if gap is None:
+                    duplicates += 1
+                    continue
+                # A late arrival: shrink or split its gap
+                late_filled += 1
+                stream.gaps.remove(gap)
+                gap_deletes.append((device, boot, gap[0]))
+                for first, last in ((gap[0], seq - 1), (seq + 1, gap[1])):
+                    if first <= last:
+                        stream.gaps.append([first, last])
+                        gap_inserts.append((device, boot, first, last, row[6]))
+            fresh.append(row)
+        try:
+            with conn:
+                conn.executemany("DELETE FROM gaps WHERE device = ? AND boot = ? AND first_seq = ?", gap_deletes)
+                conn.executemany("INSERT OR REPLACE INTO gaps VALUES (?, ?, ?, ?, ?)", gap_inserts)
+                cursor = conn.executemany("INSERT OR IGNORE INTO readings VALUES (?, ?, ?, ?, ?, ?, ?)", fresh)
+                written = cursor.rowcount
+        except sqlite3.Error as e:
+            # Nothing was acknowledged, so the broker still owes us these if we go down now
+            logger.error(f"Aggregator: writing {len(fresh)} rows failed: {e}")
+            self._load_streams(conn)
+            return False
+        for mid, qos, *_ in batch:
+            self.client.ack(mid, qos)
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.messages_received += len(batch)
+            self.rows_written += written
+            self.duplicates += duplicates + len(fresh) - written
+            self.gaps_opened += gaps_opened
+            self.gap_messages += gap_messages
+            self.late_filled += late_filled
+            self.batches += 1
+            self.commit_time_total += elapsed
+        if self.data_queue is not None:
+            for device, boot, seq, plate, timestamp, confidence, _ in fresh:
+                try:
+                    self.data_queue.put_nowait({"plate": plate, "timestamp": timestamp, "confidence": confidence,
+                                                "device": device, "seq": seq})
+                except queue.Full:
+                    self.dashboard_dropped += 1
+        return True
+
+    def _row(self, topic, received_ms, event):
+        device = str(event.get("device") or self._topic_device(topic))
+        try:
+            boot, seq = int(event.get("boot") or 0), int(event.get("seq") or 0)
+            confidence = float(event.get("confidence", 0.0))
+        except (TypeError, ValueError):
+            with self._stats_lock:
+                self.invalid += 1
+            return None
+        if not boot or seq <= 0:
+            boot = 0
+            seq = self._local_seq[device] = self._local_seq.get(device, 0) + 1
+        return (device, boot, seq, str(event["plate"]), str(event.get("timestamp", "")), confidence, received_ms)
+
+    @staticmethod
+    def _topic_device(topic):
+        parts = topic.split("/")
+        return parts[-2] if len(parts) >= 4 else "unknown" # rpi/plate_detection/<device>/plate
+
+    # --- Queries and stats ---
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "connected": self.connected,
+                "messages_received": self.messages_received,
+                "rows_written": self.rows_written,
+                "duplicates": self.duplicates,
+                "invalid": self.invalid,
+                "gaps_opened": self.gaps_opened,
+                "gap_messages": self.gap_messages,
+                "late_filled": self.late_filled,
+                "open_gaps": sum(len(s.gaps) for s in self._streams.values()),
+                "devices": len({device for device, _ in self._streams} | set(self._local_seq)),
+                "batches": self.batches,
+                "avg_batch_messages": (self.messages_received / self.batches) if self.batches else 0.0,
+                "avg_commit_ms": (self.commit_time_total / self.batches * 1000.0) if self.batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+            }
+
+
+def get_open_gaps(conn, device=None):
+    """Missing (device, boot, first_seq, last_seq) ranges, optionally for one device."""
+    if device is None:
+        return conn.execute("SELECT device, boot, first_seq, last_seq FROM gaps ORDER BY device, boot, first_seq").fetchall()
+    return conn.execute("SELECT device, boot, first_seq, last_seq FROM gaps WHERE device = ? ORDER BY boot, first_seq",
+                        (device,)).fetchall()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Store plate events from all Pis in one local database.")
+    parser.add_argument("--host", default=MQTT_BROKER_HOST)
+    parser.add_argument("--port", type=int, default=MQTT_BROKER_PORT)
+    parser.add_argument("--db", default=AGGREGATOR_DB_FILE)
+    parser.add_argument("--topic", action="append", help="topic filter to subscribe to (repeatable)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    aggregator = Aggregator(args.db, args.topic or DEVICE_TOPICS, args.host, args.port)
+    if not aggregator.start():
+        raise SystemExit(1)
+    try:
+        while True:
+            time.sleep(STATS_LOG_INTERVAL)
+            logger.info(f"Aggregator: {aggregator.stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.stop()
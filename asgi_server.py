@@ -0,0 +1,478 @@
+import asyncio
+import io
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+
+import flask_server
+import metrics
+from frame_broadcaster import StreamAdapter, stream_profile
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+MAX_STREAM_VIEWERS = 64 # Concurrent /video_feed connections (all sources together)
+MAX_EVENT_STREAMS = 64 # Concurrent /api/plates/stream connections
+WSGI_THREADS = 8 # Threads running the ordinary Flask routes; one request each at a time
+ADMISSION_WAIT = 5.0 # seconds a connection waits for a free slot on its route before it gets a 503
+ENCODE_THREADS = 2 # Threads downscaling / JPEG-encoding stream frames, shared by all viewers
+MAX_REQUEST_BODY = 1024 * 1024 # bytes; larger request bodies for the Flask routes get a 413
+SHUTDOWN_GRACE = 2.0 # seconds open streams get to finish when the server stops, then they are cut
+# --- End Defaults ---
+
+_REJECTED = metrics.HTTP_REJECTED
+_MJPEG_TYPE = b"multipart/x-mixed-replace; boundary=frame"
+
+
+class RouteLimit:
+    """
+    At most `limit` concurrent connections on one route. A connection over the
+    limit waits up to `wait` seconds for a slot (requests queue here, on the
+    event loop, instead of in threads or the kernel) and is then turned away.
+    """
+
+    def __init__(self, name, limit, wait=ADMISSION_WAIT):
+        self.name = name
+        self.limit = limit
+        self.wait = wait
+        self.active = 0
+        self.rejected = 0
+        self._semaphore = None # Created on the server's event loop
+        metrics.HTTP_CONNECTIONS.labels(name).set_function(lambda: self.active)
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            _REJECTED.labels(self.name).inc()
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+
+class _Notifier:
+    """Lets coroutines wait for a thread-side source (FrameBroadcaster, EventHub) to publish."""
+
+    def __init__(self, loop, source):
+        self._loop = loop
+        self._future = loop.create_future()
+        source.add_listener(self.notify_threadsafe)
+
+    def notify_threadsafe(self):
+        """Listener, called on the publishing thread."""
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        future, self._future = self._future, self._loop.create_future()
+        future.set_result(None)
+
+    async def wait(self, timeout):
+        """Waits for the next publish after this call, or timeout seconds."""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _FrameFeed:
+    """
+    One broadcaster as seen from the event loop: a notifier for new frames and
+    in-flight encodes shared by every viewer that needs the same frame at the
+    same (width, quality), so N viewers cost one encode and no waiting threads.
+    """
+
+    def __init__(self, loop, broadcaster, executor):
+        self.broadcaster = broadcaster
+        self.notifier = _Notifier(loop, broadcaster)
+        self._loop = loop
+        self._executor = executor
+        self._encodes = {} # (width, quality) -> (seq, future)
+
+    async def jpeg(self, seq, frame, profile):
+        key = (profile.width, profile.quality) if profile else None
+        pending = self._encodes.get(key)
+        if pending is None or pending[0] != seq:
+            future = self._loop.run_in_executor(self._executor, self.broadcaster.encode, seq, frame, profile)
+            pending = self._encodes[key] = (seq, future)
+        return await asyncio.shield(pending[1])
+
+
+class ASGIApp:
+    """
+    ASGI front end for flask_server.app.
+
+    /video_feed, /video_feed/<source_id> and /api/plates/stream run as
+    coroutines on one event loop: a viewer costs a few kilobytes of state
+    instead of an OS thread parked in a blocking wait. They are woken by
+    listeners on the FrameBroadcaster and EventHub, and encoding runs on a
+    small shared pool (one encode per frame and profile, whatever the viewer
+    count). Stream profiles and adaptive degrading work as in Flask mode;
+    the time an awaited send() takes is the backpressure signal.
+
+    Every other route is the unchanged Flask app, run on WSGI_THREADS worker
+    threads. Each route group has a RouteLimit; connections over it wait
+    on the loop, then get a 503 with Retry-After.
+    """
+
+    def __init__(self, wsgi_app=flask_server.app):
+        self.wsgi_app = wsgi_app
+        self.limits = {
+            "video": RouteLimit("video", MAX_STREAM_VIEWERS),
+            "events": RouteLimit("events", MAX_EVENT_STREAMS),
+            "wsgi": RouteLimit("wsgi", WSGI_THREADS),
+        }
+        self._wsgi_executor = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix="asgi-wsgi")
+        self._encode_executor = ThreadPoolExecutor(ENCODE_THREADS, thread_name_prefix="asgi-encode")
+        self._feeds = {} # id(broadcaster) -> _FrameFeed
+        self._hub_notifiers = {} # id(event hub) -> _Notifier
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        path = scope["path"]
+        if scope["method"] == "GET" and (path == "/video_feed" or path.startswith("/video_feed/")):
+            source_id = path[len("/video_feed/"):] if path != "/video_feed" else None
+            broadcaster = flask_server.get_frame_broadcaster(source_id)
+            if broadcaster is None:
+                if source_id is None:
+                    await _plain(send, 503, "Error: Video service not ready or frame broadcaster not configured.")
+                else:
+                    await _plain(send, 404, f"Error: Unknown video source '{source_id}'.")
+                return
+            await self._limited("video", self._video, scope, receive, send, broadcaster)
+        elif scope["method"] == "GET" and path == "/api/plates/stream":
+            if not self._logged_in(scope):
+                await send({"type": "http.response.start", "status": 302, "headers": [(b"location", b"/login")]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await self._limited("events", self._events, scope, receive, send)
+        else:
+            await self._limited("wsgi", self._wsgi, scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self._wsgi_executor.shutdown(wait=False)
+                self._encode_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _limited(self, route, handler, scope, receive, send, *args):
+        limit = self.limits[route]
+        if not await limit.acquire():
+            logger.warning(f"ASGI: {route} route at its limit of {limit.limit} connections, "
+                           f"turning away {scope['path']}.")
+            await _plain(send, 503, "Server busy, try again shortly.", [(b"retry-after", b"1")])
+            return
+        try:
+            await handler(scope, receive, send, *args)
+        finally:
+            limit.release()
+
+    def _logged_in(self, scope):
+        """Same check as flask_server.login_required, done on the signed session cookie."""
+        cookie = SimpleCookie()
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                cookie.load(value.decode("latin-1"))
+        morsel = cookie.get(self.wsgi_app.config["SESSION_COOKIE_NAME"])
+        if morsel is None:
+            return False
+        serializer = self.wsgi_app.session_interface.get_signing_serializer(self.wsgi_app)
+        try:
+            session = serializer.loads(morsel.value,
+                                       max_age=int(self.wsgi_app.permanent_session_lifetime.total_seconds()))
+        except Exception:
+            return False
+        return session.get("logged_in") is True
+
+    # --- Streaming routes ---
+
+    async def _video(self, scope, receive, send, broadcaster):
+        args = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+        try:
+            profile = stream_profile(args.get("profile", flask_server.STREAM_DEFAULT_PROFILE),
+                                     width=_number(args, "width", int), fps=_number(args, "fps", float),
+                                     quality=_number(args, "quality", int))
+        except ValueError as e:
+            await _plain(send, 400, f"Error: {e}")
+            return
+        adapter = StreamAdapter(profile, args.get("adapt", "1") not in ("0", "false", "no"))
+        feed = self._feeds.get(id(broadcaster))
+        if feed is None or feed.broadcaster is not broadcaster:
+            feed = self._feeds[id(broadcaster)] = _FrameFeed(asyncio.get_running_loop(), broadcaster,
+                                                             self._encode_executor)
+        viewer = (scope.get("client") or ("?",))[0]
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+        broadcaster.add_viewer()
+        try:
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", _MJPEG_TYPE), (b"cache-control", b"no-cache")]})
+            last_seq = 0
+            next_due = 0.0
+            last_frame_time = last_error_sent = time.monotonic()
+            while not disconnected.is_set():
+                if not flask_server.app.processing_active:
+                    paused = flask_server._status_image_jpeg("Detection Paused", (150, 240), (0, 255, 255))
+                    if paused:
+                        await _send_part(send, paused)
+                    await _wait_or_disconnect(disconnected, 0.5)
+                    last_frame_time = time.monotonic()
+                    continue
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    await _wait_or_disconnect(disconnected, delay) # This viewer's FPS cap
+                seq, frame = broadcaster.latest_frame()
+                if seq == last_seq:
+                    await feed.notifier.wait(1.0)
+                    seq, frame = broadcaster.latest_frame()
+                frame_bytes = None
+                if seq != last_seq and frame is not None:
+                    frame_bytes = await feed.jpeg(seq, frame, adapter.profile)
+                last_seq = seq
+                now = time.monotonic()
+                if frame_bytes is None:
+                    if now - last_frame_time > 1.0 and now - last_error_sent > 5.0:
+                        error_img = flask_server._status_image_jpeg("Stream Error", (180, 240), (0, 0, 255))
+                        if error_img:
+                            await _send_part(send, error_img)
+                        last_error_sent = now
+                    continue
+                last_frame_time = now
+                profile = adapter.profile
+                next_due = now + 1.0 / profile.fps
+                await _send_part(send, frame_bytes)
+                sent_at = time.monotonic()
+                metrics.STREAM_BYTES.labels(profile.name).inc(len(frame_bytes))
+                step = adapter.frame_sent(sent_at - now, sent_at)
+                if step:
+                    metrics.STREAM_PROFILE_CHANGES.labels("down" if step > 0 else "up").inc()
+                    logger.info(f"Video stream: viewer {viewer} switched to profile {adapter.profile.name} "
+                                f"({adapter.profile.width or 'full'} px, {adapter.profile.fps:g} FPS, "
+                                f"quality {adapter.profile.quality}).")
+        except OSError: # Client went away in the middle of a send
+            pass
+        finally:
+            broadcaster.remove_viewer()
+            watcher.cancel()
+
+    async def _events(self, scope, receive, send):
+        hub = flask_server.get_event_hub()
+        notifier = self._hub_notifiers.get(id(hub))
+        if notifier is None:
+            notifier = self._hub_notifiers[id(hub)] = _Notifier(asyncio.get_running_loop(), hub)
+        headers = {name: value for name, value in scope["headers"]}
+        args = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+        last_event_id = headers.get(b"last-event-id", b"").decode("latin-1") or args.get("last_event_id")
+        try:
+            last_id = int(last_event_id) if last_event_id else hub.latest_id()
+        except ValueError:
+            last_id = hub.latest_id()
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+        hub.add_subscriber()
+        try:
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                                    (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]})
+            status = json.dumps({"processing_active": flask_server.app.processing_active}, separators=(",", ":"))
+            await _send_text(send, f"retry: {flask_server.SSE_RETRY_MS}\n"
+                                   + flask_server._sse_message('status', status))
+            while not disconnected.is_set():
+                events, missed = hub.events_after(last_id)
+                if missed:
+                    last_id = hub.latest_id()
+                    await _send_text(send, flask_server._sse_message('reset', '{}', last_id))
+                    continue
+                if events:
+                    await _send_text(send, ''.join(flask_server._sse_message(e.event, e.data, e.id)
+                                                   for e in events))
+                    last_id = events[-1].id
+                    continue
+                waited = time.monotonic()
+                await notifier.wait(flask_server.SSE_HEARTBEAT_INTERVAL)
+                if time.monotonic() - waited >= flask_server.SSE_HEARTBEAT_INTERVAL and not disconnected.is_set():
+                    await _send_text(send, ": keep-alive\n\n")
+        except OSError:
+            pass
+        finally:
+            hub.remove_subscriber()
+            watcher.cancel()
+
+    # --- Everything else: the Flask app ---
+
+    async def _wsgi(self, scope, receive, send):
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.write(message.get("body", b""))
+            if body.tell() > MAX_REQUEST_BODY:
+                await _plain(send, 413, "Request body too large.")
+                return
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        environ = _environ(scope, body)
+        loop = asyncio.get_running_loop()
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+        try:
+            # The whole request, streamed body included, runs on one worker thread, which hands every
+            # chunk to the loop and waits for it to be sent: a slow client holds back its own response only
+            await loop.run_in_executor(self._wsgi_executor, self._run_wsgi, environ, send, loop, disconnected)
+        finally:
+            watcher.cancel()
+
+    def _run_wsgi(self, environ, send, loop, disconnected):
+        state = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state.get("started"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            state["status"] = int(status.split(" ", 1)[0])
+            state["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+        def send_sync(message):
+            if disconnected.is_set():
+                raise ConnectionResetError("client disconnected") # Stops generating a streamed response
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start():
+            if not state.get("started"):
+                state["started"] = True
+                send_sync({"type": "http.response.start", "status": state["status"], "headers": state["headers"]})
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                start()
+                if chunk:
+                    send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+            start()
+            send_sync({"type": "http.response.body", "body": b""})
+        except OSError: # Client went away
+            pass
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+
+def _number(args, name, kind):
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        return None # Ignored, as Flask's request.args.get(type=...) does
+
+
+def _environ(scope, body):
+    """WSGI environ (PEP 3333) for an ASGI HTTP scope."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        if key in environ:
+            value = environ[key] + ("; " if name == "COOKIE" else ",") + value
+        environ[key] = value
+    return environ
+
+
+async def _plain(send, status, text, headers=()):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8"), *headers]})
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+
+async def _send_part(send, frame_bytes):
+    await send({"type": "http.response.body", "body": flask_server._mjpeg_part(frame_bytes), "more_body": True})
+
+
+async def _send_text(send, text):
+    await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+
+async def _watch_disconnect(receive, disconnected):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+    disconnected.set()
+
+
+async def _wait_or_disconnect(disconnected, timeout):
+    try:
+        await asyncio.wait_for(disconnected.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+app = ASGIApp()
+
+
+def run_asgi_app(host='0.0.0.0', port=5000):
+    """
+    Serves app with uvicorn (pip install uvicorn); blocks like run_flask_app.
+    Returns False if uvicorn is not installed.
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error("ASGI server mode needs uvicorn (pip install uvicorn).")
+        return False
+    logger.info(f"Starting ASGI server on {host}:{port}")
+    # Off the main thread (main_pi), uvicorn leaves the signal handlers alone
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False,
+                            lifespan="on", timeout_keep_alive=5,
+                            timeout_graceful_shutdown=SHUTDOWN_GRACE)
+    uvicorn.Server(config).run()
+    return True
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    run_asgi_app()
@@ -0,0 +1,406 @@
+"""
+Offline batch processing of recorded footage and image folders.
+
+    python batch_process.py recordings/ snapshots/ --db detected_plates.db [--workers 4]
+
+Runs video files and images through the same localizer / OCR / cleaning
+code as the live system (pipeline.run_ocr, ocr_utils.clean_plate_text), fanned
+out over a process pool, and bulk-writes the results with db_utils.save_plates.
+Video readings are consolidated per vehicle with plate_tracker, like main_pi;
+every image is stored as its own detection. Progress is checkpointed to a JSON
+file next to the database, so an interrupted run continues where it stopped
+when started again with the same arguments. No camera, GPIO or MQTT needed.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+
+import cv2
+
+import db_utils
+import ocr_utils
+import pipeline
+import plate_tracker
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".h264", ".mjpeg", ".webm")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+SAMPLE_FPS = 5.0 # Video frames OCR'd per second of footage
+CHUNK_SECONDS = 30.0 # Seconds of video per pool task
+IMAGE_BATCH = 16 # Images per pool task
+MIN_CONFIDENCE = 0.3 # Readings below this OCR confidence are ignored
+CHECKPOINT_SUFFIX = ".batch_checkpoint.json"
+# --- End Defaults ---
+
+STAGES = ("decode", "ocr", "clean")
+
+
+def _empty_timings():
+    return {stage: 0.0 for stage in STAGES}
+
+
+def _clean(detections, min_confidence):
+    readings = []
+    for bbox, text, prob in detections:
+        cleaned = ocr_utils.clean_plate_text(text)
+        if cleaned and float(prob) >= min_confidence:
+            readings.append(([[float(x), float(y)] for x, y in bbox], cleaned, float(prob)))
+    return readings
+
+
+def process_video_chunk(path, start_frame, end_frame, stride, fps, min_confidence):
+    """
+    Pool task: OCRs every stride-th frame in [start_frame, end_frame) of one video (end_frame
+    None = until the end). Returns (frames, [(seconds, readings)], timings).
+    """
+    timings = _empty_timings()
+    results = []
+    frames = 0
+    cap = cv2.VideoCapture(path)
+    try:
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        index = start_frame
+        while end_frame is None or index < end_frame:
+            t0 = time.perf_counter()
+            if (index - start_frame) % stride:
+                ok = cap.grab() # Skipped frames are not converted
+                timings["decode"] += time.perf_counter() - t0
+                if not ok:
+                    break
+                index += 1
+                continue
+            ok, frame = cap.read()
+            t1 = time.perf_counter()
+            timings["decode"] += t1 - t0
+            if not ok:
+                break
+            detections = pipeline.run_ocr(frame)
+            t2 = time.perf_counter()
+            readings = _clean(detections, min_confidence)
+            timings["ocr"] += t2 - t1
+            timings["clean"] += time.perf_counter() - t2
+            results.append((index / fps, readings))
+            frames += 1
+            index += 1
+    finally:
+        cap.release()
+    return frames, results, timings
+
+
+def process_images(paths, min_confidence):
+    """Pool task: OCRs a list of image files. Returns (frames, [(path, readings)], timings)."""
+    timings = _empty_timings()
+    results = []
+    for path in paths:
+        t0 = time.perf_counter()
+        frame = cv2.imread(path)
+        t1 = time.perf_counter()
+        timings["decode"] += t1 - t0
+        if frame is None:
+            logger.warning(f"Could not read image {path}, skipping.")
+            results.append((path, []))
+            continue
+        detections = pipeline.run_ocr(frame)
+        t2 = time.perf_counter()
+        timings["ocr"] += t2 - t1
+        results.append((path, _clean(detections, min_confidence)))
+        timings["clean"] += time.perf_counter() - t2
+    return len(paths), results, timings
+
+
+def find_inputs(inputs):
+    """Expands files and directories (recursively) into sorted lists of videos and images."""
+    videos, images = [], []
+    for item in inputs:
+        paths = [item]
+        if os.path.isdir(item):
+            paths = sorted(os.path.join(root, name) for root, _, names in os.walk(item) for name in names)
+        for path in paths:
+            ext = os.path.splitext(path)[1].lower()
+            if ext in VIDEO_EXTENSIONS:
+                videos.append(path)
+            elif ext in IMAGE_EXTENSIONS:
+                images.append(path)
+            elif item == path:
+                logger.warning(f"Skipping {path}: not a known video or image type.")
+    return videos, images
+
+
+class Checkpoint:
+    """
+    JSON progress file. For every video: the chunk to resume from (the earliest chunk that
+    still had an open track) and, as "emitted", the (text, first_seen) keys of events already
+    written that a resumed run would produce again from that chunk on; for images: the batches
+    already written. Saved atomically after each database commit.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {"videos": {}, "image_batches": []}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+            logger.info(f"Resuming from checkpoint {path}.")
+        self._image_batches = set(self.data["image_batches"])
+
+    def video(self, path):
+        state = self.data["videos"].setdefault(path, {"resume_chunk": 0, "emitted": [], "done": False})
+        state.setdefault("emitted", []) # Checkpoints written before events were keyed
+        return state
+
+    def image_batch_done(self, key):
+        return key in self._image_batches
+
+    def mark_image_batch(self, key):
+        self._image_batches.add(key)
+        self.data["image_batches"].append(key)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+
+class VideoJob:
+    """Splits one video into chunk tasks and feeds their results to a PlateTracker in order."""
+
+    def __init__(self, path, state, sample_fps, chunk_seconds, start_time, tracker_options):
+        self.path = path
+        self.state = state
+        cap = cv2.VideoCapture(path)
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        cap.release()
+        self.stride = max(1, int(round(self.fps / sample_fps)))
+        if frame_count > 0:
+            chunk_frames = max(self.stride, int(chunk_seconds * self.fps) // self.stride * self.stride)
+            self.chunks = [(s, min(s + chunk_frames, frame_count)) for s in range(0, frame_count, chunk_frames)]
+        else:
+            self.chunks = [(0, None)] # Unknown length (e.g. raw .h264): one sequential task
+        if start_time is None:
+            # A recording's modification time is when it ended
+            duration = frame_count / self.fps if frame_count > 0 else 0.0
+            start_time = datetime.fromtimestamp(os.path.getmtime(path) - duration)
+        self.start_time = start_time
+        self.tracker = plate_tracker.PlateTracker(**tracker_options)
+        self.next_chunk = state["resume_chunk"]
+        self._done_chunks = {}
+        self._chunk_of_track = {} # track_id -> chunk it started in
+        # (text, first_seen) of events already written that the chunks from resume_chunk on may produce again
+        self._emitted = {(text, first_seen) for text, first_seen in state["emitted"]}
+
+    def tasks(self):
+        for i in range(self.state["resume_chunk"], len(self.chunks)):
+            yield i, self.chunks[i]
+
+    def add_result(self, chunk_index, results):
+        """
+        Stores a finished chunk; feeds every chunk that is now contiguous to the tracker and
+        returns the DB rows of the events that closed.
+        """
+        self._done_chunks[chunk_index] = results
+        rows = []
+        while self.next_chunk in self._done_chunks:
+            for seconds, readings in self._done_chunks.pop(self.next_chunk):
+                known = {t.track_id for t in self.tracker.active_tracks()}
+                rows += self._rows(self.tracker.update(readings, seconds))
+                for track in self.tracker.active_tracks():
+                    if track.track_id not in known:
+                        self._chunk_of_track[track.track_id] = self.next_chunk
+            self.next_chunk += 1
+        if self.next_chunk >= len(self.chunks):
+            rows += self._rows(self.tracker.flush())
+            self.state["done"] = True
+            self.state["resume_chunk"] = len(self.chunks)
+        else:
+            open_chunks = [self._chunk_of_track.get(t.track_id, self.next_chunk) for t in self.tracker.active_tracks()]
+            self.state["resume_chunk"] = min(open_chunks + [self.next_chunk])
+            # Events that started before the resume point are never replayed
+            resume_seconds = self.chunks[self.state["resume_chunk"]][0] / self.fps
+            self._emitted = {key for key in self._emitted if key[1] >= resume_seconds}
+        self.state["emitted"] = [] if self.state["done"] else sorted(self._emitted)
+        return rows
+
+    def _rows(self, events):
+        rows = []
+        for event in events:
+            key = (event.text, event.first_seen)
+            if key in self._emitted:
+                continue # Already written before the run was interrupted, from a chunk now replayed
+            self._emitted.add(key)
+            timestamp = (self.start_time + timedelta(seconds=event.first_seen)).isoformat()
+            rows.append((event.text, timestamp, event.peak_confidence))
+        return rows
+
+    def finished(self):
+        return self.state["done"]
+
+
+def _image_rows(results):
+    rows = []
+    for path, readings in results:
+        timestamp = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+        best = {}
+        for _, text, prob in readings: # One row per distinct plate per image
+            best[text] = max(prob, best.get(text, 0.0))
+        rows += [(text, timestamp, prob) for text, prob in best.items()]
+    return rows
+
+
+def run(args):
+    videos, images = find_inputs(args.inputs)
+    if not videos and not images:
+        logger.error("No video or image files found.")
+        return 1
+    if args.start_time and len(videos) > 1:
+        logger.error(f"--start-time applies to a single video, but {len(videos)} were given; "
+                     f"without it every video starts at its modification time minus its length.")
+        return 2
+    checkpoint = Checkpoint(None if args.no_checkpoint else (args.checkpoint or args.db + CHECKPOINT_SUFFIX))
+    start_time = datetime.fromisoformat(args.start_time) if args.start_time else None # Checked by main()
+    tracker_options = {"track_timeout": args.track_timeout}
+    ocr_options = {
+        "localizer": None if args.no_localizer else {"onnx_model_path": args.detector_model},
+        "full_frame_fallback": args.full_frame_fallback,
+    }
+
+    conn = db_utils.create_connection(args.db)
+    if not conn:
+        return 1
+    db_utils.configure_connection(conn)
+    db_utils.create_table(conn)
+
+    # Build the task list; finished work from an earlier run is skipped
+    jobs = {}
+    tasks = []
+    for path in videos:
+        state = checkpoint.video(path)
+        if state["done"]:
+            continue
+        job = jobs[path] = VideoJob(path, state, args.sample_fps, args.chunk_seconds, start_time, tracker_options)
+        for index, (first, last) in job.tasks():
+            tasks.append((("video", path, index), process_video_chunk,
+                          (path, first, last, job.stride, job.fps, args.min_confidence)))
+    for i in range(0, len(images), args.image_batch):
+        batch = images[i:i + args.image_batch]
+        key = f"{batch[0]}|{len(batch)}"
+        if not checkpoint.image_batch_done(key):
+            tasks.append((("images", key, None), process_images, (batch, args.min_confidence)))
+    skipped = len(videos) - len(jobs)
+    logger.info(f"{len(jobs)} videos and {len(images)} images to process in {len(tasks)} tasks "
+                f"on {args.workers} workers ({skipped} videos already done).")
+
+    totals = _empty_timings()
+    totals["db"] = 0.0
+    frames = rows_written = 0
+    started = time.monotonic()
+    last_report = started
+    executor = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=pipeline.init_ocr_worker, initargs=(ocr_options,))
+    pending = {}
+    task_iter = iter(tasks)
+    try:
+        while True:
+            # Keep a couple of tasks per worker in flight, so results never pile up in memory
+            while len(pending) < args.workers * 2:
+                task = next(task_iter, None)
+                if task is None:
+                    break
+                key, fn, fn_args = task
+                pending[executor.submit(fn, *fn_args)] = key
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, name, index = pending.pop(future)
+                task_frames, results, timings = future.result()
+                frames += task_frames
+                for stage, seconds in timings.items():
+                    totals[stage] += seconds
+                rows = jobs[name].add_result(index, results) if kind == "video" else _image_rows(results)
+                t0 = time.perf_counter()
+                if rows:
+                    written = db_utils.save_plates(conn, rows)
+                    if written != len(rows):
+                        raise RuntimeError(f"Database write failed for {name}; stopping so the checkpoint stays valid.")
+                    rows_written += written
+                totals["db"] += time.perf_counter() - t0
+                if kind == "images":
+                    checkpoint.mark_image_batch(name)
+                checkpoint.save()
+            now = time.monotonic()
+            if now - last_report >= args.report_interval:
+                last_report = now
+                logger.info(f"Progress: {frames} frames, {rows_written} plates, {frames / (now - started):.1f} frames/s, "
+                            f"{len(pending)} tasks in flight.")
+        executor.shutdown()
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; progress is saved in the checkpoint. Run again to resume.")
+        return 130
+    except Exception as e: # A worker crash, a broken pool or a failed write
+        logger.error(f"Batch run stopped ({type(e).__name__}: {e}); progress up to the last commit is saved "
+                     f"in the checkpoint, run again to resume.")
+        return 1
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True) # No-op after a clean finish
+        conn.close()
+
+    elapsed = time.monotonic() - started
+    print_report(frames, rows_written, elapsed, totals, args.workers)
+    return 0
+
+
+def print_report(frames, plates, elapsed, totals, workers):
+    print(f"Processed {frames} frames in {elapsed:.1f}s with {workers} workers")
+    print(f"  throughput   {frames / elapsed if elapsed else 0.0:8.2f} frames/s  {plates / elapsed if elapsed else 0.0:8.2f} plates/s"
+          f"  ({plates} plates written)")
+    print("  stage time (summed over workers; db is in the main process):")
+    for stage in STAGES + ("db",):
+        per_frame = (totals[stage] / frames * 1000.0) if frames else 0.0
+        print(f"    {stage:7s} {totals[stage]:9.1f}s  {per_frame:8.2f} ms/frame")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="video files, image files or directories")
+    parser.add_argument("--db", default=db_utils.DB_NAME, help="database to write detections to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sample-fps", type=float, default=SAMPLE_FPS, help="video frames OCR'd per second of footage")
+    parser.add_argument("--chunk-seconds", type=float, default=CHUNK_SECONDS, help="seconds of video per task")
+    parser.add_argument("--image-batch", type=int, default=IMAGE_BATCH, help="images per task")
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE)
+    parser.add_argument("--track-timeout", type=float, default=plate_tracker.TRACK_TIMEOUT,
+                        help="seconds of video without a reading before a vehicle's track closes")
+    parser.add_argument("--start-time", default=None,
+                        help="ISO time the video starts at, single video only "
+                             "(default: each video's modification time minus its length)")
+    parser.add_argument("--no-localizer", action="store_true", help="OCR whole frames instead of plate crops")
+    parser.add_argument("--detector-model", default=None, help="ONNX plate detector for the localizer")
+    parser.add_argument("--full-frame-fallback", action="store_true")
+    parser.add_argument("--checkpoint", default=None, help=f"progress file (default: <db>{CHECKPOINT_SUFFIX})")
+    parser.add_argument("--no-checkpoint", action="store_true")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between progress log lines")
+    args = parser.parse_args(argv)
+    if args.start_time:
+        try:
+            datetime.fromisoformat(args.start_time)
+        except ValueError:
+            parser.error(f"--start-time: not an ISO time: {args.start_time!r}")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Compares the old per-row commit path with the batched AsyncPlateWriter.
+
+    python benchmarks/bench_db_writer.py [--rows 2000] [--dir /path/on/sd/card]
+
+Run it with --dir on the Pi's SD card: the difference comes from fsyncs, so
+a tmpfs or fast SSD understates it.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_utils # noqa: E402
+import db_writer # noqa: E402
+
+
+def _rows(n):
+    now = datetime.now().isoformat()
+    return [(f"KA01AB{i % 10000:04d}", now, 0.5 + (i % 50) / 100.0) for i in range(n)]
+
+
+def bench_per_row_commit(db_file, rows):
+    """db_utils.save_plate on a default (rollback journal, synchronous=FULL) connection."""
+    conn = db_utils.create_connection(db_file)
+    db_utils.create_table(conn)
+    start = time.perf_counter()
+    for plate, ts, conf in rows:
+        db_utils.save_plate(conn, plate, ts, conf)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed, elapsed
+
+
+def bench_async_writer(db_file, rows, batch_size):
+    """Time for submit() alone (what the sink thread pays) and until everything is committed."""
+    writer = db_writer.AsyncPlateWriter(db_file, batch_size=batch_size, flush_interval=0.5)
+    writer.start()
+    start = time.perf_counter()
+    for plate, ts, conf in rows:
+        writer.submit(plate, ts, conf)
+    submit_elapsed = time.perf_counter() - start
+    writer.flush(timeout=120)
+    total_elapsed = time.perf_counter() - start
+    writer.close()
+    return submit_elapsed, total_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=db_writer.BATCH_SIZE)
+    parser.add_argument("--dir", default=None, help="directory for the temporary databases")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    rows = _rows(args.rows)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        per_row, _ = bench_per_row_commit(os.path.join(tmp, "per_row.db"), rows)
+        submit, total = bench_async_writer(os.path.join(tmp, "batched.db"), rows, args.batch_size)
+
+    print(f"{args.rows} rows:")
+    print(f"  per-row commit        {args.rows / per_row:10.0f} rows/s  ({per_row / args.rows * 1e6:8.1f} us/row on the caller)")
+    print(f"  async writer, commit  {args.rows / total:10.0f} rows/s  (batch size {args.batch_size})")
+    print(f"  async writer, submit  {args.rows / submit:10.0f} rows/s  ({submit / args.rows * 1e6:8.1f} us/row on the caller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Compares the copy-based frame hand-off with the shared-memory frame ring.
+
+    python benchmarks/bench_frame_ring.py [--frames 300]
+
+For 720p and 1080p BGR frames it times:
+  - copy hand-off:    lock + reference store by the writer, getter .copy() and
+                      the extra frame.copy() before OCR (the old main_pi path)
+  - pickle to process: sending each frame to another process through a
+                      multiprocessing queue (what a process pool does with arrays)
+  - ring, in-process: SharedFrameRing.write() + zero-copy read() + is_valid()
+  - ring to process:  write() in this process, FrameRef through a queue, read()
+                      with one copy in the other process
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frame_ring # noqa: E402
+
+RESOLUTIONS = {"720p": (720, 1280, 3), "1080p": (1080, 1920, 3)}
+
+
+def bench_copy_handoff(frames):
+    lock = threading.Lock()
+    latest = None
+    start = time.perf_counter()
+    for frame in frames:
+        with lock:
+            latest = frame
+        with lock:
+            streamed = latest.copy() # get_latest_frame_for_flask()
+        ocr_input = frame.copy() # detect_plate_text(frame.copy(), ...)
+    del streamed, ocr_input
+    return time.perf_counter() - start
+
+
+def _pickle_consumer(q, done):
+    while True:
+        frame = q.get()
+        if frame is None:
+            break
+        done.put(frame.shape[0])
+
+
+def bench_pickle_to_process(frames):
+    ctx = multiprocessing.get_context("spawn")
+    q, done = ctx.Queue(maxsize=2), ctx.Queue()
+    proc = ctx.Process(target=_pickle_consumer, args=(q, done))
+    proc.start()
+    q.put(frames[0]); done.get() # Warm up
+    start = time.perf_counter()
+    for frame in frames:
+        q.put(frame)
+        done.get()
+    elapsed = time.perf_counter() - start
+    q.put(None)
+    proc.join()
+    return elapsed
+
+
+def bench_ring_in_process(frames):
+    ring = frame_ring.SharedFrameRing.create(frames[0].shape, slots=8, name=frame_ring.new_ring_name("bench"))
+    reader = frame_ring.SharedFrameRing.attach(ring.name)
+    try:
+        start = time.perf_counter()
+        for frame in frames:
+            ref = ring.write(frame)
+            view, _ = reader.read(ref.seq, copy=False)
+            checksum = int(view[0, 0, 0]) # Touch the view like an encoder would
+            assert reader.is_valid(ref.seq)
+        del view, checksum
+        return time.perf_counter() - start
+    finally:
+        reader.close()
+        ring.close()
+
+
+def _ring_consumer(q, done):
+    rings = {}
+    while True:
+        ref = q.get()
+        if ref is None:
+            break
+        ring = rings.get(ref.ring_name) or rings.setdefault(ref.ring_name, frame_ring.SharedFrameRing.attach(ref.ring_name))
+        result = ring.read(ref.seq)
+        done.put(result is not None)
+    for ring in rings.values():
+        ring.close()
+
+
+def bench_ring_to_process(frames):
+    ctx = multiprocessing.get_context("spawn")
+    ring = frame_ring.SharedFrameRing.create(frames[0].shape, slots=8, name=frame_ring.new_ring_name("bench"))
+    q, done = ctx.Queue(), ctx.Queue()
+    proc = ctx.Process(target=_ring_consumer, args=(q, done))
+    proc.start()
+    try:
+        q.put(ring.write(frames[0])); done.get() # Warm up / attach
+        start = time.perf_counter()
+        stale = 0
+        for frame in frames:
+            q.put(ring.write(frame))
+            if not done.get():
+                stale += 1
+        elapsed = time.perf_counter() - start
+        if stale:
+            print(f"  warning: {stale} frames were overwritten before the reader got them")
+        return elapsed
+    finally:
+        q.put(None)
+        proc.join()
+        ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=300, help="frames per measurement")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    benches = [
+        ("copy hand-off", bench_copy_handoff),
+        ("pickle to process", bench_pickle_to_process),
+        ("ring, in-process", bench_ring_in_process),
+        ("ring to process", bench_ring_to_process),
+    ]
+    for label, shape in RESOLUTIONS.items():
+        # A few distinct frames so caches do not flatter either side
+        pool = [rng.integers(0, 255, shape, dtype=np.uint8) for _ in range(4)]
+        frames = [pool[i % len(pool)] for i in range(args.frames)]
+        print(f"{label} ({shape[1]}x{shape[0]}, {frames[0].nbytes / 1e6:.1f} MB/frame), {args.frames} frames:")
+        for name, fn in benches:
+            elapsed = fn(frames)
+            per_frame_us = elapsed / len(frames) * 1e6
+            print(f"  {name:<18} {per_frame_us:9.1f} us/frame  {len(frames) / elapsed:9.1f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
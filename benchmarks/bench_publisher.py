@@ -0,0 +1,130 @@
+"""
+OutboundPublisher against a local broker that goes away and comes back.
+
+    python benchmarks/bench_publisher.py [--messages 300] [--rate 50] [--outage 3]
+
+Publishes numbered detections to an MQTT target and a batched ThingsBoard
+target while benchmarks/mqtt_stub_broker.py is stopped for --outage seconds in
+the middle, then checks that every message arrived, in order, and reports
+duplicates, spool depth, publish latency and how many publishes the
+ThingsBoard batching saved.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import publisher # noqa: E402
+from mqtt_stub_broker import MQTTStubBroker # noqa: E402
+
+MQTT_TOPIC = "rpi/plate_detection/plate"
+TB_TOPIC = "v1/devices/me/telemetry"
+
+
+def _client(name, port):
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=name)
+    else:
+        client = mqtt.Client(client_id=name)
+    client.reconnect_delay_set(min_delay=1, max_delay=2)
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    return client
+
+
+def _received_seqs(messages, topic):
+    seqs = []
+    for t, payload in messages:
+        if t != topic:
+            continue
+        data = json.loads(payload)
+        entries = [entry["values"] for entry in data] if isinstance(data, list) else [data]
+        seqs.extend(values["seq"] for values in entries)
+    return seqs
+
+
+def _check(name, seqs, expected):
+    unique = list(dict.fromkeys(seqs)) # First arrival of each message
+    missing = expected - len(unique)
+    in_order = unique == sorted(unique)
+    print(f"  {name:12s} {len(seqs)} received, {len(seqs) - len(unique)} duplicates, {missing} missing, "
+          f"{'in order' if in_order else 'OUT OF ORDER'}")
+    return missing == 0 and in_order
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=50.0, help="messages per second")
+    parser.add_argument("--outage", type=float, default=3.0, help="seconds the broker is down")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    broker = MQTTStubBroker(record=True).start()
+    port = broker.port
+    messages = broker.messages
+    clients = [_client("bench-plates", port), _client("bench-tb", port)]
+    time.sleep(0.5)
+    with tempfile.TemporaryDirectory() as tmp:
+        outbound = publisher.OutboundPublisher(os.path.join(tmp, "spool.db"), ack_timeout=1.0, retry_interval=1.0)
+        outbound.add_target("mqtt", clients[0], MQTT_TOPIC)
+        outbound.add_target("thingsboard", clients[1], TB_TOPIC, batch=True)
+        outbound.start()
+
+        outage_at, outage_end = args.messages // 3, None
+        submit_times = []
+        max_spool = 0
+        started = time.monotonic()
+        for seq in range(args.messages):
+            if seq == outage_at:
+                print(f"Broker down for {args.outage:.0f}s after {seq} messages...")
+                broker.stop()
+                outage_end = time.monotonic() + args.outage
+            if outage_end and time.monotonic() >= outage_end:
+                broker = MQTTStubBroker(port=port, record=True).start() # Same port, so the clients reconnect
+                broker.messages = messages
+                outage_end = None
+                print(f"Broker back after {seq} messages.")
+            t0 = time.perf_counter()
+            outbound.publish("mqtt", {"plate": f"KA01AB{seq:04d}", "seq": seq})
+            outbound.publish("thingsboard", {"plate": f"KA01AB{seq:04d}", "seq": seq})
+            submit_times.append(time.perf_counter() - t0)
+            stats = outbound.stats()
+            max_spool = max(max_spool, stats["mqtt"]["spool_depth"], stats["thingsboard"]["spool_depth"])
+            time.sleep(1.0 / args.rate)
+
+        deadline = time.monotonic() + 30.0 # Let the spool drain
+        while time.monotonic() < deadline:
+            stats = outbound.stats()
+            if not (stats["mqtt"]["spool_depth"] or stats["thingsboard"]["spool_depth"] or stats["queue_depth"]):
+                break
+            time.sleep(0.2)
+        elapsed = time.monotonic() - started
+        outbound.stop()
+        stats = outbound.stats()
+    for client in clients:
+        client.loop_stop()
+        client.disconnect()
+    broker.stop()
+
+    submit_times.sort()
+    print(f"{args.messages} messages per target in {elapsed:.1f}s; publish() p50 "
+          f"{submit_times[len(submit_times) // 2] * 1e6:.0f} us, max {submit_times[-1] * 1e6:.0f} us; "
+          f"spool peaked at {max_spool}")
+    for name in ("mqtt", "thingsboard"):
+        print(f"  {name:12s} {stats[name]}")
+    tb_publishes = sum(1 for t, _ in messages if t == TB_TOPIC)
+    print(f"  ThingsBoard: {tb_publishes} publishes for {args.messages} entries")
+    ok = _check("mqtt", _received_seqs(messages, MQTT_TOPIC), args.messages)
+    ok = _check("thingsboard", _received_seqs(messages, TB_TOPIC), args.messages) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
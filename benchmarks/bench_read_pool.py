@@ -0,0 +1,113 @@
+"""
+Dashboard read load with and without the read connection pool.
+
+    python benchmarks/bench_read_pool.py [--rows 100000] [--clients 8] [--seconds 5]
+
+Each client thread hammers /api/plates, /api/plates/search and /api/stats
+through Flask's test client while a db_writer.AsyncPlateWriter keeps
+committing detections, once with a connection opened per request
+(READ_POOL_SIZE = 0, the old behaviour) and once with the pool.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_utils # noqa: E402
+import db_writer # noqa: E402
+import flask_server # noqa: E402
+
+REQUESTS = [
+    "/api/plates?limit=50",
+    "/api/plates/search?q=AB12&mode=substring",
+    "/api/plates/search?q=KA0&mode=prefix",
+    "/api/stats?bucket=hour&from=0",
+]
+
+
+def _fill(db_file, rows):
+    conn = db_utils.create_connection(db_file)
+    db_utils.create_table(conn)
+    db_utils.configure_connection(conn)
+    start = datetime.now() - timedelta(seconds=rows)
+    batch = []
+    for i in range(rows):
+        batch.append((f"KA{i % 97:02d}AB{i % 9973:04d}", (start + timedelta(seconds=i)).isoformat(), 0.5 + (i % 50) / 100.0))
+        if len(batch) == 10000:
+            db_utils.save_plates(conn, batch)
+            batch = []
+    db_utils.save_plates(conn, batch)
+    conn.close()
+
+
+def _client(stop, latencies, errors):
+    client = flask_server.app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    i = 0
+    while not stop.is_set():
+        path = REQUESTS[i % len(REQUESTS)]
+        i += 1
+        start = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+def run(db_file, pool_size, clients, seconds):
+    flask_server.DB_NAME_FLASK = db_file
+    flask_server.READ_POOL_SIZE = pool_size
+    writer = db_writer.AsyncPlateWriter(db_file, batch_size=20, flush_interval=0.1)
+    writer.start()
+    stop = threading.Event()
+    latencies, errors = [], []
+    threads = [threading.Thread(target=_client, args=(stop, latencies, errors)) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    end = time.monotonic() + seconds
+    n = 0
+    while time.monotonic() < end:
+        writer.submit(f"WR{n % 1000:04d}", datetime.now().isoformat(), 0.9) # ~200 detections/s
+        n += 1
+        time.sleep(0.005)
+    stop.set()
+    for t in threads:
+        t.join()
+    writer.close()
+    latencies.sort()
+    return {
+        "rps": len(latencies) / seconds,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--pool-size", type=int, default=flask_server.READ_POOL_SIZE)
+    parser.add_argument("--dir", default=None, help="directory for the temporary database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        db_file = os.path.join(tmp, "plates.db")
+        _fill(db_file, args.rows)
+        print(f"{args.rows} rows, {args.clients} clients, {args.seconds:.0f}s each, writer committing alongside:")
+        for label, pool_size in (("connection per request", 0), (f"read pool ({args.pool_size})", args.pool_size)):
+            r = run(db_file, pool_size, args.clients, args.seconds)
+            print(f"  {label:24s} {r['rps']:8.0f} req/s   p50 {r['p50_ms']:6.1f} ms   p99 {r['p99_ms']:6.1f} ms"
+                  f"   errors {r['errors']}")
+
+
+if __name__ == "__main__":
+    main()
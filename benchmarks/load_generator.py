@@ -0,0 +1,179 @@
+"""
+Load generator for the laptop aggregator: many simulated Pis publishing plate events.
+
+    python benchmarks/load_generator.py [--devices 10] [--rate 2000] [--duration 10] [--drop 0.001]
+                                        [--host H --port P] [--no-aggregator] [--restart]
+
+Every device publishes events shaped like main_pi's ({"device", "boot", "seq",
+"plate", ...}) at QoS 1 on rpi/plate_detection/<device>/plate. --drop skips
+that fraction of sequence numbers, so the aggregator should report exactly
+those as gaps. Without --host a benchmarks/mqtt_stub_broker.py broker is
+started in-process; unless --no-aggregator is given, an Aggregator on a
+temporary database ingests the feed, and the run reports ingest throughput,
+commit batch sizes and whether the gaps found match the ones injected.
+
+--restart stops the aggregator for a second in the middle and starts a new
+one on the same database. Against a real broker (mosquitto) the persistent
+session delivers what was published meanwhile; the stub broker keeps no
+sessions, so those events come back as gaps.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aggregator # noqa: E402
+from mqtt_stub_broker import MQTTStubBroker # noqa: E402
+
+TOPIC = "rpi/plate_detection/{device}/plate"
+
+
+class SimulatedDevice(threading.Thread):
+    """One Pi: its own MQTT connection, a boot id and a sequence counter."""
+
+    def __init__(self, name, host, port, rate, duration, drop, seed):
+        super().__init__(name=name, daemon=True)
+        self.device = name
+        self.rate = rate
+        self.duration = duration
+        self.drop = drop
+        self.random = random.Random(seed)
+        self.boot = int(time.time() * 1000)
+        self.published = 0
+        self.skipped = 0
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"loadgen-{name}")
+        self.client.max_inflight_messages_set(1000)
+        self.client.connect(host, port)
+        self.client.loop_start()
+
+    def run(self):
+        topic = TOPIC.format(device=self.device)
+        seq = 0
+        start = time.monotonic()
+        while True:
+            elapsed = time.monotonic() - start
+            if elapsed >= self.duration:
+                break
+            due = int(elapsed * self.rate) - (self.published + self.skipped)
+            for _ in range(due):
+                seq += 1
+                if self.random.random() < self.drop:
+                    self.skipped += 1 # Lost on the way: the aggregator should see a gap here
+                    continue
+                event = {"device": self.device, "boot": self.boot, "seq": seq,
+                         "plate": f"KA{self.random.randint(0, 99):02d}AB{self.random.randint(0, 9999):04d}",
+                         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                         "confidence": round(self.random.uniform(0.6, 0.99), 2), "frame_count": 3}
+                self.client.publish(topic, json.dumps(event), qos=1)
+                self.published += 1
+            time.sleep(0.005)
+        # A trailing gap is only visible once a later message arrives, so always end on a delivered one
+        if self.skipped and self.published:
+            seq += 1
+            self.client.publish(topic, json.dumps({"device": self.device, "boot": self.boot, "seq": seq,
+                                                   "plate": "END0000", "confidence": 1.0}), qos=1)
+            self.published += 1
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=2000.0, help="messages per second over all devices")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of publishing")
+    parser.add_argument("--drop", type=float, default=0.001, help="fraction of sequence numbers to skip")
+    parser.add_argument("--host", help="broker to use instead of the in-process stub broker")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--no-aggregator", action="store_true", help="only publish")
+    parser.add_argument("--restart", action="store_true", help="restart the aggregator half way through")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    broker = None
+    if args.host is None:
+        broker = MQTTStubBroker(max_inflight=100).start()
+        host, port = "127.0.0.1", broker.port
+    else:
+        host, port = args.host, args.port
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "aggregated.db")
+        client_id = f"loadgen-aggregator-{os.getpid()}"
+        agg = None
+        if not args.no_aggregator:
+            agg = aggregator.Aggregator(db_file, host=host, port=port, client_id=client_id)
+            agg.start()
+            time.sleep(0.5) # Let it subscribe before the load starts
+
+        devices = [SimulatedDevice(f"pi{i:02d}", host, port, args.rate / args.devices, args.duration, args.drop,
+                                   args.seed + i) for i in range(args.devices)]
+        print(f"{args.devices} devices, {args.rate:.0f} msg/s for {args.duration:.0f}s, drop {args.drop}")
+        start = time.monotonic()
+        for device in devices:
+            device.start()
+
+        totals = []
+        if agg is not None and args.restart:
+            time.sleep(args.duration / 2)
+            totals.append(agg.stats())
+            agg.stop()
+            time.sleep(1.0)
+            agg = aggregator.Aggregator(db_file, host=host, port=port, client_id=client_id)
+            agg.start()
+            print("Aggregator restarted.")
+        for device in devices:
+            device.join()
+        published = sum(d.published for d in devices)
+        skipped = sum(d.skipped for d in devices)
+        publish_time = time.monotonic() - start
+        print(f"Published {published} messages in {publish_time:.1f}s ({published / publish_time:.0f}/s), "
+              f"skipped {skipped} sequence numbers")
+
+        if agg is not None:
+            # Wait for the writer to catch up
+            last, idle_since = -1, time.monotonic()
+            while time.monotonic() - idle_since < 2.0:
+                written = agg.stats()["rows_written"]
+                if written != last:
+                    last, idle_since = written, time.monotonic()
+                time.sleep(0.1)
+            ingest_time = idle_since - start
+            agg.stop()
+            stats = agg.stats()
+            for key in ("rows_written", "duplicates", "gaps_opened", "gap_messages", "batches"):
+                stats[key] += sum(t[key] for t in totals)
+            conn = aggregator.db_utils.create_connection(db_file)
+            stored = conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+            missing = conn.execute("SELECT COALESCE(SUM(last_seq - first_seq + 1), 0) FROM gaps").fetchone()[0]
+            conn.close()
+            print(f"Aggregator: {stored} rows stored, {stats['rows_written'] / ingest_time:.0f} rows/s, "
+                  f"avg {stats['avg_batch_messages']:.1f} messages per commit, "
+                  f"avg commit {stats['avg_commit_ms']:.2f} ms, {stats['duplicates']} duplicates")
+            print(f"Gaps: {stats['gaps_opened']} opened, {missing} sequence numbers missing in the store "
+                  f"(injected {skipped})")
+            ok = stored == published and missing == skipped
+            if args.restart:
+                print(f"Lost across the restart: {published - stored} (0 expected with a broker that keeps sessions)")
+                ok = stored + missing == published + skipped
+            print("OK" if ok else "MISMATCH")
+
+        for device in devices:
+            device.close()
+    if broker is not None:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Load test for the web server modes: memory and CPU per connected /video_feed viewer.
+
+    python benchmarks/load_test_stream.py [--modes threaded,asgi] [--viewers 1,10,20,40] [--seconds 10]
+                                          [--profile medium] [--sse 0] [--fps 20] [--output results.json]
+
+Every mode gets its own server process (flask_server.run_flask_app in that
+mode) fed with synthetic 640x480 frames at --fps. Viewers are added step by
+step up to each --viewers count; after a short warm-up the server's RSS,
+thread count and CPU use (from /proc, so Linux only) are sampled over
+--seconds, along with the frames each viewer actually received. --sse adds
+that many logged-in /api/plates/stream subscribers, with one event
+published per second. The summary reports the cost per viewer over the
+idle server.
+
+Viewers are asyncio sockets in this process, so on a single-core machine
+they compete with the server for the CPU; compare modes on the same host.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def serve(mode, port, fps):
+    """Server process: a fake camera feeding the broadcaster, the event hub ticking, then the web server."""
+    import logging
+
+    import cv2
+    import numpy as np
+
+    import flask_server
+    from frame_broadcaster import FrameBroadcaster
+    logging.getLogger().setLevel(logging.ERROR)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR) # No access log line per viewer
+
+    broadcaster = FrameBroadcaster(max_fps=fps)
+    base = cv2.GaussianBlur(np.random.default_rng(1).integers(0, 255, (480, 640, 3), dtype=np.uint8), (0, 0), 2)
+
+    def camera():
+        n = 0
+        while True:
+            frame = np.roll(base, n * 5, axis=1)
+            cv2.putText(frame, str(n), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+            broadcaster.publish(frame)
+            n += 1
+            time.sleep(1.0 / fps)
+
+    def events():
+        while True:
+            flask_server.get_event_hub().publish('plate', {"plate_number": "LOAD0001", "confidence": "0.90"})
+            time.sleep(1.0)
+
+    threading.Thread(target=camera, daemon=True).start()
+    threading.Thread(target=events, daemon=True).start()
+    flask_server.set_frame_broadcaster(broadcaster)
+    flask_server.run_flask_app("127.0.0.1", port, mode=mode)
+
+
+def _proc_sample(pid):
+    """(rss bytes, threads, cpu seconds) of a process."""
+    rss = threads = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith("Threads:"):
+                threads = int(line.split()[1])
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS # utime + stime
+    return rss, threads, cpu
+
+
+class Viewer:
+    """One streaming client: counts the bytes and MJPEG parts it receives."""
+
+    def __init__(self, port, path, cookie=None):
+        self.port = port
+        self.path = path
+        self.cookie = cookie
+        self.bytes = 0
+        self.parts = 0
+        self.status = None
+        self._tail = b""
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        headers = f"Cookie: {self.cookie}\r\n" if self.cookie else ""
+        writer.write(f"GET {self.path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n".encode())
+        try:
+            status_line = await reader.readline()
+            self.status = int(status_line.split()[1])
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                self.bytes += len(chunk)
+                data = self._tail + chunk
+                self.parts += data.count(b"--frame") - self._tail.count(b"--frame")
+                self._tail = data[-8:]
+        finally:
+            writer.close()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+async def _login(port):
+    """Session cookie of a logged-in admin (the default credentials)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = "username=admin&password=password"
+    writer.write(f"POST /login HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/x-www-form-urlencoded\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n{body}".encode())
+    response = (await reader.read()).decode("latin-1")
+    writer.close()
+    for line in response.split("\r\n"):
+        if line.lower().startswith("set-cookie:"):
+            return line.split(":", 1)[1].split(";", 1)[0].strip()
+    raise RuntimeError("Login failed")
+
+
+async def run_mode(mode, args):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port),
+                               "--fps", str(args.fps)])
+    viewers = []
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"{mode} server did not start")
+                await asyncio.sleep(0.2)
+
+        subscribers = []
+        if args.sse:
+            cookie = await _login(port)
+            subscribers = [Viewer(port, "/api/plates/stream", cookie) for _ in range(args.sse)]
+            for subscriber in subscribers:
+                subscriber.start()
+
+        query = f"?profile={args.profile}" if args.profile else ""
+        steps = []
+        for count in [0] + args.viewers:
+            while len(viewers) < count:
+                viewer = Viewer(port, f"/video_feed{query}")
+                viewer.start()
+                viewers.append(viewer)
+            await asyncio.sleep(args.warmup)
+            parts_before = [v.parts for v in viewers]
+            bytes_before = sum(v.bytes for v in viewers)
+            rss, threads, cpu_before = _proc_sample(server.pid)
+            start = time.monotonic()
+            await asyncio.sleep(args.seconds)
+            elapsed = time.monotonic() - start
+            rss, threads, cpu_after = _proc_sample(server.pid)
+            fps = [(v.parts - before) / elapsed for v, before in zip(viewers, parts_before)]
+            step = {
+                "viewers": count,
+                "rss_mb": rss / 1048576,
+                "threads": threads,
+                "cpu_percent": (cpu_after - cpu_before) / elapsed * 100.0,
+                "viewer_fps_avg": sum(fps) / len(fps) if fps else 0.0,
+                "viewer_fps_min": min(fps) if fps else 0.0,
+                "mbit_per_s": (sum(v.bytes for v in viewers) - bytes_before) * 8 / elapsed / 1e6,
+                "rejected": sum(1 for v in viewers if v.status not in (None, 200)),
+            }
+            steps.append(step)
+            print(f"  {mode:9s} {count:4d} viewers: RSS {step['rss_mb']:6.1f} MB, {threads:4d} threads, "
+                  f"CPU {step['cpu_percent']:5.1f}%, {step['viewer_fps_avg']:5.1f} FPS/viewer "
+                  f"(min {step['viewer_fps_min']:.1f}), {step['mbit_per_s']:.1f} Mbit/s"
+                  + (f", {step['rejected']} turned away" if step["rejected"] else ""), flush=True)
+        idle, top = steps[0], steps[-1]
+        per_viewer = {
+            "rss_kb": (top["rss_mb"] - idle["rss_mb"]) * 1024 / max(1, top["viewers"]),
+            "threads": (top["threads"] - idle["threads"]) / max(1, top["viewers"]),
+            "cpu_percent": (top["cpu_percent"] - idle["cpu_percent"]) / max(1, top["viewers"]),
+        }
+        ok = sum(1 for s in subscribers if s.status == 200 and s.bytes)
+        viewers += subscribers
+        return {"steps": steps, "per_viewer": per_viewer, "sse_subscribers_ok": ok}
+    finally:
+        for viewer in viewers:
+            viewer.stop()
+        await asyncio.sleep(0.5) # Let the connections close before the server is stopped
+        server.terminate()
+        server.wait(10)
+
+
+async def run(args):
+    results = {}
+    for mode in args.modes:
+        print(f"{mode}:")
+        results[mode] = await run_mode(mode, args)
+    print("\nPer viewer, over the idle server:")
+    for mode, result in results.items():
+        p = result["per_viewer"]
+        print(f"  {mode:9s} {p['rss_kb']:8.0f} KB RSS, {p['threads']:5.2f} threads, {p['cpu_percent']:5.2f}% CPU"
+              + (f"; {result['sse_subscribers_ok']}/{args.sse} event streams OK" if args.sse else ""))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="threaded,asgi", help="comma-separated server modes")
+    parser.add_argument("--viewers", default="1,10,20,40", help="comma-separated viewer counts, one step each")
+    parser.add_argument("--seconds", type=float, default=10.0, help="measurement time per step")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds after adding viewers before measuring")
+    parser.add_argument("--profile", help="stream profile the viewers ask for (default: the server's)")
+    parser.add_argument("--sse", type=int, default=0, help="event stream subscribers kept open throughout")
+    parser.add_argument("--fps", type=int, default=20, help="frames per second published by the fake camera")
+    parser.add_argument("--output", "-o", help="write the results as JSON")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.fps)
+        return
+    args.modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    args.viewers = sorted(int(v) for v in args.viewers.split(","))
+
+    results = asyncio.run(run(args))
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": {"hostname": platform.node(), "platform": platform.platform(),
+                            "cpu_count": os.cpu_count(), "python": platform.python_version()},
+            "parameters": {k: getattr(args, k) for k in ("viewers", "seconds", "warmup", "profile", "sse", "fps")},
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
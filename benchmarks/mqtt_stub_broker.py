@@ -0,0 +1,263 @@
+"""
+Minimal local MQTT 3.1.1 broker for benchmarks, so publish timings don't depend
+on a real broker or the network.
+
+    python benchmarks/mqtt_stub_broker.py [--port 1883] [--ack-delay-ms 0] [--max-inflight 20]
+
+Handles CONNECT, PUBLISH (QoS 0/1/2), SUBSCRIBE/UNSUBSCRIBE, PINGREQ and
+DISCONNECT. Published messages are counted (and kept with record=True) and
+forwarded to matching subscribers at the lower of the publish and subscription
+QoS (0 or 1). Like mosquitto's max_inflight_messages, at most --max-inflight
+QoS 1 messages per subscriber wait for a PUBACK; further publishes wait for a
+slot, so a subscriber that acknowledges slowly slows its publishers down.
+There are no retained messages, stored sessions or authentication.
+--ack-delay-ms holds back every acknowledgement to imitate a network round trip.
+"""
+import argparse
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def _encode_length(n):
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def _packet(packet_type, body=b"", flags=0):
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _read_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("client closed the connection")
+        buf += chunk
+    return bytes(buf)
+
+
+def _read_packet(sock):
+    """Returns (type, flags, body) of the next packet on sock."""
+    header = _read_exact(sock, 1)[0]
+    length, shift = 0, 0
+    while True:
+        byte = _read_exact(sock, 1)[0]
+        length += (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return header >> 4, header & 0x0F, _read_exact(sock, length) if length else b""
+
+
+def _read_string(body, offset):
+    (n,) = struct.unpack_from("!H", body, offset)
+    return body[offset + 2:offset + 2 + n].decode("utf-8"), offset + 2 + n
+
+
+def _string(text):
+    data = text.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def topic_matches(pattern, topic):
+    """MQTT topic filter match with + and # wildcards."""
+    p_parts, t_parts = pattern.split("/"), topic.split("/")
+    for i, part in enumerate(p_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts) or (part != "+" and part != t_parts[i]):
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.subscriptions = {} # Topic filter -> granted QoS
+        self.inflight = threading.BoundedSemaphore(self.server.broker.max_inflight)
+        self.inflight_ids = set()
+        self.next_id = 0
+        self.closed = False
+
+    def forward(self, topic, payload, qos):
+        """Sends a PUBLISH to this subscriber; QoS 1 waits for a free in-flight slot first."""
+        if not qos:
+            self.send(_packet(PUBLISH, _string(topic) + payload))
+            return True
+        while not self.inflight.acquire(timeout=0.5):
+            if self.closed:
+                return False
+        with self.send_lock:
+            self.next_id = self.next_id % 65535 + 1
+            packet_id = self.next_id
+            self.inflight_ids.add(packet_id)
+            self.request.sendall(_packet(PUBLISH, _string(topic) + struct.pack("!H", packet_id) + payload, flags=0x02))
+        return True
+
+    def send(self, data):
+        with self.send_lock:
+            self.request.sendall(data)
+
+    def ack(self, data):
+        delay = self.server.broker.ack_delay
+        if delay:
+            time.sleep(delay)
+        self.send(data)
+
+    def handle(self):
+        broker = self.server.broker
+        broker._add_client(self)
+        try:
+            while True:
+                packet_type, flags, body = _read_packet(self.request)
+                if packet_type == CONNECT:
+                    self.ack(_packet(CONNACK, b"\x00\x00"))
+                elif packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic, offset = _read_string(body, 0)
+                    packet_id = body[offset:offset + 2]
+                    payload = body[offset + 2:] if qos else body[offset:]
+                    broker._received(topic, payload, qos)
+                    if qos == 1:
+                        self.ack(_packet(PUBACK, packet_id))
+                    elif qos == 2:
+                        self.ack(_packet(PUBREC, packet_id))
+                elif packet_type == PUBACK:
+                    (packet_id,) = struct.unpack("!H", body[:2])
+                    with self.send_lock:
+                        known = packet_id in self.inflight_ids
+                        self.inflight_ids.discard(packet_id)
+                    if known:
+                        self.inflight.release()
+                elif packet_type == PUBREL:
+                    self.ack(_packet(PUBCOMP, body[:2]))
+                elif packet_type == SUBSCRIBE:
+                    offset, granted = 2, bytearray()
+                    while offset < len(body):
+                        topic, offset = _read_string(body, offset)
+                        granted.append(min(body[offset], 1)) # QoS 2 is downgraded to 1
+                        offset += 1
+                        self.subscriptions[topic] = granted[-1]
+                    self.ack(_packet(SUBACK, body[:2] + bytes(granted)))
+                elif packet_type == UNSUBSCRIBE:
+                    offset = 2
+                    while offset < len(body):
+                        topic, offset = _read_string(body, offset)
+                        self.subscriptions.pop(topic, None)
+                    self.ack(_packet(UNSUBACK, body[:2]))
+                elif packet_type == PINGREQ:
+                    self.send(_packet(PINGRESP))
+                elif packet_type == DISCONNECT:
+                    return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+            broker._remove_client(self)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MQTTStubBroker:
+    """Local MQTT broker on a background thread; port=0 picks a free port."""
+
+    def __init__(self, host="127.0.0.1", port=0, ack_delay_ms=0.0, record=False, max_inflight=20):
+        self.ack_delay = ack_delay_ms / 1000.0
+        self.max_inflight = max_inflight
+        self.record = record
+        self.messages = [] # (topic, payload) in arrival order when record is set
+        self._server = _Server((host, port), _ClientHandler)
+        self._server.broker = self
+        self.host, self.port = self._server.server_address
+        self._thread = None
+        self._lock = threading.Lock()
+        self._clients = set()
+        self.messages_received = 0
+        self.bytes_received = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mqtt-stub-broker", daemon=True)
+        self._thread.start()
+        logger.info(f"MQTT stub broker listening on {self.host}:{self.port}.")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+
+    def _add_client(self, client):
+        with self._lock:
+            self._clients.add(client)
+
+    def _remove_client(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def _received(self, topic, payload, qos=0):
+        with self._lock:
+            self.messages_received += 1
+            self.bytes_received += len(payload)
+            if self.record:
+                self.messages.append((topic, payload))
+            subscribers = []
+            for client in self._clients:
+                granted = [q for s, q in client.subscriptions.items() if topic_matches(s, topic)]
+                if granted:
+                    subscribers.append((client, min(qos, max(granted))))
+        for client, forward_qos in subscribers:
+            try:
+                client.forward(topic, payload, forward_qos)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._clients), "messages_received": self.messages_received,
+                    "bytes_received": self.bytes_received}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--ack-delay-ms", type=float, default=0.0)
+    parser.add_argument("--max-inflight", type=int, default=20, help="unacknowledged QoS 1 messages per subscriber")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    broker = MQTTStubBroker(args.host, args.port, args.ack_delay_ms, max_inflight=args.max_inflight).start()
+    try:
+        while True:
+            time.sleep(10)
+            logger.info(f"Broker stats: {broker.stats()}")
+    except KeyboardInterrupt:
+        broker.stop()
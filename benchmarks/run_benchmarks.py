@@ -0,0 +1,692 @@
+"""
+Benchmark suite for the detection stack: every stage timed on its own, plus
+the end-to-end loop.
+
+    python benchmarks/run_benchmarks.py [--output results.json] [--baseline old.json]
+    python benchmarks/run_benchmarks.py --frames recording.mp4 --ocr real
+    python benchmarks/run_benchmarks.py --compare old.json new.json [--threshold 0.1]
+
+Stages: frame copy, JPEG encoding through flask_server.generate_frames, plate
+text cleaning, plate localization, OCR (pipeline.run_ocr), db_utils.save_plate
+and the dashboard read queries, MQTT publish at QoS 0/1, and the capture ->
+OCR -> tracker -> writer/MQTT loop of main_pi (end_to_end).
+
+Frames are synthetic (seeded, so every run sees the same pixels) unless
+--frames points at a video or an image folder. OCR uses a deterministic
+stand-in engine by default, so runs are comparable without EasyOCR or a GPU;
+--ocr real loads the actual reader. MQTT goes to benchmarks/mqtt_stub_broker.py
+on localhost unless --mqtt-host is given.
+
+Results are written as JSON together with machine metadata. With --baseline
+(or --compare for two saved files) the p50 latencies and end-to-end
+throughput are compared and the exit code is 1 if any got worse by more than
+--threshold. A p50 change whose repeats overlap those of the baseline is
+reported as noise rather than a regression.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_utils # noqa: E402
+import db_writer # noqa: E402
+import flask_server # noqa: E402
+import ocr_utils # noqa: E402
+import pipeline # noqa: E402
+import plate_localizer # noqa: E402
+import plate_tracker # noqa: E402
+from frame_broadcaster import FrameBroadcaster # noqa: E402
+from mqtt_stub_broker import MQTTStubBroker # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+FRAME_SIZE = (1280, 720)
+FRAME_COUNT = 8 # Distinct synthetic frames (one plate each)
+SEED = 1
+MIN_TIME = 0.5 # seconds per repeat of a micro benchmark (after warm-up)
+MIN_RUNS = 20
+REPEAT = 3 # The repeat with the median p50 is reported, which damps one-off hiccups
+MAX_RUNS = 100000
+WARMUP_RUNS = 3
+DB_ROWS = 50000 # Rows in the database the read queries run against
+E2E_SECONDS = 10.0
+E2E_CAMERA_FPS = 15.0
+E2E_OCR_MS = 25.0 # Simulated inference time of the stand-in engine in the end-to-end loop
+E2E_HOLD_FRAMES = 30 # Frames each synthetic vehicle stays in view
+REGRESSION_THRESHOLD = 0.10
+MQTT_TOPIC = "benchmarks/plates"
+# --- End Defaults ---
+
+# Metrics compared against a baseline, with +1 when higher is better and -1 when lower is
+CHECKED_METRICS = {"p50_us": -1, "processed_fps": 1, "latency_p50_ms": -1}
+
+# Raw strings as OCR returns them (spacing, punctuation, lower case) for the cleaning stage
+RAW_READINGS = ["KA 01 AB 1234", "ka-05-mh-9876", "DL3C.AY.4521", "MH 12 DE 1433", "TN 07 BZ 0042",
+                "KA01AB1234 ", "  HR26 DK 8337", "[UP 16 BT 7782]", "GJ-01-KA-5555", "AP 09 CD 1010"]
+
+
+class StandInOCR:
+    """
+    Deterministic replacement for the EasyOCR reader: the same image always gives the
+    same reading (picked by CRC of the pixels), after latency_ms of simulated inference.
+    """
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.calls = 0
+
+    def read(self, image):
+        self.calls += 1
+        key = zlib.crc32(np.ascontiguousarray(image[::8, ::8]).tobytes())
+        if self.latency:
+            time.sleep(self.latency) # Releases the GIL like the real inference does
+        h, w = image.shape[:2]
+        return [([[0, 0], [w, 0], [w, h], [0, h]], RAW_READINGS[key % len(RAW_READINGS)], 0.5 + (key % 50) / 100.0)]
+
+
+def install_stand_in_ocr(latency_ms=0.0):
+    engine = StandInOCR(latency_ms)
+    ocr_utils.get_ocr_reader = lambda: engine
+    ocr_utils.detect_plate_text = lambda image, reader: reader.read(image)
+    return engine
+
+
+def set_ocr_options(options):
+    """(Re)initializes this process's OCR stage with new pipeline options."""
+    pipeline._plate_localizer = None
+    pipeline._ocr_cache = None
+    return pipeline.init_ocr_worker(options)
+
+
+# --- Frames ---
+
+def synthetic_frames(count=FRAME_COUNT, size=FRAME_SIZE, seed=SEED):
+    """One frame per vehicle: textured road with a dark-on-white plate at a seeded position."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    frames = []
+    for i in range(count):
+        gradient = np.linspace(60, 140, height, dtype=np.float32)[:, None]
+        noise = rng.normal(0, 6, (height, width)).astype(np.float32)
+        gray = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+        frame = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        pw, ph = width // 6, width // 26
+        x = int(rng.integers(width // 8, width - pw - width // 8))
+        y = int(rng.integers(height // 2, height - ph - height // 10))
+        cv2.rectangle(frame, (x, y), (x + pw, y + ph), (235, 235, 235), -1)
+        text = "".join(ch for ch in RAW_READINGS[i % len(RAW_READINGS)].upper() if ch.isalnum())
+        (tw, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1.0, 2)
+        cv2.putText(frame, text, (x + 8, y + int(ph * 0.75)), cv2.FONT_HERSHEY_SIMPLEX, (pw - 16) / tw, (15, 15, 15), 2)
+        frames.append(frame)
+    return frames
+
+
+def load_frames(path, count):
+    """Up to count frames from a video file or an image folder."""
+    frames = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            frame = cv2.imread(os.path.join(path, name))
+            if frame is not None:
+                frames.append(frame)
+            if len(frames) >= count:
+                break
+    else:
+        cap = cv2.VideoCapture(path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        step = max(1, total // count) if total else 1 # Spread over the recording
+        index = 0
+        while len(frames) < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if index % step == 0:
+                frames.append(frame)
+            index += 1
+        cap.release()
+    if not frames:
+        raise SystemExit(f"No frames could be read from {path}")
+    return frames
+
+
+# --- Measurement ---
+
+def summarize(samples):
+    """Latency statistics in microseconds for a list of per-call durations in seconds."""
+    samples = sorted(samples)
+    n = len(samples)
+    total = sum(samples)
+    return {
+        "runs": n,
+        "mean_us": total / n * 1e6,
+        "p50_us": samples[n // 2] * 1e6,
+        "p95_us": samples[min(n - 1, int(n * 0.95))] * 1e6,
+        "p99_us": samples[min(n - 1, int(n * 0.99))] * 1e6,
+        "min_us": samples[0] * 1e6,
+        "ops_per_s": n / total if total else 0.0,
+    }
+
+
+def measure(fn, inputs, min_time=MIN_TIME, min_runs=MIN_RUNS, repeat=REPEAT, max_runs=MAX_RUNS, warmup=WARMUP_RUNS):
+    """
+    Calls fn(input) round-robin over inputs until min_time and min_runs are both reached,
+    repeat times; returns the repeat with the median p50 (plus the p50 spread across repeats).
+    """
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    summaries = []
+    for _ in range(repeat):
+        gc.collect()
+        samples = []
+        started = time.perf_counter()
+        i = 0
+        while i < max_runs and (i < min_runs or time.perf_counter() - started < min_time):
+            item = inputs[i % len(inputs)]
+            t0 = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - t0)
+            i += 1
+        summaries.append(summarize(samples))
+    summaries.sort(key=lambda r: r["p50_us"])
+    result = summaries[len(summaries) // 2]
+    result["p50_range_us"] = [summaries[0]["p50_us"], summaries[-1]["p50_us"]]
+    return result
+
+
+# --- Stage benchmarks (each takes the shared context and returns a result dict) ---
+
+def bench_frame_copy(ctx):
+    return measure(lambda frame: frame.copy(), ctx.frames, **ctx.timing)
+
+
+def bench_jpeg_encode(ctx):
+    """One frame through the broadcaster and out of flask_server.generate_frames as an MJPEG part."""
+    broadcaster = FrameBroadcaster(max_fps=0)
+    flask_server.app.processing_active = True
+    stream = flask_server.generate_frames(broadcaster)
+    sizes = []
+
+    def encode(frame):
+        broadcaster.publish(frame)
+        sizes.append(len(next(stream)))
+
+    result = measure(encode, ctx.frames, **ctx.timing)
+    stream.close()
+    result["avg_part_kb"] = sum(sizes) / len(sizes) / 1024.0
+    return result
+
+
+def bench_clean_text(ctx):
+    return measure(ocr_utils.clean_plate_text, RAW_READINGS, **ctx.timing)
+
+
+def bench_localizer(ctx):
+    localizer = plate_localizer.PlateLocalizer()
+    counts = []
+    result = measure(lambda frame: counts.append(len(localizer.locate(frame))), ctx.frames, **ctx.timing)
+    result["avg_candidates"] = sum(counts) / len(counts)
+    return result
+
+
+def _bench_ocr(ctx, options):
+    set_ocr_options(options)
+    counts = []
+    result = measure(lambda frame: counts.append(len(pipeline.run_ocr(frame))), ctx.frames, **ctx.ocr_timing)
+    result["avg_detections"] = sum(counts) / len(counts)
+    return result
+
+
+def bench_ocr_full_frame(ctx):
+    return _bench_ocr(ctx, {})
+
+
+def bench_ocr_localized(ctx):
+    return _bench_ocr(ctx, {"localizer": {}, "full_frame_fallback": False})
+
+
+def bench_db_save_plate(ctx):
+    conn = db_utils.create_connection(ctx.db_file)
+    db_utils.configure_connection(conn)
+    now = datetime.now()
+    counter = iter(range(MAX_RUNS + WARMUP_RUNS))
+
+    def save(plate):
+        i = next(counter)
+        db_utils.save_plate(conn, plate, (now + timedelta(milliseconds=i)).isoformat(), 0.9)
+
+    plates = [ocr_utils.clean_plate_text(r) for r in RAW_READINGS]
+    result = measure(save, plates, **ctx.timing)
+    conn.close()
+    return result
+
+
+def _bench_db_read(ctx, query):
+    conn = db_utils.create_connection(ctx.db_file)
+    db_utils.configure_connection(conn)
+    result = measure(lambda _: query(conn), [None], **ctx.timing)
+    conn.close()
+    return result
+
+
+def bench_db_recent_plates(ctx):
+    return _bench_db_read(ctx, lambda conn: db_utils.get_recent_plates(conn, 10))
+
+
+def bench_db_plates_page(ctx):
+    return _bench_db_read(ctx, lambda conn: db_utils.get_plates_page(conn, limit=50))
+
+
+def bench_db_search_prefix(ctx):
+    return _bench_db_read(ctx, lambda conn: db_utils.search_plates(conn, "KA0", mode="prefix"))
+
+
+def bench_db_search_substring(ctx):
+    return _bench_db_read(ctx, lambda conn: db_utils.search_plates(conn, "AB12", mode="substring"))
+
+
+def bench_db_rollups(ctx):
+    day_ago = int((time.time() - 86400) * 1000)
+    return _bench_db_read(ctx, lambda conn: db_utils.get_rollups(conn, "hour", start=day_ago))
+
+
+def _mqtt_client(ctx):
+    import paho.mqtt.client as mqtt
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-{os.getpid()}")
+    else:
+        client = mqtt.Client(client_id=f"bench-{os.getpid()}")
+    client.connect(ctx.mqtt_host, ctx.mqtt_port)
+    client.loop_start()
+    deadline = time.monotonic() + 5.0
+    while not client.is_connected() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    if not client.is_connected():
+        client.loop_stop()
+        raise RuntimeError(f"Could not connect to the MQTT broker at {ctx.mqtt_host}:{ctx.mqtt_port}")
+    return client
+
+
+def _plate_payload(plate):
+    """Same shape as main_pi's plate_data_dict."""
+    now = datetime.now().isoformat()
+    return json.dumps({"plate": plate, "timestamp": now, "confidence": 0.93, "first_seen": now,
+                       "last_seen": now, "frame_count": 12})
+
+
+def _bench_mqtt(ctx, qos):
+    client = _mqtt_client(ctx)
+    plates = [ocr_utils.clean_plate_text(r) for r in RAW_READINGS]
+
+    def publish(plate):
+        info = client.publish(MQTT_TOPIC, _plate_payload(plate), qos=qos)
+        if qos:
+            info.wait_for_publish(5.0) # Until the broker's PUBACK
+
+    try:
+        return measure(publish, plates, **ctx.timing)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+def bench_mqtt_publish_qos0(ctx):
+    return _bench_mqtt(ctx, 0)
+
+
+def bench_mqtt_publish_qos1(ctx):
+    return _bench_mqtt(ctx, 1)
+
+
+def bench_end_to_end(ctx):
+    """
+    main_pi's loop on a paced synthetic camera: capture -> DetectionPipeline (thread mode) ->
+    clean -> PlateTracker -> AsyncPlateWriter + MQTT, with one MJPEG viewer attached.
+    """
+    engine = ocr_utils.get_ocr_reader()
+    if isinstance(engine, StandInOCR):
+        engine.latency = ctx.e2e_ocr_ms / 1000.0
+    set_ocr_options({"localizer": {}, "full_frame_fallback": True})
+    broadcaster = FrameBroadcaster()
+    flask_server.app.processing_active = True
+    writer = db_writer.AsyncPlateWriter(ctx.db_file)
+    writer.start()
+    client = _mqtt_client(ctx)
+    tracker = plate_tracker.PlateTracker()
+    stop = threading.Event()
+    latencies, events = [], []
+    frame_interval = 1.0 / ctx.camera_fps
+    next_due = time.monotonic()
+    captured = [0]
+
+    def capture():
+        nonlocal next_due
+        delay = next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        next_due = max(next_due + frame_interval, time.monotonic() - frame_interval)
+        frame = ctx.frames[(captured[0] // ctx.hold_frames) % len(ctx.frames)]
+        captured[0] += 1
+        broadcaster.publish(frame)
+        return frame
+
+    def emit(event):
+        timestamp = datetime.fromtimestamp(event.first_seen).isoformat()
+        writer.submit(event.text, timestamp, event.peak_confidence)
+        client.publish(MQTT_TOPIC, _plate_payload(event.text), qos=1)
+        events.append(event)
+
+    def sink(item, detections):
+        readings = []
+        for bbox, text, prob in detections:
+            cleaned = ocr_utils.clean_plate_text(text)
+            if cleaned:
+                readings.append((bbox, cleaned, float(prob)))
+        for event in tracker.update(readings, item.captured_at):
+            emit(event)
+        latencies.append(time.time() - item.captured_at)
+
+    def idle(now):
+        for event in tracker.expire(now):
+            emit(event)
+
+    def viewer():
+        stream = flask_server.generate_frames(broadcaster)
+        while not stop.is_set():
+            next(stream)
+        stream.close()
+
+    detection = pipeline.DetectionPipeline(capture, sink, idle_fn=idle, ocr_workers=ctx.ocr_workers)
+    viewer_thread = threading.Thread(target=viewer, daemon=True)
+    viewer_thread.start()
+    started = time.monotonic()
+    detection.start()
+    time.sleep(ctx.e2e_seconds)
+    detection.stop()
+    elapsed = time.monotonic() - started
+    for event in tracker.flush():
+        emit(event)
+    stop.set()
+    writer.close()
+    client.loop_stop()
+    client.disconnect()
+    viewer_thread.join(2.0)
+
+    stats = detection.stats()
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "seconds": elapsed,
+        "capture_fps": stats["frames_captured"] / elapsed,
+        "processed_fps": stats["frames_processed"] / elapsed,
+        "frames_dropped": stats["frames_dropped"],
+        "latency_p50_ms": latencies[n // 2] * 1000 if n else 0.0,
+        "latency_p95_ms": latencies[min(n - 1, int(n * 0.95))] * 1000 if n else 0.0,
+        "stream_frames_encoded": broadcaster.frames_encoded,
+        "events": len(events),
+        "rows_written": writer.stats()["rows_written"],
+        "ocr_workers": ctx.ocr_workers,
+        "ocr_ms": ctx.e2e_ocr_ms if isinstance(engine, StandInOCR) else None,
+    }
+
+
+BENCHMARKS = {
+    "frame_copy": bench_frame_copy,
+    "jpeg_encode": bench_jpeg_encode,
+    "clean_text": bench_clean_text,
+    "localizer": bench_localizer,
+    "ocr_full_frame": bench_ocr_full_frame,
+    "ocr_localized": bench_ocr_localized,
+    "db_save_plate": bench_db_save_plate,
+    "db_recent_plates": bench_db_recent_plates,
+    "db_plates_page": bench_db_plates_page,
+    "db_search_prefix": bench_db_search_prefix,
+    "db_search_substring": bench_db_search_substring,
+    "db_rollups": bench_db_rollups,
+    "mqtt_publish_qos0": bench_mqtt_publish_qos0,
+    "mqtt_publish_qos1": bench_mqtt_publish_qos1,
+    "end_to_end": bench_end_to_end,
+}
+
+
+# --- Metadata, output and comparison ---
+
+def _cpu_model():
+    try:
+        with open("/proc/device-tree/model") as f: # Raspberry Pi board name
+            return f.read().strip("\x00\n ")
+    except OSError:
+        pass
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.lower().startswith(("model name", "hardware")):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def machine_metadata():
+    try:
+        import paho.mqtt
+        paho_version = paho.mqtt.__version__
+    except ImportError:
+        paho_version = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_model": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "load_avg": os.getloadavg() if hasattr(os, "getloadavg") else None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "paho_mqtt": paho_version,
+        "git_commit": _git_commit(),
+    }
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Prints a comparison table; returns the list of (benchmark, metric, change) regressions."""
+    for key in ("machine", "cpu_model", "opencv", "python"):
+        old, new = baseline["meta"].get(key), current["meta"].get(key)
+        if old != new:
+            print(f"note: {key} differs ({old} -> {new}); timings may not be comparable")
+    regressions = []
+    print(f"{'benchmark':22s} {'metric':15s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for name, result in current["results"].items():
+        old_result = baseline["results"].get(name)
+        if not old_result or "error" in result or "error" in old_result:
+            continue
+        for metric, direction in CHECKED_METRICS.items():
+            old, new = old_result.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change * direction # > 0 means worse in either direction
+            flag = "REGRESSION" if worse > threshold else ("improved" if -worse > threshold else "")
+            range_key = metric.replace("_us", "_range_us")
+            old_range, new_range = old_result.get(range_key), result.get(range_key)
+            if flag and old_range and new_range and new_range[0] <= old_range[1] and old_range[0] <= new_range[1]:
+                flag = "(noisy)" # Repeats of the two runs overlap, so the change is within run-to-run noise
+            if flag == "REGRESSION":
+                regressions.append((name, metric, change))
+            print(f"{name:22s} {metric:15s} {old:12.1f} {new:12.1f} {change * 100:+7.1f}% {flag}")
+    print(f"{len(regressions)} regression(s) beyond {threshold * 100:.0f}%.")
+    return regressions
+
+
+def print_results(results):
+    for name, r in results.items():
+        if "error" in r:
+            print(f"  {name:22s} ERROR: {r['error']}")
+        elif "p50_us" in r:
+            print(f"  {name:22s} p50 {r['p50_us']:10.1f} us   p95 {r['p95_us']:10.1f} us   "
+                  f"{r['ops_per_s']:10.0f} ops/s   ({r['runs']} runs)")
+        else:
+            print(f"  {name:22s} {r['processed_fps']:.1f} frames/s OCR'd of {r['capture_fps']:.1f} captured, "
+                  f"latency p50 {r['latency_p50_ms']:.0f} ms / p95 {r['latency_p95_ms']:.0f} ms, "
+                  f"{r['frames_dropped']} dropped, {r['events']} events")
+
+
+def _fill_db(db_file, rows):
+    conn = db_utils.create_connection(db_file)
+    db_utils.create_table(conn)
+    db_utils.configure_connection(conn)
+    start = datetime.now() - timedelta(seconds=rows)
+    batch = []
+    for i in range(rows):
+        batch.append((f"KA{i % 97:02d}AB{i % 9973:04d}", (start + timedelta(seconds=i)).isoformat(),
+                      0.5 + (i % 50) / 100.0))
+        if len(batch) == 10000:
+            db_utils.save_plates(conn, batch)
+            batch = []
+    db_utils.save_plates(conn, batch)
+    conn.close()
+
+
+class Context:
+    """Everything the stage benchmarks share: frames, database, broker and timing settings."""
+
+    def __init__(self, args, frames, db_file, mqtt_host, mqtt_port):
+        self.frames = frames
+        self.db_file = db_file
+        self.mqtt_host = mqtt_host
+        self.mqtt_port = mqtt_port
+        self.timing = {"min_time": args.min_time, "min_runs": args.min_runs, "repeat": args.repeat}
+        # Real OCR takes seconds per frame; one pass over the frames is enough
+        self.ocr_timing = self.timing if args.ocr == "stand-in" else {"min_time": 0, "min_runs": len(frames), "repeat": 1}
+        self.e2e_seconds = args.e2e_seconds
+        self.e2e_ocr_ms = args.ocr_ms
+        self.camera_fps = args.camera_fps
+        self.hold_frames = args.hold_frames
+        self.ocr_workers = args.ocr_workers
+
+
+def run(args, names):
+    if args.ocr == "stand-in":
+        install_stand_in_ocr()
+    if args.frames:
+        frames = load_frames(args.frames, args.frame_count)
+    else:
+        frames = synthetic_frames(args.frame_count, (args.width, args.height), args.seed)
+    set_ocr_options({})
+
+    broker = None
+    mqtt_host, mqtt_port = args.mqtt_host, args.mqtt_port
+    if any(n.startswith("mqtt") or n == "end_to_end" for n in names) and not mqtt_host:
+        broker = MQTTStubBroker(ack_delay_ms=args.mqtt_ack_delay_ms).start()
+        mqtt_host, mqtt_port = broker.host, broker.port
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        db_file = os.path.join(tmp, "bench.db")
+        print(f"Preparing a {args.db_rows}-row database...")
+        _fill_db(db_file, args.db_rows)
+        ctx = Context(args, frames, db_file, mqtt_host, mqtt_port)
+        for name in names:
+            print(f"  running {name}...", flush=True)
+            try:
+                results[name] = BENCHMARKS[name](ctx)
+            except Exception as e:
+                logger.error(f"Benchmark {name} failed: {e}", exc_info=True)
+                results[name] = {"error": str(e)}
+    if broker is not None:
+        broker.stop()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "compare", "only", "list")}
+    config["frame_shape"] = list(frames[0].shape)
+    return {"meta": machine_metadata(), "config": config, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="comma-separated benchmark names (see --list)")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    parser.add_argument("--output", "-o", help="write the results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare this run against")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="compare two saved results and exit")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative change that counts as a regression (default 0.10 = 10%%)")
+    parser.add_argument("--frames", help="video file or image folder to use instead of synthetic frames")
+    parser.add_argument("--frame-count", type=int, default=FRAME_COUNT)
+    parser.add_argument("--width", type=int, default=FRAME_SIZE[0])
+    parser.add_argument("--height", type=int, default=FRAME_SIZE[1])
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--ocr", choices=("stand-in", "real"), default="stand-in")
+    parser.add_argument("--ocr-ms", type=float, default=E2E_OCR_MS,
+                        help="simulated stand-in inference time in the end-to-end loop")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME)
+    parser.add_argument("--min-runs", type=int, default=MIN_RUNS)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--db-rows", type=int, default=DB_ROWS)
+    parser.add_argument("--dir", help="directory for the temporary database (use the Pi's SD card)")
+    parser.add_argument("--mqtt-host", help="use this broker instead of the local stub broker")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--mqtt-ack-delay-ms", type=float, default=0.0, help="stub broker acknowledgement delay")
+    parser.add_argument("--e2e-seconds", type=float, default=E2E_SECONDS)
+    parser.add_argument("--camera-fps", type=float, default=E2E_CAMERA_FPS)
+    parser.add_argument("--hold-frames", type=int, default=E2E_HOLD_FRAMES)
+    parser.add_argument("--ocr-workers", type=int, default=pipeline.DEFAULT_OCR_WORKERS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        return 1 if compare(baseline, current, args.threshold) else 0
+
+    names = list(BENCHMARKS)
+    if args.only:
+        names = [n.strip() for n in args.only.split(",") if n.strip()]
+        unknown = [n for n in names if n not in BENCHMARKS]
+        if unknown:
+            parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    report = run(args, names)
+    print_results(report["results"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return 1 if compare(baseline, report, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
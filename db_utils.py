@@ -1,42 +1,327 @@
 import sqlite3
 import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from urllib.parse import quote
  
 logger = logging.getLogger(__name__)
 DB_NAME = "detected_plates.db" # Or import from a config file
+# Characters OCR commonly confuses, folded to one representative for fuzzy search
+OCR_CONFUSIONS = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2",
+                                "S": "5", "G": "6", "B": "8"})
+MIN_FTS_QUERY = 3 # The trigram index needs at least 3 characters; shorter queries fall back to LIKE
+SEARCH_MODES = ("prefix", "substring", "fuzzy")
+ROLLUP_BUCKETS = ("hour", "day") # Local-time windows kept in the rollup tables
+CONFIDENCE_BINS = 10 # Confidence histogram bins of width 0.1
  
-def create_connection(db_file=DB_NAME):
+def create_connection(db_file=DB_NAME, check_same_thread=True):
     """Create a database connection to the SQLite database."""
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        conn = sqlite3.connect(db_file, check_same_thread=check_same_thread)
         return conn
     except sqlite3.Error as e:
         logger.error(f"Error connecting to database: {e}")
     return conn
  
-def create_table(conn):
-    """Create the license_plates table if it doesn't exist."""
-    sql_create_plates_table = """ CREATE TABLE IF NOT EXISTS license_plates (
+def configure_connection(conn, cache_size_kb=8192):
+    """
+    Tunes a connection for the detection writer: WAL lets the Flask readers run
+    alongside the writer, synchronous=NORMAL only fsyncs at WAL checkpoints
+    instead of on every commit (safe in WAL mode), and a larger page cache and
+    in-memory temp storage spare the SD card.
+    """
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+    except sqlite3.Error as e:
+        logger.error(f"Error configuring database connection: {e}")
+ 
+class ReadConnectionPool:
+    """
+    Bounded pool of read-only connections for request handlers.
+
+    Connections are opened with a URI in mode=ro, so they can never take the
+    write lock, and with WAL (set by the writer) they read a snapshot without
+    waiting for it. Each keeps its own prepared-statement cache
+    (cached_statements), so the handlers' fixed SQL is only compiled once per
+    connection. At most max_connections are open; a request waits up to
+    timeout seconds for one. Re-entrant: a thread that already holds a
+    connection gets the same one back.
+    """
+
+    def __init__(self, db_file=DB_NAME, max_connections=4, timeout=5.0, cached_statements=128, cache_size_kb=2048):
+        self.db_file = db_file
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.cache_size_kb = cache_size_kb
+        self._idle = queue.LifoQueue() # Most recently used first: its page cache is warmest
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def _connect(self):
+        uri = f"file:{quote(os.path.abspath(self.db_file))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=self.cached_statements)
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Yields a read-only connection, or None if none could be opened within timeout."""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                logger.error(f"Read pool: no connection free within {self.timeout}s ({self.max_connections} in use).")
+                yield None
+                return
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                try:
+                    conn = self._connect()
+                    with self._lock:
+                        self._open += 1
+                except sqlite3.Error as e:
+                    logger.error(f"Read pool: error opening {self.db_file} read-only: {e}")
+            if conn is not None:
+                with self._lock:
+                    self.checkouts += 1
+            self._local.conn = conn
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn is not None:
+                if conn.in_transaction: # A handler left a read transaction open; don't pin the WAL
+                    conn.rollback()
+                self._idle.put(conn)
+            self._slots.release()
+
+    def close(self):
+        """Closes the idle connections; call once no request is using the pool any more."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": self._open,
+                "idle": self._idle.qsize(),
+                "max": self.max_connections,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
+ 
+def to_epoch_ms(timestamp):
+    """ISO timestamp (local time, as written by main_pi) -> integer epoch milliseconds."""
+    return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+ 
+def _migrate_v1(conn):
+    """Original schema."""
+    conn.execute(""" CREATE TABLE IF NOT EXISTS license_plates (
                                             id INTEGER PRIMARY KEY AUTOINCREMENT,
                                             plate_number TEXT NOT NULL,
                                             timestamp TEXT NOT NULL,
                                             confidence REAL
-                                        ); """
+                                        ); """)
+ 
+def _migrate_v2(conn, batch_size=5000):
+    """Numeric epoch_ms column (backfilled from the ISO text) with indexes on time and plate."""
+    conn.execute("ALTER TABLE license_plates ADD COLUMN epoch_ms INTEGER")
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, timestamp FROM license_plates WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, ts in rows:
+            try:
+                updates.append((to_epoch_ms(ts), row_id))
+            except (TypeError, ValueError):
+                logger.warning(f"Migration: row {row_id} has an unparsable timestamp {ts!r}, leaving epoch_ms NULL.")
+        conn.executemany("UPDATE license_plates SET epoch_ms = ? WHERE id = ?", updates)
+        last_id = rows[-1][0]
+    # The rowid is implicitly the last column of every index, so (epoch_ms) also orders ties by id
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_license_plates_epoch_ms ON license_plates(epoch_ms)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_license_plates_plate ON license_plates(plate_number, epoch_ms)")
+ 
+def normalize_plate(text):
+    """Upper-cases, drops non-alphanumerics and folds OCR look-alikes (O/0, I/1, B/8, ...)."""
+    return "".join(ch for ch in str(text).upper() if ch.isalnum()).translate(OCR_CONFUSIONS)
+ 
+def fts5_available(conn):
     try:
-        c = conn.cursor()
-        c.execute(sql_create_plates_table)
-        conn.commit()
+        conn.execute("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp._fts5_probe")
+        return True
+    except sqlite3.Error:
+        return False
+ 
+def _migrate_v3(conn, batch_size=5000):
+    """
+    plate_norm column (normalize_plate of plate_number) and, where SQLite has FTS5 with the
+    trigram tokenizer, an external-content index over both columns kept in sync by triggers.
+    """
+    conn.execute("ALTER TABLE license_plates ADD COLUMN plate_norm TEXT")
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, plate_number FROM license_plates WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        conn.executemany("UPDATE license_plates SET plate_norm = ? WHERE id = ?",
+                         [(normalize_plate(plate), row_id) for row_id, plate in rows])
+        last_id = rows[-1][0]
+    if not fts5_available(conn):
+        logger.warning("SQLite has no FTS5 trigram tokenizer; plate search will use LIKE scans.")
+        return
+    conn.execute("""CREATE VIRTUAL TABLE license_plates_fts USING fts5(
+                        plate_number, plate_norm, content='license_plates', content_rowid='id',
+                        tokenize='trigram')""")
+    conn.execute("""CREATE TRIGGER license_plates_fts_ai AFTER INSERT ON license_plates BEGIN
+                        INSERT INTO license_plates_fts(rowid, plate_number, plate_norm)
+                        VALUES (new.id, new.plate_number, new.plate_norm);
+                    END""")
+    conn.execute("""CREATE TRIGGER license_plates_fts_ad AFTER DELETE ON license_plates BEGIN
+                        INSERT INTO license_plates_fts(license_plates_fts, rowid, plate_number, plate_norm)
+                        VALUES ('delete', old.id, old.plate_number, old.plate_norm);
+                    END""")
+    conn.execute("""CREATE TRIGGER license_plates_fts_au AFTER UPDATE OF plate_number, plate_norm ON license_plates BEGIN
+                        INSERT INTO license_plates_fts(license_plates_fts, rowid, plate_number, plate_norm)
+                        VALUES ('delete', old.id, old.plate_number, old.plate_norm);
+                        INSERT INTO license_plates_fts(rowid, plate_number, plate_norm)
+                        VALUES (new.id, new.plate_number, new.plate_norm);
+                    END""")
+    conn.execute("INSERT INTO license_plates_fts(license_plates_fts) VALUES ('rebuild')")
+ 
+def _migrate_v4(conn):
+    """Rollup tables for /api/stats, backfilled from the existing detections."""
+    conn.execute("""CREATE TABLE plate_rollups (
+                        bucket TEXT NOT NULL,
+                        bucket_start INTEGER NOT NULL,
+                        detections INTEGER NOT NULL DEFAULT 0,
+                        unique_plates INTEGER NOT NULL DEFAULT 0,
+                        confidence_sum REAL NOT NULL DEFAULT 0,
+                        confidence_count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (bucket, bucket_start)
+                    ) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE plate_rollup_confidence (
+                        bucket TEXT NOT NULL,
+                        bucket_start INTEGER NOT NULL,
+                        bin INTEGER NOT NULL,
+                        detections INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (bucket, bucket_start, bin)
+                    ) WITHOUT ROWID""")
+    # Distinct plates per bucket; unique_plates grows by the plates new to it (retention prunes old buckets' lists)
+    conn.execute("""CREATE TABLE plate_rollup_plates (
+                        bucket TEXT NOT NULL,
+                        bucket_start INTEGER NOT NULL,
+                        plate_number TEXT NOT NULL,
+                        PRIMARY KEY (bucket, bucket_start, plate_number)
+                    ) WITHOUT ROWID""")
+    rebuild_rollups(conn)
+ 
+def _migrate_v5(conn):
+    """source_id column (the camera/stream a detection came from; NULL for single-source rows)."""
+    conn.execute("ALTER TABLE license_plates ADD COLUMN source_id TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_license_plates_source ON license_plates(source_id, epoch_ms)")
+ 
+def _migrate_v6(conn):
+    """Hashes of the plate crop and scene snapshot in the snapshot store (snapshot_store.py), NULL if none."""
+    conn.execute("ALTER TABLE license_plates ADD COLUMN snapshot_hash TEXT")
+    conn.execute("ALTER TABLE license_plates ADD COLUMN scene_hash TEXT")
+ 
+# (version, migration) in order; PRAGMA user_version records the last one applied
+MIGRATIONS = [
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+    (6, _migrate_v6),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+ 
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+ 
+def has_search_index(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'license_plates_fts'").fetchone()
+    return row is not None
+ 
+def migrate_schema(conn):
+    """Applies every pending migration, each in its own transaction. Returns the resulting version."""
+    version = get_schema_version(conn)
+    if version == 0 and not conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+        # New file: incremental vacuum can be switched on for free before the first table exists
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    for target, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info(f"Migrating database schema from version {version} to {target}...")
+        try:
+            conn.execute("BEGIN")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"Error migrating database schema to version {target}: {e}")
+            return version
+        version = target
+    return version
+ 
+def create_table(conn):
+    """Create the license_plates table if it doesn't exist and bring its schema up to date."""
+    try:
+        migrate_schema(conn)
     except sqlite3.Error as e:
         logger.error(f"Error creating table: {e}")
  
-def save_plate(conn, plate_number, timestamp, confidence):
+def save_plate(conn, plate_number, timestamp, confidence, source_id=None, snapshot_hash=None, scene_hash=None):
     """Save a new detected plate into the license_plates table."""
-    sql = ''' INSERT INTO license_plates(plate_number, timestamp, confidence)
-              VALUES(?,?,?) '''
+    sql = ''' INSERT INTO license_plates(plate_number, timestamp, confidence, epoch_ms, plate_norm, source_id,
+                                       snapshot_hash, scene_hash)
+              VALUES(?,?,?,?,?,?,?,?) '''
+    try:
+        epoch_ms = to_epoch_ms(timestamp)
+    except (TypeError, ValueError, OverflowError) as e:
+        logger.error(f"Not saving plate {plate_number}: bad timestamp {timestamp!r} ({e})")
+        return None
     cur = conn.cursor()
     try:
-        cur.execute(sql, (plate_number, timestamp, confidence))
+        cur.execute(sql, (plate_number, timestamp, confidence, epoch_ms, normalize_plate(plate_number), source_id,
+                          snapshot_hash, scene_hash))
+        update_rollups(conn, [(plate_number, epoch_ms, confidence)])
         conn.commit()
         logger.info(f"Saved to DB: {plate_number}, {timestamp}, {confidence:.2f}")
         return cur.lastrowid
@@ -44,11 +329,140 @@ def save_plate(conn, plate_number, timestamp, confidence):
         logger.error(f"Error saving plate to DB: {e}")
         return None
  
+def save_plates(conn, rows, raise_errors=False):
+    """
+    Save many (plate_number, timestamp, confidence[, source_id[, snapshot_hash[, scene_hash]]])
+    rows with one executemany and one commit. Rows with an unparseable timestamp are skipped;
+    returns the number of rows saved. A database error rolls the batch back and returns 0, or is
+    re-raised with raise_errors so the caller can retry it.
+    """
+    sql = ''' INSERT INTO license_plates(plate_number, timestamp, confidence, epoch_ms, plate_norm, source_id,
+                                       snapshot_hash, scene_hash)
+              VALUES(?,?,?,?,?,?,?,?) '''
+    params = []
+    for plate, ts, conf, *extra in rows:
+        try:
+            epoch_ms = to_epoch_ms(ts)
+        except (TypeError, ValueError, OverflowError) as e: # One bad row must not lose the rest of the batch
+            logger.error(f"Not saving plate {plate}: bad timestamp {ts!r} ({e})")
+            continue
+        params.append((plate, ts, conf, epoch_ms, normalize_plate(plate), *(list(extra) + [None] * 3)[:3]))
+    if not params:
+        return 0
+    try:
+        with conn: # Commits once for the whole batch (rollups included), rolls back on error
+            conn.executemany(sql, params)
+            update_rollups(conn, [(p[0], p[3], p[2]) for p in params])
+        return len(params)
+    except sqlite3.Error as e:
+        logger.error(f"Error saving {len(rows)} plates to DB: {e}")
+        if raise_errors:
+            raise
+        return 0
+ 
+def bucket_start(epoch_ms, bucket):
+    """Start (epoch ms) of the local-time hour or day containing epoch_ms."""
+    dt = datetime.fromtimestamp(epoch_ms / 1000.0)
+    if bucket == "hour":
+        dt = dt.replace(minute=0, second=0, microsecond=0)
+    elif bucket == "day":
+        dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        raise ValueError(f"Unknown rollup bucket {bucket!r}")
+    return int(dt.timestamp() * 1000)
+ 
+def update_rollups(conn, rows):
+    """
+    Adds (plate_number, epoch_ms, confidence) detections to the hour and day rollups. Runs inside
+    the caller's transaction, so the rollups commit (or roll back) together with the rows.
+    Deleting detections later does not touch the rollups: they count traffic as it was seen.
+    """
+    totals = {} # (bucket, start) -> [detections, confidence_sum, confidence_count]
+    histogram = {} # (bucket, start, bin) -> detections
+    plates = set()
+    for plate, epoch_ms, confidence in rows:
+        if epoch_ms is None:
+            continue
+        for bucket in ROLLUP_BUCKETS:
+            key = (bucket, bucket_start(epoch_ms, bucket))
+            entry = totals.setdefault(key, [0, 0.0, 0])
+            entry[0] += 1
+            plates.add(key + (plate,))
+            if confidence is not None:
+                entry[1] += confidence
+                entry[2] += 1
+                bin_key = key + (min(max(int(confidence * CONFIDENCE_BINS), 0), CONFIDENCE_BINS - 1),)
+                histogram[bin_key] = histogram.get(bin_key, 0) + 1
+    if not totals:
+        return
+    conn.executemany("""INSERT INTO plate_rollups(bucket, bucket_start, detections, confidence_sum, confidence_count)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(bucket, bucket_start) DO UPDATE SET
+                            detections = detections + excluded.detections,
+                            confidence_sum = confidence_sum + excluded.confidence_sum,
+                            confidence_count = confidence_count + excluded.confidence_count""",
+                     [key + tuple(entry) for key, entry in totals.items()])
+    conn.executemany("""INSERT INTO plate_rollup_confidence(bucket, bucket_start, bin, detections) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(bucket, bucket_start, bin) DO UPDATE SET
+                            detections = detections + excluded.detections""",
+                     [key + (count,) for key, count in histogram.items()])
+    # Counted as they are added rather than recounted, since retention drops the plate lists of old
+    # buckets: a late detection in such a bucket must not reset its count to the new plates alone
+    new_plates = {}
+    cur = conn.cursor()
+    for bucket, start, plate in plates:
+        cur.execute("INSERT OR IGNORE INTO plate_rollup_plates(bucket, bucket_start, plate_number) VALUES (?, ?, ?)",
+                    (bucket, start, plate))
+        if cur.rowcount > 0:
+            new_plates[(bucket, start)] = new_plates.get((bucket, start), 0) + 1
+    conn.executemany("UPDATE plate_rollups SET unique_plates = unique_plates + ? WHERE bucket = ? AND bucket_start = ?",
+                     [(count,) + key for key, count in new_plates.items()])
+ 
+def rebuild_rollups(conn, batch_size=5000):
+    """Recomputes the rollup tables from license_plates, in the caller's transaction."""
+    for table in ("plate_rollups", "plate_rollup_confidence", "plate_rollup_plates"):
+        conn.execute(f"DELETE FROM {table}")
+    last_id, total = 0, 0
+    while True:
+        rows = conn.execute("""SELECT id, plate_number, epoch_ms, confidence FROM license_plates
+                               WHERE id > ? ORDER BY id LIMIT ?""", (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        update_rollups(conn, [row[1:] for row in rows])
+        last_id = rows[-1][0]
+        total += len(rows)
+    logger.info(f"Rebuilt traffic rollups from {total} detections.")
+    return total
+ 
+def get_rollups(conn, bucket="hour", start=None, end=None):
+    """
+    Precomputed stats per bucket with start <= bucket_start < end, oldest first. Returns
+    (bucket_start, detections, unique_plates, avg_confidence, histogram) rows, histogram being
+    CONFIDENCE_BINS counts for confidence 0.0-0.1, 0.1-0.2, ...
+    """
+    start = 0 if start is None else start
+    end = 2 ** 62 if end is None else end
+    try:
+        rows = conn.execute("""SELECT bucket_start, detections, unique_plates, confidence_sum, confidence_count
+                               FROM plate_rollups WHERE bucket = ? AND bucket_start >= ? AND bucket_start < ?
+                               ORDER BY bucket_start""", (bucket, start, end)).fetchall()
+        histograms = {}
+        for b_start, b_bin, count in conn.execute("""SELECT bucket_start, bin, detections FROM plate_rollup_confidence
+                                                     WHERE bucket = ? AND bucket_start >= ? AND bucket_start < ?""",
+                                                  (bucket, start, end)):
+            histograms.setdefault(b_start, [0] * CONFIDENCE_BINS)[b_bin] = count
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching {bucket} rollups: {e}")
+        return []
+    return [(b_start, detections, unique, (conf_sum / conf_count) if conf_count else None,
+             histograms.get(b_start, [0] * CONFIDENCE_BINS))
+            for b_start, detections, unique, conf_sum, conf_count in rows]
+ 
 def get_all_plates(conn):
     """Query all rows in the license_plates table."""
     cur = conn.cursor()
     try:
-        cur.execute("SELECT plate_number, timestamp, confidence FROM license_plates ORDER BY timestamp DESC")
+        cur.execute("SELECT plate_number, timestamp, confidence FROM license_plates ORDER BY epoch_ms DESC, id DESC")
         rows = cur.fetchall()
         return rows
     except sqlite3.Error as e:
@@ -59,45 +473,224 @@ def get_recent_plates(conn, limit=10):
     """Query a limited number of recent plates."""
     cur = conn.cursor()
     try:
-        cur.execute("SELECT plate_number, timestamp, confidence FROM license_plates ORDER BY timestamp DESC LIMIT ?", (limit,))
+        cur.execute("SELECT plate_number, timestamp, confidence FROM license_plates ORDER BY epoch_ms DESC, id DESC LIMIT ?", (limit,))
         rows = cur.fetchall()
         return rows
     except sqlite3.Error as e:
         logger.error(f"Error fetching recent plates: {e}")
         return []
  
-def clear_except_last_n(conn, n=10):
+def get_plates_page(conn, before=None, before_id=None, limit=50):
+    """
+    Keyset pagination, newest first. Returns (id, plate_number, timestamp, confidence, epoch_ms,
+    source_id, snapshot_hash) rows older than the (before, before_id) cursor, i.e. the epoch_ms
+    and id of the last row of the previous page. Uses the epoch_ms index, so every page costs the
+    same however deep it is.
+    """
+    cur = conn.cursor()
+    try:
+        if before is None:
+            cur.execute("""SELECT id, plate_number, timestamp, confidence, epoch_ms, source_id, snapshot_hash
+                           FROM license_plates
+                           ORDER BY epoch_ms DESC, id DESC LIMIT ?""", (limit,))
+        elif before_id is None:
+            cur.execute("""SELECT id, plate_number, timestamp, confidence, epoch_ms, source_id, snapshot_hash
+                           FROM license_plates
+                           WHERE epoch_ms < ? ORDER BY epoch_ms DESC, id DESC LIMIT ?""", (before, limit))
+        else:
+            cur.execute("""SELECT id, plate_number, timestamp, confidence, epoch_ms, source_id, snapshot_hash
+                           FROM license_plates
+                           WHERE epoch_ms <= ? AND (epoch_ms < ? OR id < ?)
+                           ORDER BY epoch_ms DESC, id DESC LIMIT ?""", (before, before, before_id, limit))
+        return cur.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching plates page: {e}")
+        return []
+ 
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+ 
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+ 
+def search_plates(conn, query, mode="substring", start=None, end=None, before=None, before_id=None, limit=50):
+    """
+    Finds plates matching query, newest first, with the same (before, before_id) keyset
+    cursor as get_plates_page and optional start <= epoch_ms < end filters.
+
+    prefix    - plate_number starts with query (range scan on the plate index)
+    substring - plate_number contains query (trigram index)
+    fuzzy     - like substring, but on plate_norm so OCR look-alikes (O/0, I/1, B/8...) match
+
+    Returns (id, plate_number, timestamp, confidence, epoch_ms, source_id, snapshot_hash) rows.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {mode!r}")
+    term = "".join(ch for ch in str(query).upper() if ch.isalnum())
+    if mode == "fuzzy":
+        term = normalize_plate(term)
+    if not term:
+        return []
+
+    clauses, params = [], []
+    use_fts = mode != "prefix" and len(term) >= MIN_FTS_QUERY and has_search_index(conn)
+    if mode == "prefix":
+        # Half-open range on plate_number so idx_license_plates_plate is used
+        clauses.append("p.plate_number >= ? AND p.plate_number < ?")
+        params += [term, term[:-1] + chr(ord(term[-1]) + 1)]
+    elif use_fts:
+        column = "plate_norm" if mode == "fuzzy" else "plate_number"
+        clauses.append("p.id IN (SELECT rowid FROM license_plates_fts WHERE license_plates_fts MATCH ?)")
+        params.append(f"{column} : {_fts_phrase(term)}")
+    else:
+        column = "p.plate_norm" if mode == "fuzzy" else "p.plate_number"
+        clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+        params.append(f"%{_like_escape(term)}%")
+    if start is not None:
+        clauses.append("p.epoch_ms >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("p.epoch_ms < ?")
+        params.append(end)
+    if before is not None and before_id is None:
+        clauses.append("p.epoch_ms < ?")
+        params.append(before)
+    elif before is not None:
+        clauses.append("p.epoch_ms <= ? AND (p.epoch_ms < ? OR p.id < ?)")
+        params += [before, before, before_id]
+
+    sql = (f"SELECT p.id, p.plate_number, p.timestamp, p.confidence, p.epoch_ms, p.source_id, p.snapshot_hash "
+           f"FROM license_plates p "
+           f"WHERE {' AND '.join(clauses)} ORDER BY p.epoch_ms DESC, p.id DESC LIMIT ?")
+    params.append(limit)
+    try:
+        return conn.execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error searching plates for {query!r} ({mode}): {e}")
+        return []
+ 
+def get_plates_range(conn, start=None, end=None, after=None, limit=1000):
+    """
+    Keyset pagination, oldest first. Returns at most limit (id, plate_number, timestamp,
+    confidence, epoch_ms) rows with start <= epoch_ms < end (either optional) that come after
+    the after cursor, i.e. the (epoch_ms, id) of the last row of the previous page. Each page is
+    its own short query, so a caller can give the connection back between pages.
+    """
+    sql = "SELECT id, plate_number, timestamp, confidence, epoch_ms FROM license_plates"
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("epoch_ms >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("epoch_ms < ?")
+        params.append(end)
+    if after is not None:
+        after_ms, after_id = after
+        if after_ms is None: # Rows without epoch_ms sort first
+            clauses.append("(epoch_ms IS NOT NULL OR id > ?)")
+            params.append(after_id)
+        else:
+            clauses.append("epoch_ms >= ? AND (epoch_ms > ? OR id > ?)")
+            params += [after_ms, after_ms, after_id]
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY epoch_ms, id LIMIT ?"
+    try:
+        return conn.execute(sql, params + [limit]).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching plates range: {e}")
+        return []
+ 
+def clear_except_last_n(conn, n=10, batch_size=1000):
     """
     Deletes all but the last `n` entries (by timestamp descending) from license_plates.
+    Rows go in batches of batch_size, each its own short transaction, so the detection
+    writer is never locked out for long. Returns the number of rows deleted.
     """
+    deleted = 0
     try:
-        cursor = conn.cursor()
-        # Keep latest `n` entries
-        cursor.execute(f"""
-            DELETE FROM license_plates
-            WHERE id NOT IN (
-                SELECT id FROM license_plates
-                ORDER BY timestamp DESC
-                LIMIT ?
-            )
-        """, (n,))
-        conn.commit()
-        logger.info(f"Cleared database, kept last {n} entries.")
+        while True:
+            with conn:
+                # Keep latest `n` entries
+                cur = conn.execute("""
+                    DELETE FROM license_plates WHERE id IN (
+                        SELECT id FROM license_plates
+                        WHERE id NOT IN (SELECT id FROM license_plates ORDER BY epoch_ms DESC, id DESC LIMIT ?)
+                        LIMIT ?
+                    )""", (n, batch_size))
+            deleted += cur.rowcount
+            if cur.rowcount < batch_size:
+                break
+        incremental_vacuum(conn)
+        logger.info(f"Cleared database ({deleted} rows), kept last {n} entries.")
     except Exception as e:
         logger.error(f"Error clearing entries: {e}")
+    return deleted
+ 
+def enable_incremental_vacuum(conn):
+    """
+    Switches the file to auto_vacuum=INCREMENTAL so freed pages can be handed back to the
+    filesystem a few at a time. An existing file has to be rebuilt once with VACUUM, which
+    locks the database while it runs: call this before the writer starts.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return True
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+            logger.info("Rebuilding database with VACUUM to enable incremental vacuum (one-time)...")
+            conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    except sqlite3.Error as e:
+        logger.error(f"Error enabling incremental vacuum: {e}")
+        return False
+ 
+def incremental_vacuum(conn, pages=None):
+    """Returns up to `pages` free pages (all when None) to the filesystem. No-op unless auto_vacuum=INCREMENTAL."""
+    try:
+        if pages is None:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        else:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error running incremental vacuum: {e}")
+ 
+def get_db_size(conn):
+    """Returns (used_bytes, free_bytes) of the main database file, excluding the WAL."""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - free_pages) * page_size, free_pages * page_size
  
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Create or migrate the detections database.")
+    parser.add_argument("db_file", nargs="?", default=DB_NAME)
+    parser.add_argument("--demo", action="store_true", help="insert two test plates and list the table")
+    parser.add_argument("--backfill-rollups", action="store_true",
+                        help="recompute the hourly/daily traffic rollups from all stored detections")
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO)
-    conn = create_connection()
+    conn = create_connection(args.db_file)
     if conn:
         create_table(conn)
-        # Test save
-        save_plate(conn, "TEST1234", datetime.now().isoformat(), 0.95)
-        save_plate(conn, "XYZ567", datetime.now().isoformat(), 0.88)
+        count = conn.execute("SELECT COUNT(*) FROM license_plates").fetchone()[0]
+        print(f"{args.db_file}: schema version {get_schema_version(conn)} (latest {SCHEMA_VERSION}), {count} rows")
+
+        if args.backfill_rollups:
+            with conn:
+                rebuilt = rebuild_rollups(conn)
+            print(f"Rebuilt rollups from {rebuilt} detections.")
+
+        if args.demo:
+            # Test save
+            save_plate(conn, "TEST1234", datetime.now().isoformat(), 0.95)
+            save_plate(conn, "XYZ567", datetime.now().isoformat(), 0.88)
 
-        print("All plates:")
-        plates = get_all_plates(conn)
-        for plate in plates:
-            print(plate)
+            print("All plates:")
+            plates = get_all_plates(conn)
+            for plate in plates:
+                print(plate)
 
-        conn.close()
\ No newline at end of file
+        conn.close()
@@ -0,0 +1,186 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import db_utils
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+BATCH_SIZE = 100 # Rows per commit at most
+FLUSH_INTERVAL = 1.0 # seconds; a partial batch is committed after waiting this long
+MAX_QUEUE = 10000 # Detections waiting to be written before submit() starts dropping
+RETRY_DELAY = 0.5 # seconds before retrying a batch the database refused (e.g. locked); doubles on every retry
+RETRY_MAX_DELAY = 10.0
+# --- End Defaults ---
+
+_FLUSH = object()
+_STOP = object()
+
+_DB_WRITE_SECONDS = metrics.STAGE_SECONDS.labels("db_write")
+
+
+class AsyncPlateWriter:
+    """
+    Background writer that owns the detection database connection.
+
+    Callers hand detections over with submit(), which only enqueues and never
+    touches SQLite. The writer thread groups them and commits with one
+    executemany per batch, either when batch_size rows are waiting or
+    flush_interval seconds after the first row of a batch arrived. The
+    connection runs in WAL mode with synchronous=NORMAL (see
+    db_utils.configure_connection). close() writes everything still queued.
+
+    A batch the database refuses (e.g. still locked after the busy timeout
+    while retention or /clear_data holds it) is kept and retried with
+    backoff; meanwhile new detections queue up behind it. Only rows that can
+    never be written (a bad timestamp) are counted as failed and dropped.
+    """
+
+    def __init__(self, db_file=db_utils.DB_NAME, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_queue=MAX_QUEUE):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._ready = threading.Event()
+        self._connected = False
+        self._flushed = threading.Condition()
+        self._flush_requests = 0
+        self._flushes_done = 0
+
+        self._stats_lock = threading.Lock()
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_failed = 0
+        self.retries = 0
+        self.batches = 0
+        self.commit_time_total = 0.0
+
+    def start(self, timeout=10.0):
+        """Starts the writer thread; returns True once its connection is open and the table exists."""
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        return self._connected
+
+    def submit(self, plate_number, timestamp, confidence, source_id=None, snapshot_hash=None, scene_hash=None):
+        """Queues one detection for writing. Returns False if the queue is full and it was dropped."""
+        try:
+            self._queue.put_nowait((plate_number, timestamp, float(confidence), source_id, snapshot_hash, scene_hash))
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self.rows_dropped += 1
+            logger.error(f"DB writer queue full, dropping detection {plate_number}.")
+            return False
+
+    def flush(self, timeout=5.0):
+        """Blocks until everything submitted so far has been committed."""
+        with self._flushed:
+            self._flush_requests += 1
+            target = self._flush_requests
+        self._queue.put(_FLUSH)
+        with self._flushed:
+            return self._flushed.wait_for(lambda: self._flushes_done >= target, timeout)
+
+    def close(self, timeout=10.0):
+        """Writes all queued detections, then closes the connection."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        conn = db_utils.create_connection(self.db_file)
+        if not conn:
+            self._ready.set()
+            return
+        db_utils.configure_connection(conn)
+        db_utils.create_table(conn)
+        self._connected = True
+        self._ready.set()
+        logger.info(f"DB writer started on {self.db_file} (batch {self.batch_size}, flush every {self.flush_interval}s).")
+
+        batch = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None # Flush interval elapsed
+
+            if item is _STOP:
+                stopping = True
+            elif item is _FLUSH:
+                self._commit(conn, batch)
+                batch, deadline = [], None
+                with self._flushed:
+                    self._flushes_done += 1
+                    self._flushed.notify_all()
+                continue
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+
+            self._commit(conn, batch)
+            batch, deadline = [], None
+
+        # Drain whatever arrived after the stop request
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple):
+                batch.append(item)
+        self._commit(conn, batch)
+        conn.close()
+        logger.info(f"DB writer stopped after {self.rows_written} rows in {self.batches} batches.")
+
+    def _commit(self, conn, batch):
+        if not batch:
+            return
+        delay = RETRY_DELAY
+        while True:
+            start = time.perf_counter()
+            try:
+                written = db_utils.save_plates(conn, batch, raise_errors=True)
+                break
+            except sqlite3.Error:
+                with self._stats_lock:
+                    self.retries += 1
+                logger.warning(f"DB writer: retrying {len(batch)} rows in {delay:.1f}s.")
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+        elapsed = time.perf_counter() - start
+        _DB_WRITE_SECONDS.observe(elapsed)
+        with self._stats_lock:
+            self.batches += 1
+            self.commit_time_total += elapsed
+            self.rows_written += written
+            self.rows_failed += len(batch) - written
+        logger.debug(f"DB writer committed {written} rows in {elapsed * 1000:.1f} ms.")
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "rows_written": self.rows_written,
+                "rows_dropped": self.rows_dropped,
+                "rows_failed": self.rows_failed,
+                "retries": self.retries,
+                "batches": self.batches,
+                "avg_batch_rows": (self.rows_written / self.batches) if self.batches else 0.0,
+                "avg_commit_ms": (self.commit_time_total / self.batches * 1000.0) if self.batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+            }
@@ -0,0 +1,113 @@
+import collections
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+HISTORY_SIZE = 500 # Events kept for Last-Event-ID resume after a reconnect
+# --- End Defaults ---
+
+# One published event; data is already JSON-encoded so every subscriber shares the same string
+HubEvent = collections.namedtuple("HubEvent", ["id", "event", "data"])
+
+
+class EventHub:
+    """
+    In-process pub/sub for dashboard push (Server-Sent Events).
+
+    publish() serializes an event once, gives it the next id and wakes every
+    waiting subscriber; subscribers call wait_for_events() with the last id
+    they have seen and get only the newer events. The last history_size
+    events are kept so a client reconnecting with Last-Event-ID gets what it
+    missed. Ids start from the current time in milliseconds, so they keep
+    increasing across restarts; a client whose id is no longer in the
+    history (or is from the future) is told to reload instead.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._cond = threading.Condition()
+        self._history = collections.deque(maxlen=history_size)
+        self._next_id = int(time.time() * 1000)
+        self._subscribers = 0
+        self._listeners = []
+        self.events_published = 0
+
+    def publish(self, event, data):
+        """Publishes one event (name, JSON-serializable data) to all subscribers; returns its id."""
+        payload = json.dumps(data, separators=(",", ":"))
+        with self._cond:
+            event_id = self._next_id
+            self._next_id += 1
+            self._history.append(HubEvent(event_id, event, payload))
+            self.events_published += 1
+            self._cond.notify_all()
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Event hub listener failed: {e}")
+        return event_id
+
+    def add_listener(self, callback):
+        """callback() is called (on the publishing thread) after every event; it must not block."""
+        with self._cond:
+            self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        with self._cond:
+            self._listeners = [c for c in self._listeners if c is not callback]
+
+    def latest_id(self):
+        with self._cond:
+            return self._next_id - 1
+
+    def _events_after(self, last_id):
+        """Returns (events, missed) for ids > last_id; caller holds the lock."""
+        if last_id >= self._next_id: # Id from an earlier run that got further than this one
+            return [], True
+        oldest = self._history[0].id if self._history else self._next_id
+        missed = last_id < oldest - 1
+        if not self._history or last_id >= self._history[-1].id:
+            return [], missed
+        return [e for e in self._history if e.id > last_id], missed
+
+    def events_after(self, last_id):
+        """Non-blocking wait_for_events(): (events newer than last_id, missed)."""
+        with self._cond:
+            return self._events_after(last_id)
+
+    def wait_for_events(self, last_id, timeout=None):
+        """
+        Blocks until there are events newer than last_id or timeout expires. Returns
+        (events, missed); missed is True if events after last_id are no longer available.
+        """
+        with self._cond:
+            events, missed = self._events_after(last_id)
+            if not events and not missed:
+                self._cond.wait_for(lambda: self._next_id - 1 > last_id, timeout)
+                events, missed = self._events_after(last_id)
+            return events, missed
+
+    def add_subscriber(self):
+        with self._cond:
+            self._subscribers += 1
+
+    def remove_subscriber(self):
+        with self._cond:
+            self._subscribers = max(0, self._subscribers - 1)
+
+    def subscriber_count(self):
+        with self._cond:
+            return self._subscribers
+
+    def stats(self):
+        with self._cond:
+            return {
+                "subscribers": self._subscribers,
+                "events_published": self.events_published,
+                "history": len(self._history),
+                "latest_id": self._next_id - 1,
+            }
@@ -1,16 +1,27 @@
-from flask import Flask, jsonify, render_template, Response, request, send_file, redirect, url_for, session # Added request, send_file, redirect, url_for, session
+from flask import Flask, jsonify, render_template, Response, request, send_file, redirect, url_for, session, stream_with_context # Added request, send_file, redirect, url_for, session
 
 import logging
 import cv2
 import time
 import numpy as np
 import db_utils
+import metrics
+from event_hub import EventHub
+from frame_broadcaster import StreamAdapter, stream_profile
+import snapshot_store
 import csv
+import hmac
+import io
+import json
+import zlib
 from datetime import datetime
 import os
+import threading
+import socket
+from contextlib import contextmanager
 
 # Optional password login
-from functools import wraps
+from functools import wraps, lru_cache
 
 # If running flask_server.py standalone for testing, adjust import:
 # import db_utils as db_utils_standalone # and use db_utils_standalone
@@ -18,6 +29,21 @@ from functools import wraps
 logger = logging.getLogger(__name__)
 
 DB_NAME_FLASK = "detected_plates.db" # Ensure this matches db_utils
+MAX_PAGE_SIZE = 500 # Upper bound for ?limit= on paginated endpoints
+EXPORT_CHUNK_ROWS = 1000 # Rows fetched and sent per chunk by /export
+READ_POOL_SIZE = 4 # Read-only connections shared by the API routes, 0 opens one per request
+READ_POOL_TIMEOUT = 5.0 # seconds a request waits for a free read connection
+SSE_HEARTBEAT_INTERVAL = 15.0 # seconds between keep-alive comments on idle event streams
+SSE_RETRY_MS = 3000 # Reconnect delay suggested to EventSource clients
+STATS_DEFAULT_HOURS = 24 # Default /api/stats window for hourly buckets
+STATS_DEFAULT_DAYS = 30 # ... and for daily buckets
+EXPORT_FORMATS = {'csv': ('text/csv', 'csv'), 'ndjson': ('application/x-ndjson', 'ndjson')}
+METRICS_TOKEN = None # If set, /metrics requires "Authorization: Bearer <token>" (no login, so Prometheus can scrape)
+SERVER_MODE = "threaded" # "threaded": Werkzeug, a thread per connection; "asgi": asgi_server.py on uvicorn
+STREAM_DEFAULT_PROFILE = "full" # /video_feed profile without ?profile= (see frame_broadcaster.STREAM_PROFILES)
+STREAM_SEND_BUFFER = 64 * 1024 # Socket send buffer of /video_feed connections, so a slow client backs up early
+SNAPSHOT_DIR = "snapshots" # Used when running standalone; main_pi.py shares its own SnapshotStore
+SNAPSHOT_MAX_AGE = 365 * 24 * 3600 # Browser cache lifetime of /snapshots/<hash>; the content behind a hash never changes
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Required for sessions
@@ -26,8 +52,28 @@ app.secret_key = os.urandom(24)  # Required for sessions
 # main_pi.py will read this flag to control its loop.
 app.processing_active = True # Default to active
 
-# Global variable to hold the function that gets frames from main_pi.py
-_get_frame_function = None
+# FrameBroadcaster shared by all /video_feed clients, set by main_pi.py
+_frame_broadcaster = None
+# Source id -> FrameBroadcaster for /video_feed/<source_id>, and a callable returning per-source stats
+_source_broadcasters = {}
+_source_stats = None
+
+# Pushes new detections and status changes to /api/plates/stream; main_pi.py may replace it
+_event_hub = EventHub()
+
+# Plate snapshots behind /snapshots/<hash>, set by main_pi.py or opened on first use
+_snapshot_store = None
+_snapshot_store_lock = threading.Lock()
+
+# Read-only connection pool for the API routes, created on first use
+_read_pool = None
+_read_pool_lock = threading.Lock()
+
+metrics.PROCESSING_ACTIVE.set_function(lambda: 1 if app.processing_active else 0)
+metrics.STREAM_VIEWERS.set_function(
+    lambda: sum(b.viewer_count for b in {id(b): b for b in [_frame_broadcaster, *_source_broadcasters.values()]
+                                           if b is not None}.values()))
+metrics.EVENT_SUBSCRIBERS.set_function(lambda: _event_hub.subscriber_count())
 
 # Optional password login
 def login_required(f):
@@ -38,96 +84,207 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def set_frame_provider(frame_getter_func):
+def set_frame_broadcaster(broadcaster):
     """
-    Called by main_pi.py to provide the function that retrieves the latest frame.
+    Called by main_pi.py to provide the FrameBroadcaster that the capture stage publishes to.
     """
-    global _get_frame_function
-    _get_frame_function = frame_getter_func
-    logger.info("Frame provider function set for Flask video stream.")
-
-def generate_frames():
-    """Generator function for video streaming."""
-    global _get_frame_function
-
-    frame_read_errors = 0
-    max_frame_read_errors = 30 # e.g., stop if no valid frame for ~1 second at 30fps attempt
+    global _frame_broadcaster
+    _frame_broadcaster = broadcaster
+    logger.info("Frame broadcaster set for Flask video stream.")
+
+def set_source_broadcasters(broadcasters):
+    """Called by main_pi.py with {source_id: FrameBroadcaster} for the per-source video streams."""
+    global _source_broadcasters
+    _source_broadcasters = dict(broadcasters)
+    logger.info(f"Video streams set for sources: {', '.join(_source_broadcasters)}.")
+
+def set_source_stats(stats_fn):
+    """Called by main_pi.py with a callable returning {source_id: stats dict} for /api/sources."""
+    global _source_stats
+    _source_stats = stats_fn
+
+def get_frame_broadcaster(source_id=None):
+    """The broadcaster behind /video_feed (source_id None) or /video_feed/<source_id>; None if unknown."""
+    if source_id is None:
+        return _frame_broadcaster
+    return _source_broadcasters.get(source_id)
+
+def get_event_hub():
+    return _event_hub
+
+def set_event_hub(hub):
+    """Called by main_pi.py to share the EventHub that the detection pipeline publishes to."""
+    global _event_hub
+    _event_hub = hub
+    logger.info("Event hub set for the dashboard event stream.")
+
+def set_snapshot_store(store):
+    """Called by main_pi.py to share the SnapshotStore its detections are saved to."""
+    global _snapshot_store
+    _snapshot_store = store
+    logger.info("Snapshot store set for /snapshots.")
+
+def get_snapshot_store():
+    global _snapshot_store
+    with _snapshot_store_lock:
+        if _snapshot_store is None:
+            _snapshot_store = snapshot_store.SnapshotStore(SNAPSHOT_DIR)
+        return _snapshot_store
+
+def set_processing_active(active):
+    """Sets the master processing flag and pushes the change to connected dashboards."""
+    app.processing_active = bool(active)
+    _event_hub.publish('status', {"processing_active": app.processing_active})
+
+@contextmanager
+def _unpooled_connection():
+    conn = db_utils.create_connection(DB_NAME_FLASK)
+    try:
+        yield conn
+    finally:
+        if conn:
+            conn.close()
 
-    while True:
-        if not app.processing_active:
-            # If processing is stopped, send a "Paused" image
-            paused_img = np.zeros((480, 640, 3), dtype=np.uint8) # Adjust size as needed
-            cv2.putText(paused_img, "Detection Paused", (150, 240), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 255), 2)
-            ret_enc, buffer = cv2.imencode('.jpg', paused_img)
-            if ret_enc:
-                frame_bytes = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(0.5) # Send "paused" image periodically
-            continue # Skip trying to get live frames
-
-        if _get_frame_function is None:
-            logger.warning("Video stream: Frame provider not set. Sending placeholder.")
-            placeholder = np.zeros((480, 640, 3), dtype=np.uint8)
-            cv2.putText(placeholder, "No Video Signal", (160, 240), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
-            ret_enc, buffer = cv2.imencode('.jpg', placeholder)
-            if ret_enc:
-                frame_bytes = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(1) # Send placeholder every second
-            continue
-
-        frame = _get_frame_function() # Call the function from main_pi to get the frame
-
-        if frame is None:
-            # logger.debug("Video stream: No frame available from provider.")
-            frame_read_errors += 1
-            if frame_read_errors > max_frame_read_errors:
-                logger.warning("Video stream: Too many errors getting frame. Sending error image and pausing for client.")
-                error_img = np.zeros((480, 640, 3), dtype=np.uint8)
-                cv2.putText(error_img, "Stream Error", (180, 240), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 2)
-                ret_enc, buffer = cv2.imencode('.jpg', error_img)
-                if ret_enc:
-                    frame_bytes = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                time.sleep(5) # Wait before client might retry or show error longer
-                # Optionally, break here if the client should disconnect
-            time.sleep(0.03) # Wait a bit if no frame is available
-            continue
-
-        frame_read_errors = 0 # Reset error count on successful frame read
+def read_connection():
+    """
+    Context manager yielding a connection for read-only routes (None if the database is
+    unavailable). Comes from a shared db_utils.ReadConnectionPool unless READ_POOL_SIZE is 0.
+    """
+    global _read_pool
+    if READ_POOL_SIZE <= 0:
+        return _unpooled_connection()
+    with _read_pool_lock:
+        if _read_pool is None or _read_pool.db_file != DB_NAME_FLASK:
+            if _read_pool is not None:
+                _read_pool.close()
+            _read_pool = db_utils.ReadConnectionPool(DB_NAME_FLASK, max_connections=READ_POOL_SIZE,
+                                                     timeout=READ_POOL_TIMEOUT)
+        pool = _read_pool
+    return pool.connection()
+
+@lru_cache(maxsize=None)
+def _status_image_jpeg(text, org, color):
+    """Encodes a status placeholder image once; every client reuses the same bytes."""
+    img = np.zeros((480, 640, 3), dtype=np.uint8)
+    cv2.putText(img, text, org, cv2.FONT_HERSHEY_SIMPLEX, 1.2, color, 2)
+    ret_enc, buffer = cv2.imencode('.jpg', img)
+    return buffer.tobytes() if ret_enc else None
+
+def _mjpeg_part(frame_bytes):
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+
+def generate_frames(broadcaster, adapter=None, viewer=None):
+    """
+    Generator function for video streaming. Waits for new frames instead of sleep-polling.
 
-        try:
-            # Encode frame as JPEG. Adjust quality vs. performance.
-            # Lower quality (e.g., 70) reduces CPU load and bandwidth.
-            ret_enc, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 75])
-            if not ret_enc:
-                logger.warning("Video stream: JPEG encoding failed.")
+    With a StreamAdapter, frames are sent at its current profile's size,
+    quality and FPS cap, and the time the server takes to write each one is
+    reported back so a viewer that falls behind is moved to a lower profile.
+    Without one, every broadcast frame is sent at full size.
+    """
+    last_seq = 0
+    next_due = 0.0
+    last_frame_time = time.monotonic()
+    last_error_sent = 0.0
+    stream_error_after = 1.0 # seconds without a frame before showing "Stream Error"
+    stream_error_repeat = 5.0 # seconds between repeated error images
+
+    broadcaster.add_viewer()
+    try:
+        while True:
+            if not app.processing_active:
+                # If processing is stopped, send a "Paused" image periodically
+                paused = _status_image_jpeg("Detection Paused", (150, 240), (0, 255, 255))
+                if paused:
+                    yield _mjpeg_part(paused)
+                time.sleep(0.5)
+                last_frame_time = time.monotonic()
                 continue
 
-            frame_bytes = buffer.tobytes()
-
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        except Exception as e:
-            logger.error(f"Error in generate_frames encoding/yielding: {e}")
-            break # Exit the generator loop for this client on error
+            profile = adapter.profile if adapter else None
+            if profile is not None:
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay) # This viewer's FPS cap; frames published meanwhile are skipped
+            seq, frame_bytes = broadcaster.wait_for_frame(last_seq, timeout=1.0, profile=profile)
+            last_seq = seq
+            if frame_bytes is None:
+                now = time.monotonic()
+                if (now - last_frame_time) > stream_error_after and (now - last_error_sent) > stream_error_repeat:
+                    logger.warning("Video stream: No frames from capture. Sending error image.")
+                    error_img = _status_image_jpeg("Stream Error", (180, 240), (0, 0, 255))
+                    if error_img:
+                        yield _mjpeg_part(error_img)
+                    last_error_sent = now
+                continue
 
-        # Control frame rate of the stream (e.g., target 10-20 FPS for web view)
-        # This sleep is important to not overload the Pi or the network.
-        time.sleep(1/20) # Approx 20 FPS
+            last_frame_time = time.monotonic()
+            if profile is None:
+                # The broadcaster caps the frame rate, so no sleep is needed here.
+                yield _mjpeg_part(frame_bytes)
+                continue
+            next_due = last_frame_time + 1.0 / profile.fps
+            yield _mjpeg_part(frame_bytes)
+            # The server's write blocks once the socket buffer is full, so this is the time the client took
+            sent_at = time.monotonic()
+            metrics.STREAM_BYTES.labels(profile.name).inc(len(frame_bytes))
+            step = adapter.frame_sent(sent_at - last_frame_time, sent_at)
+            if step:
+                metrics.STREAM_PROFILE_CHANGES.labels("down" if step > 0 else "up").inc()
+                logger.info(f"Video stream: viewer {viewer} switched to profile {adapter.profile.name} "
+                            f"({adapter.profile.width or 'full'} px, {adapter.profile.fps:g} FPS, "
+                            f"quality {adapter.profile.quality}).")
+    finally:
+        # Runs when the client disconnects and Werkzeug closes the generator
+        broadcaster.remove_viewer()
+
+def _stream_response(broadcaster):
+    """
+    MJPEG response for one viewer. Query parameters: ?profile= (a
+    frame_broadcaster.STREAM_PROFILES name), optional width=, fps= and
+    quality= overrides, and adapt=0 to keep the profile even if the viewer
+    falls behind.
+    """
+    try:
+        profile = stream_profile(request.args.get('profile', STREAM_DEFAULT_PROFILE),
+                                 width=request.args.get('width', type=int), fps=request.args.get('fps', type=float),
+                                 quality=request.args.get('quality', type=int))
+    except ValueError as e:
+        return f"Error: {e}", 400
+    adaptive = request.args.get('adapt', '1') not in ('0', 'false', 'no')
+    sock = request.environ.get('werkzeug.socket')
+    if sock is not None and STREAM_SEND_BUFFER:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_SEND_BUFFER)
+        except OSError as e:
+            logger.debug(f"Video stream: could not set the send buffer size: {e}")
+    return Response(generate_frames(broadcaster, StreamAdapter(profile, adaptive), viewer=request.remote_addr),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/video_feed')
 def video_feed():
     """Video streaming route."""
-    if not _get_frame_function: # Check if main_pi has set the provider
-        logger.error("Video feed request but frame provider not set by main application.")
-        return "Error: Video service not ready or frame provider not configured.", 503
-
-    return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+    if not _frame_broadcaster: # Check if main_pi has set the broadcaster
+        logger.error("Video feed request but frame broadcaster not set by main application.")
+        return "Error: Video service not ready or frame broadcaster not configured.", 503
+    return _stream_response(_frame_broadcaster)
+
+@app.route('/video_feed/<source_id>')
+def source_video_feed(source_id):
+    """Video streaming route of one camera source."""
+    broadcaster = _source_broadcasters.get(source_id)
+    if broadcaster is None:
+        return f"Error: Unknown video source '{source_id}'.", 404
+    return _stream_response(broadcaster)
+
+@app.route('/api/sources', methods=['GET'])
+@login_required
+def get_sources():
+    """Per-source capture FPS, frame counts, fair-queue share and capture -> OCR latency."""
+    stats = _source_stats() if _source_stats else {}
+    return jsonify({"sources": [dict(s, id=source_id, video_feed=url_for('source_video_feed', source_id=source_id))
+                                for source_id, s in stats.items()]})
 
 @app.route('/')
 @login_required
@@ -135,18 +292,170 @@ def index():
     """Serves the admin panel HTML page, passing the current processing status."""
     return render_template('admin_panel.html', processing_status=app.processing_active)
 
+_MAX_EPOCH_MS = 253402300799999 # 9999-12-31T23:59:59.999Z, the last instant datetime can represent
+
+def _parse_time_arg(value):
+    """
+    ?from= / ?to= value (epoch milliseconds or an ISO timestamp) -> epoch_ms, None if absent.
+    Raises ValueError for unparseable values and for times before 1970 or after year 9999.
+    """
+    if value is None or value == '':
+        return None
+    if value.lstrip('-').isdigit():
+        epoch_ms = int(value)
+    else:
+        try:
+            epoch_ms = db_utils.to_epoch_ms(value)
+        except (OverflowError, OSError) as e:
+            raise ValueError(f"Time out of range: {value}") from e
+    if not 0 <= epoch_ms <= _MAX_EPOCH_MS:
+        raise ValueError(f"Time out of range: {value}")
+    return epoch_ms
+
+def _page_args():
+    """
+    (before, before_id, limit) from ?before=&before_id=&limit=. Raises ValueError for values that
+    are not integers and for a cursor without both parts: before alone would skip the rows that
+    share the previous page's last millisecond.
+    """
+    def int_arg(name, default=None):
+        value = request.args.get(name)
+        return default if value is None or value == '' else int(value)
+    before, before_id = int_arg('before'), int_arg('before_id')
+    if (before is None) != (before_id is None):
+        raise ValueError("before and before_id must be given together")
+    return before, before_id, min(max(int_arg('limit', 50), 1), MAX_PAGE_SIZE)
+
 @app.route('/api/plates', methods=['GET'])
 @login_required
 def get_plates_data():
-    """API endpoint to get detected plates from the database."""
-    # Ensure db_utils is correctly imported and DB_NAME_FLASK is set
-    conn = db_utils.create_connection(DB_NAME_FLASK)
-    if conn:
-        plates = db_utils.get_recent_plates(conn, limit=50) # Get recent 50
-        conn.close()
-        plates_list = [{"plate_number": p[0], "timestamp": p[1], "confidence": f"{p[2]:.2f}"} for p in plates]
+    """
+    API endpoint to get detected plates from the database, newest first.
+    Page back through history with ?before=<epoch_ms>&before_id=<id>&limit=<n>, passing
+    the epoch_ms and id of the last plate of the previous page (both are required).
+    """
+    try:
+        before, before_id, limit = _page_args()
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters; give before and before_id together"}), 400
+
+    with read_connection() as conn:
+        plates = db_utils.get_plates_page(conn, before=before, before_id=before_id, limit=limit) if conn else None
+    if plates is not None:
+        plates_list = [{"id": p[0], "plate_number": p[1], "timestamp": p[2], "confidence": f"{p[3]:.2f}",
+                        "epoch_ms": p[4], "source": p[5], "snapshot_hash": p[6]} for p in plates]
         return jsonify(plates_list)
-    return jsonify({"error": "Could not retrieve data from database"}), 500
+    return jsonify({"error": "Could not retrieve data from database"}), 503
+
+def _sse_message(event, data, event_id=None):
+    lines = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{lines}event: {event}\ndata: {data}\n\n"
+
+def generate_events(hub, last_id):
+    """
+    Event stream for one dashboard: the current status first, then every event after
+    last_id as it is published, with a keep-alive comment every SSE_HEARTBEAT_INTERVAL.
+    """
+    hub.add_subscriber()
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n"
+        yield _sse_message('status', json.dumps({"processing_active": app.processing_active}, separators=(",", ":")))
+        while True:
+            events, missed = hub.wait_for_events(last_id, timeout=SSE_HEARTBEAT_INTERVAL)
+            if missed:
+                # Events after last_id are gone (restart or long disconnect): the page reloads its list
+                last_id = hub.latest_id()
+                yield _sse_message('reset', '{}', last_id)
+                continue
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            yield ''.join(_sse_message(e.event, e.data, e.id) for e in events)
+            last_id = events[-1].id
+    finally:
+        hub.remove_subscriber()
+
+@app.route('/api/plates/stream')
+@login_required
+def plates_stream():
+    """
+    Server-Sent Events: 'plate' for every new detection, 'status' when processing starts or
+    stops, 'reset' when the client has to reload. Resumes after Last-Event-ID on reconnect.
+    """
+    hub = _event_hub
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else hub.latest_id()
+    except ValueError:
+        last_id = hub.latest_id()
+    return Response(stream_with_context(generate_events(hub, last_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/plates/search', methods=['GET'])
+@login_required
+def search_plates():
+    """
+    Plate search, newest first: ?q=<text>&mode=prefix|substring|fuzzy (default substring).
+    fuzzy also matches OCR look-alikes (O/0, I/1, B/8, ...). Accepts the same
+    ?before=&before_id=&limit= paging as /api/plates and ?from= / ?to= time filters.
+    """
+    query = request.args.get('q', '').strip()
+    mode = request.args.get('mode', 'substring').lower()
+    if not query:
+        return jsonify({"error": "Missing search text ?q="}), 400
+    if mode not in db_utils.SEARCH_MODES:
+        return jsonify({"error": f"Unknown mode '{mode}', use prefix, substring or fuzzy"}), 400
+    try:
+        start = _parse_time_arg(request.args.get('from'))
+        end = _parse_time_arg(request.args.get('to'))
+        before, before_id, limit = _page_args()
+    except ValueError:
+        return jsonify({"error": "Invalid time or pagination parameters"}), 400
+
+    with read_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Could not retrieve data from database"}), 503
+        plates = db_utils.search_plates(conn, query, mode=mode, start=start, end=end,
+                                        before=before, before_id=before_id, limit=limit)
+    return jsonify([{"id": p[0], "plate_number": p[1], "timestamp": p[2], "confidence": f"{p[3]:.2f}",
+                     "epoch_ms": p[4], "source": p[5], "snapshot_hash": p[6]} for p in plates])
+
+@app.route('/api/stats', methods=['GET'])
+@login_required
+def get_stats():
+    """
+    Traffic stats from the precomputed rollups: ?bucket=hour|day&from=&to= (epoch ms or ISO).
+    Defaults to the last 24 hours (hour) or 30 days (day).
+    """
+    bucket = request.args.get('bucket', 'hour').lower()
+    if bucket not in db_utils.ROLLUP_BUCKETS:
+        return jsonify({"error": f"Unknown bucket '{bucket}', use hour or day"}), 400
+    try:
+        start = _parse_time_arg(request.args.get('from'))
+        end = _parse_time_arg(request.args.get('to'))
+    except ValueError:
+        return jsonify({"error": "Invalid from/to value, use epoch milliseconds or an ISO timestamp"}), 400
+    if start is None:
+        window = STATS_DEFAULT_HOURS if bucket == 'hour' else STATS_DEFAULT_DAYS * 24
+        start = int((time.time() - window * 3600) * 1000)
+    try:
+        start = db_utils.bucket_start(start, bucket) # Include the bucket that `from` falls in
+    except (OverflowError, OSError, ValueError): # Local time of the edge of the range not representable
+        return jsonify({"error": "from is out of range"}), 400
+
+    with read_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Could not retrieve data from database"}), 503
+        rollups = db_utils.get_rollups(conn, bucket, start=start, end=end)
+    return jsonify({
+        "bucket": bucket,
+        "confidence_bins": [round(i / db_utils.CONFIDENCE_BINS, 2) for i in range(db_utils.CONFIDENCE_BINS)],
+        "buckets": [{"start": datetime.fromtimestamp(b_start / 1000).isoformat(), "epoch_ms": b_start,
+                     "detections": detections, "unique_plates": unique,
+                     "avg_confidence": round(avg, 4) if avg is not None else None,
+                     "confidence_histogram": histogram}
+                    for b_start, detections, unique, avg, histogram in rollups],
+    })
 
 @app.route('/api/control/status', methods=['GET'])
 @login_required
@@ -156,17 +465,61 @@ def get_status():
 @app.route('/api/control/start', methods=['POST'])
 @login_required
 def start_processing():
-    app.processing_active = True
+    set_processing_active(True)
     logger.info("Admin command: START processing (flag set to True)")
     return jsonify({"status": "processing_started", "processing_active": app.processing_active})
 
 @app.route('/api/control/stop', methods=['POST'])
 @login_required
 def stop_processing():
-    app.processing_active = False
+    set_processing_active(False)
     logger.info("Admin command: STOP processing (flag set to False)")
     return jsonify({"status": "processing_stopped", "processing_active": app.processing_active})
 
+@app.route('/snapshots/<snapshot_hash>')
+@login_required
+def get_snapshot(snapshot_hash):
+    """
+    A stored plate crop or scene snapshot by content hash; ?w=<px> serves a
+    thumbnail (made on first request, then cached). The bytes behind a hash
+    never change, so the hash is the ETag and browsers may cache it for good.
+    """
+    width = request.args.get('w', type=int)
+    if width is not None and width <= 0:
+        return jsonify({"error": "w must be a positive width"}), 400
+    if width is not None:
+        width = snapshot_store.thumb_width(width)
+    etag = f"{snapshot_hash}-w{width}" if width else snapshot_hash
+    if request.if_none_match.contains(etag):
+        # Answered without touching the disk
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = SNAPSHOT_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+    store = get_snapshot_store()
+    path = store.thumbnail(snapshot_hash, width) if width else store.get(snapshot_hash)
+    if path is None:
+        return jsonify({"error": "Unknown or expired snapshot"}), 404
+    try:
+        response = send_file(os.path.abspath(path), mimetype='image/jpeg', etag=etag, max_age=SNAPSHOT_MAX_AGE,
+                             conditional=True)
+    except FileNotFoundError: # Evicted between the lookup and the read
+        return jsonify({"error": "Unknown or expired snapshot"}), 404
+    # Behind the login, so only the browser may keep a copy
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text-format metrics of this device (stage latency histograms, counters, gauges)."""
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 # New routes for admin panel functionalities
 @app.route('/logs')
 @login_required
@@ -203,24 +556,77 @@ def settings():
                            mqtt_broker=current_mqtt_broker, 
                            mqtt_topic=current_mqtt_topic)
 
+def _export_rows(fmt, start, end):
+    """
+    Yields the export body (CSV or NDJSON text) one keyset page at a time. The read connection
+    is only held while a page is fetched, so slow downloads don't tie up the read pool.
+    """
+    if fmt == 'csv':
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(("Plate Number", "Timestamp", "Confidence"))
+        yield buf.getvalue()
+    after = None
+    while True:
+        with read_connection() as conn:
+            if not conn:
+                logger.error("Export: Database connection failed.")
+                return
+            rows = db_utils.get_plates_range(conn, start=start, end=end, after=after, limit=EXPORT_CHUNK_ROWS)
+        if not rows:
+            return
+        after = (rows[-1][4], rows[-1][0])
+        if fmt == 'csv':
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows((p, ts, f"{conf:.2f}") for _, p, ts, conf, _ in rows)
+            yield buf.getvalue()
+        else:
+            yield ''.join(json.dumps({"plate_number": p, "timestamp": ts, "confidence": round(conf, 4),
+                                      "epoch_ms": ms}) + '\n' for _, p, ts, conf, ms in rows)
+        if len(rows) < EXPORT_CHUNK_ROWS:
+            return
+
+def _gzip_stream(chunks):
+    """Compresses a stream of text chunks into a single gzip member as they are produced."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31 -> gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
 @app.route('/export')
 @login_required
 def export_logs():
-    conn = db_utils.create_connection(DB_NAME_FLASK)
-    if not conn:
-        logger.error("Export: Database connection failed.")
-        return "Database connection failed", 500
- 
-    plates = db_utils.get_all_plates(conn)
-    conn.close()
- 
-    if not plates:
-         logger.warning("Export: No data to export.")
-         return "No data to export", 404 # Browser might show this message
- 
-    csv_data = [("Plate Number", "Timestamp", "Confidence")]  # Header
-    csv_data.extend(plates)
-    # ... rest of your code
+    """
+    Streams the detections as a download, oldest first.
+    ?format=csv (default) or ndjson, ?gzip=1 to compress on the fly, and ?from= / ?to= (epoch ms
+    or ISO timestamps) to limit the time range. Rows are read and sent in chunks, so memory use
+    does not grow with the table and the first bytes go out immediately.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return f"Unsupported export format '{fmt}', use csv or ndjson", 400
+    try:
+        start = _parse_time_arg(request.args.get('from'))
+        end = _parse_time_arg(request.args.get('to'))
+    except ValueError:
+        return "Invalid from/to value, use epoch milliseconds or an ISO timestamp", 400
+    use_gzip = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"plates_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    rows = _export_rows(fmt, start, end)
+    if use_gzip:
+        body = _gzip_stream(rows)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        body = (chunk.encode('utf-8') for chunk in rows)
+    logger.info(f"Export: streaming {filename} (from={start}, to={end}).")
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/clear_data', methods=['POST'])
 @login_required
@@ -252,8 +658,13 @@ def logout():
     session.pop('logged_in', None)
     return redirect(url_for('login'))
 
-def run_flask_app(host='0.0.0.0', port=5000):
-    """Runs the Flask app."""
+def run_flask_app(host='0.0.0.0', port=5000, mode=None):
+    """Runs the Flask app, in SERVER_MODE unless mode is given."""
+    if (mode or SERVER_MODE) == "asgi":
+        import asgi_server # Only needed (with uvicorn) in this mode
+        if asgi_server.run_asgi_app(host, port):
+            return
+        logger.warning("Falling back to the threaded server.")
     logger.info(f"Starting Flask server on {host}:{port}")
     # threaded=True allows Flask to handle multiple requests concurrently (e.g., API and video stream)
     # use_reloader=False is important when Flask is run in a thread managed by another script.
@@ -264,11 +675,17 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     # Make sure db_utils can be imported if you use its functions here for testing
     # e.g. import db_utils as dbu_test
-    # Setup a dummy frame provider for testing /video_feed
-    def dummy_frame_getter():
-        img = np.zeros((480, 640, 3), dtype=np.uint8)
-        cv2.putText(img, f"Flask Test Mode: {time.strftime('%H:%M:%S')}", (50,50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255,255,0), 2)
-        return img
-    set_frame_provider(dummy_frame_getter)
-
-    run_flask_app(debug=True) # debug=True enables reloader for standalone
\ No newline at end of file
+    # Feed a dummy broadcaster for testing /video_feed
+    from frame_broadcaster import FrameBroadcaster
+    test_broadcaster = FrameBroadcaster()
+
+    def publish_dummy_frames():
+        while True:
+            img = np.zeros((480, 640, 3), dtype=np.uint8)
+            cv2.putText(img, f"Flask Test Mode: {time.strftime('%H:%M:%S')}", (50,50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255,255,0), 2)
+            test_broadcaster.publish(img)
+            time.sleep(1/30)
+    threading.Thread(target=publish_dummy_frames, daemon=True).start()
+    set_frame_broadcaster(test_broadcaster)
+
+    run_flask_app()
@@ -0,0 +1,294 @@
+import collections
+import logging
+import threading
+import time
+
+import cv2
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+STREAM_MAX_FPS = 20 # Frames offered to viewers per second (was the per-client sleep in generate_frames)
+STREAM_JPEG_QUALITY = 75
+# Viewer profiles, best first: (max width in px, 0 = camera resolution; FPS cap; JPEG quality).
+# "low" and "min" fit a 1 Mbit/s link with room to spare.
+STREAM_PROFILES = collections.OrderedDict([
+    ("full", (0, 20, 75)),
+    ("high", (960, 12, 70)),
+    ("medium", (640, 6, 60)),
+    ("low", (480, 4, 50)),
+    ("min", (320, 2, 40)),
+])
+STREAM_MAX_ENCODINGS = 8 # Distinct (width, quality) encodings kept per broadcaster
+ADAPT_DEGRADE_BUSY = 0.6 # Step down once sending takes this fraction of the frame interval (moving average)
+ADAPT_UPGRADE_BUSY = 0.2 # Below this, the next better profile is tried after ADAPT_UPGRADE_AFTER seconds
+ADAPT_UPGRADE_AFTER = 10.0
+ADAPT_UPGRADE_AFTER_MAX = 300.0 # Each step up that had to be undone doubles the wait, up to this
+ADAPT_SETTLE = 2.0 # Seconds after a change before the next step down
+# --- End Defaults ---
+
+_ENCODE_SECONDS = metrics.STAGE_SECONDS.labels("stream_encode")
+
+# What one viewer asked for: name is a STREAM_PROFILES key or "custom"
+StreamProfile = collections.namedtuple("StreamProfile", ["name", "width", "fps", "quality"])
+
+
+def stream_profile(name=None, width=None, fps=None, quality=None):
+    """
+    Builds a StreamProfile from a preset name (default "full") with optional
+    width/fps/quality overrides. Widths are rounded to multiples of 16 and
+    qualities to multiples of 5, so near-identical requests share an encoding.
+    Raises ValueError for an unknown name or out-of-range values.
+    """
+    name = (name or "full").lower()
+    if name not in STREAM_PROFILES:
+        raise ValueError(f"Unknown stream profile '{name}', use one of: {', '.join(STREAM_PROFILES)}")
+    base_width, base_fps, base_quality = STREAM_PROFILES[name]
+    if width is None and fps is None and quality is None:
+        return StreamProfile(name, base_width, base_fps, base_quality)
+    width = base_width if width is None else int(width)
+    fps = base_fps if fps is None else float(fps)
+    quality = base_quality if quality is None else int(quality)
+    if width < 0 or not 0 < fps <= 60 or not 5 <= quality <= 100:
+        raise ValueError("width must be >= 0, fps in (0, 60] and quality in [5, 100]")
+    width = (width + 8) // 16 * 16 if width else 0
+    return StreamProfile("custom", width, fps, quality // 5 * 5)
+
+
+def profile_ladder(profile):
+    """The profile followed by the presets below it, each clamped to at most the profile's width, fps and quality."""
+    def size(p):
+        return (p.width or float("inf"), p.fps, p.quality)
+    ladder = [profile]
+    for name, (width, fps, quality) in STREAM_PROFILES.items():
+        width = min(width or float("inf"), profile.width or float("inf"))
+        step = StreamProfile(name, 0 if width == float("inf") else int(width), min(fps, profile.fps),
+                             min(quality, profile.quality))
+        if size(step) < size(ladder[-1]) and step[1:] != ladder[-1][1:]:
+            ladder.append(step)
+    return ladder
+
+
+class StreamAdapter:
+    """
+    Picks the profile for one viewer and steps it down when the viewer can't keep up.
+
+    After every frame the stream reports how long handing it to the server
+    took. The server's write blocks once the socket's send buffer is full, so
+    on a link too slow for the profile the send time grows towards the frame
+    interval. When its moving average passes ADAPT_DEGRADE_BUSY of the interval
+    the viewer moves one step down profile_ladder(); after ADAPT_UPGRADE_AFTER
+    seconds below ADAPT_UPGRADE_BUSY it tries one step up again. A step up that
+    has to be undone doubles the wait before the next try.
+    """
+
+    def __init__(self, profile, adaptive=True):
+        self.ladder = profile_ladder(profile) if adaptive else [profile]
+        self.level = 0
+        self._busy = 0.0
+        self._changed_at = time.monotonic()
+        self._upgrade_after = ADAPT_UPGRADE_AFTER
+        self._probing = False # Last change was a step up that hasn't proven itself yet
+
+    @property
+    def profile(self):
+        return self.ladder[self.level]
+
+    def frame_sent(self, send_seconds, now=None):
+        """Records one frame's send time; returns +1 / -1 when the profile stepped down / up, else 0."""
+        now = time.monotonic() if now is None else now
+        busy = min(send_seconds * self.profile.fps, 2.0)
+        self._busy += 0.2 * (busy - self._busy)
+        since = now - self._changed_at
+        if self._busy > ADAPT_DEGRADE_BUSY and self.level + 1 < len(self.ladder) and since >= ADAPT_SETTLE:
+            if self._probing:
+                self._upgrade_after = min(self._upgrade_after * 2, ADAPT_UPGRADE_AFTER_MAX)
+            self._change(1, now, probing=False)
+            return 1
+        if self._probing and since >= self._upgrade_after:
+            self._probing = False
+            self._upgrade_after = ADAPT_UPGRADE_AFTER
+        if self._busy < ADAPT_UPGRADE_BUSY and self.level > 0 and since >= self._upgrade_after:
+            self._change(-1, now, probing=True)
+            return -1
+        return 0
+
+    def _change(self, step, now, probing):
+        self.level += step
+        self._changed_at = now
+        self._probing = probing
+        self._busy = (ADAPT_DEGRADE_BUSY + ADAPT_UPGRADE_BUSY) / 2 # Judge the new profile on its own frames
+
+
+class _Encoding:
+    """Most recent JPEG of one (width, quality); its lock makes concurrent viewers wait for one encode."""
+
+    __slots__ = ("lock", "seq", "jpeg")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.jpeg = None
+
+
+class FrameBroadcaster:
+    """
+    Encode-once, fan-out source of JPEG frames for the MJPEG stream.
+
+    The capture side calls publish() with every new frame; each accepted frame
+    gets a sequence number. Viewers call wait_for_frame() with the last sequence
+    they sent and block on a condition until a newer one exists. The first viewer
+    to ask for a sequence encodes it, every other viewer gets the same cached
+    bytes, so encoder work depends on the stream FPS, not on the viewer count.
+
+    Viewers may ask for a smaller width and lower JPEG quality (a
+    StreamProfile): each distinct (width, quality) is downscaled and encoded
+    once per frame and shared by every viewer using it.
+    """
+
+    def __init__(self, max_fps=STREAM_MAX_FPS, jpeg_quality=STREAM_JPEG_QUALITY):
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.jpeg_quality = int(jpeg_quality)
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._last_publish = 0.0
+
+        self._encode_lock = threading.Lock() # Guards the encoding table and the scaled-frame cache
+        self._encodings = collections.OrderedDict() # (width, quality) -> _Encoding, least recently used first
+        self._scaled = {} # width -> (seq, downscaled frame) of the current frame
+
+        self._viewers = 0
+        self._listeners = []
+        self.frames_published = 0
+        self.frames_encoded = 0
+
+    def publish(self, frame):
+        """
+        Offers a new frame to viewers. The frame is kept by reference, so the
+        caller must not modify it afterwards. Frames arriving faster than
+        max_fps are skipped; returns True if the frame was accepted.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if self._frame is not None and (now - self._last_publish) < self.min_interval:
+                return False
+            self._frame = frame
+            self._seq += 1
+            self._last_publish = now
+            self.frames_published += 1
+            self._cond.notify_all()
+        self._notify_listeners()
+        return True
+
+    def clear(self):
+        """Drops the current frame (paused / camera error) and wakes up waiting viewers."""
+        with self._cond:
+            if self._frame is None:
+                return
+            self._frame = None
+            self._seq += 1
+            self._cond.notify_all()
+        self._notify_listeners()
+
+    def add_listener(self, callback):
+        """callback() is called (on the publishing thread) after every new or cleared frame; it must not block."""
+        with self._cond:
+            self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        with self._cond:
+            self._listeners = [c for c in self._listeners if c is not callback]
+
+    def _notify_listeners(self):
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Frame broadcaster listener failed: {e}")
+
+    def latest_frame(self):
+        """Returns (seq, frame) for the most recent frame without copying it; frame may be None."""
+        with self._cond:
+            return self._seq, self._frame
+
+    def wait_for_frame(self, last_seq, timeout=1.0, profile=None):
+        """
+        Blocks until a frame newer than last_seq is published or timeout expires.
+        Returns (seq, jpeg_bytes) at the profile's width and quality, which
+        jpeg_quality caps (default: full size at jpeg_quality). jpeg_bytes is None on timeout, when the
+        current frame was cleared, or if encoding failed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != last_seq, timeout)
+            seq, frame = self._seq, self._frame
+        if seq == last_seq or frame is None:
+            return seq, None
+        return seq, self.encode(seq, frame, profile)
+
+    def encode(self, seq, frame, profile=None):
+        """JPEG bytes of frame number seq (from latest_frame()) at the profile's width and quality, or None."""
+        if profile is None:
+            return self._encode(seq, frame, 0, self.jpeg_quality)
+        return self._encode(seq, frame, profile.width, min(profile.quality, self.jpeg_quality))
+
+    def _encode(self, seq, frame, width, quality):
+        if width >= frame.shape[1]:
+            width = 0 # Never upscale; share the full-size encoding
+        with self._encode_lock:
+            entry = self._encodings.get((width, quality))
+            if entry is None:
+                entry = self._encodings[(width, quality)] = _Encoding()
+                if len(self._encodings) > STREAM_MAX_ENCODINGS:
+                    self._encodings.popitem(last=False)
+            else:
+                self._encodings.move_to_end((width, quality))
+        with entry.lock:
+            # Another viewer may already have encoded this (or a newer) frame
+            if entry.seq >= seq and entry.jpeg is not None:
+                return entry.jpeg
+            start = time.perf_counter()
+            ret_enc, buffer = cv2.imencode('.jpg', self._scaled_frame(seq, frame, width),
+                                           [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            _ENCODE_SECONDS.observe(time.perf_counter() - start)
+            if not ret_enc:
+                logger.warning("Video stream: JPEG encoding failed.")
+                return None
+            entry.seq = seq
+            entry.jpeg = buffer.tobytes()
+            self.frames_encoded += 1
+            return entry.jpeg
+
+    def _scaled_frame(self, seq, frame, width):
+        """The frame downscaled to width (0: as is), resized once per frame for all qualities at that width."""
+        if not width:
+            return frame
+        with self._encode_lock:
+            cached_seq, scaled = self._scaled.get(width, (0, None))
+        if cached_seq == seq:
+            return scaled
+        height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+        scaled = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        with self._encode_lock:
+            if self._scaled.get(width, (0, None))[0] < seq:
+                self._scaled[width] = (seq, scaled)
+            self._scaled = {w: v for w, v in self._scaled.items() if v[0] >= seq} # Forget older frames
+        return scaled
+
+    def add_viewer(self):
+        with self._cond:
+            self._viewers += 1
+            return self._viewers
+
+    def remove_viewer(self):
+        with self._cond:
+            self._viewers -= 1
+            return self._viewers
+
+    @property
+    def viewer_count(self):
+        with self._cond:
+            return self._viewers
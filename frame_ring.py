@@ -0,0 +1,173 @@
+import logging
+import os
+import time
+import collections
+import itertools
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+DEFAULT_SLOTS = 8
+# --- End Defaults ---
+
+_MAGIC = 0x4C50445249 # "LPDRI"
+_VERSION = 1
+# Global header fields (int64 each)
+_H_MAGIC, _H_VERSION, _H_SLOTS, _H_HEIGHT, _H_WIDTH, _H_CHANNELS, _H_LATEST = range(7)
+_HEADER_FIELDS = 8
+_ALIGN = 64
+_ring_counter = itertools.count(1)
+
+# Handle passed between processes instead of the pixels themselves.
+FrameRef = collections.namedtuple("FrameRef", ["ring_name", "seq", "timestamp"])
+
+
+def _data_offset(slots):
+    # global header + per-slot seq (uint64) + per-slot timestamp (float64), cache-line aligned
+    offset = 8 * _HEADER_FIELDS + 16 * slots
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class SharedFrameRing:
+    """
+    Ring of preallocated frame slots in multiprocessing.shared_memory.
+
+    A single writer (the capture stage) copies each frame into the next slot
+    and readers in any process attach by name. Every slot carries a sequence
+    number and a capture timestamp. The slot sequence works as a seqlock: it is
+    odd while the writer is filling the slot and 2*seq once the frame is
+    complete, so a reader that sees the same even value before and after
+    reading knows the pixels were not overwritten underneath it.
+
+    Frames are uint8 arrays of one fixed (height, width, channels) shape, set
+    when the ring is created.
+    """
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        buf = shm.buf
+        self._header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=buf, offset=0)
+        if int(self._header[_H_MAGIC]) != _MAGIC or int(self._header[_H_VERSION]) != _VERSION:
+            raise ValueError(f"Shared memory block '{shm.name}' is not a frame ring")
+        self.slots = int(self._header[_H_SLOTS])
+        self.frame_shape = (int(self._header[_H_HEIGHT]), int(self._header[_H_WIDTH]), int(self._header[_H_CHANNELS]))
+        self._seqs = np.ndarray((self.slots,), dtype=np.uint64, buffer=buf, offset=8 * _HEADER_FIELDS)
+        self._stamps = np.ndarray((self.slots,), dtype=np.float64, buffer=buf, offset=8 * _HEADER_FIELDS + 8 * self.slots)
+        self._frames = np.ndarray((self.slots,) + self.frame_shape, dtype=np.uint8, buffer=buf,
+                                  offset=_data_offset(self.slots))
+        self._next_seq = int(self._header[_H_LATEST]) + 1
+
+    @classmethod
+    def create(cls, frame_shape, slots=DEFAULT_SLOTS, name=None):
+        """Allocates a new ring for frames of frame_shape ((h, w) or (h, w, c))."""
+        if len(frame_shape) == 2:
+            frame_shape = (frame_shape[0], frame_shape[1], 1)
+        height, width, channels = (int(v) for v in frame_shape)
+        size = _data_offset(slots) + slots * height * width * channels
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf, offset=0)
+        header[:] = 0
+        header[_H_SLOTS] = slots
+        header[_H_HEIGHT], header[_H_WIDTH], header[_H_CHANNELS] = height, width, channels
+        header[_H_VERSION] = _VERSION
+        np.ndarray((slots,), dtype=np.uint64, buffer=shm.buf, offset=8 * _HEADER_FIELDS)[:] = 0
+        header[_H_MAGIC] = _MAGIC # Written last: the ring is valid from here on
+        del header
+        logger.info(f"Created shared frame ring '{shm.name}': {slots} slots of {width}x{height}x{channels} "
+                    f"({size / 1e6:.1f} MB).")
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to an existing ring created by another process (or this one)."""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+        except TypeError:
+            # Older Pythons register every attach with the resource tracker, which
+            # unlinks the block when the tracker exits. Processes spawned from the
+            # creator share its tracker, so that is harmless; an independent
+            # process would start its own tracker, so unregister the block there.
+            shared_tracker = getattr(resource_tracker._resource_tracker, "_fd", None) is not None
+            shm = shared_memory.SharedMemory(name=name)
+            if not shared_tracker:
+                resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def accepts(self, frame):
+        """True if frame has the ring's shape and dtype."""
+        shape = frame.shape if frame.ndim == 3 else frame.shape + (1,)
+        return shape == self.frame_shape and frame.dtype == np.uint8
+
+    def write(self, frame, timestamp=None):
+        """Copies frame into the next slot and returns its FrameRef. Single writer only."""
+        if not self.accepts(frame):
+            raise ValueError(f"Frame shape {frame.shape} does not match ring shape {self.frame_shape}")
+        seq = self._next_seq
+        slot = (seq - 1) % self.slots
+        timestamp = time.time() if timestamp is None else timestamp
+        self._seqs[slot] = 2 * seq - 1 # Odd: write in progress
+        np.copyto(self._frames[slot], frame.reshape(self.frame_shape))
+        self._stamps[slot] = timestamp
+        self._seqs[slot] = 2 * seq # Even: frame complete
+        self._header[_H_LATEST] = seq
+        self._next_seq = seq + 1
+        return FrameRef(self.name, seq, timestamp)
+
+    def latest_seq(self):
+        return int(self._header[_H_LATEST])
+
+    def is_valid(self, seq):
+        """True while frame seq is still in its slot (not overwritten or being rewritten)."""
+        return seq > 0 and int(self._seqs[(seq - 1) % self.slots]) == 2 * seq
+
+    def read(self, seq, copy=True):
+        """
+        Returns (frame, timestamp) for frame seq, or None if it has already been
+        overwritten. With copy=False the frame is a view into shared memory:
+        no bytes are copied, but the caller must check is_valid(seq) after
+        using it, because the writer may reuse the slot at any time.
+        """
+        slot = (seq - 1) % self.slots
+        before = int(self._seqs[slot])
+        if seq <= 0 or before != 2 * seq:
+            return None
+        frame = self._frames[slot]
+        if copy:
+            frame = frame.copy()
+        timestamp = float(self._stamps[slot])
+        if int(self._seqs[slot]) != before:
+            return None
+        if self.frame_shape[2] == 1:
+            frame = frame[:, :, 0]
+        return frame, timestamp
+
+    def read_latest(self, copy=True):
+        """Returns (seq, frame, timestamp) for the newest complete frame, or None."""
+        seq = self.latest_seq()
+        result = self.read(seq, copy=copy) if seq else None
+        if result is None:
+            return None
+        return (seq,) + result
+
+    def close(self):
+        """Detaches from the shared memory; the creator also unlinks it."""
+        self._header = self._seqs = self._stamps = self._frames = None
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def new_ring_name(prefix="lpd_frames"):
+    """Shared memory name that is unique per process and call."""
+    return f"{prefix}_{os.getpid()}_{next(_ring_counter)}"
@@ -8,10 +8,13 @@ import logging
 #from . import mqtt_sub_laptop
 
 # Or if running main_laptop.py directly for testing:
-import tkinter_dash, mqtt_sub_laptop
+import tkinter_dash, mqtt_sub_laptop, aggregator
 
 # --- Configuration (from mqtt_sub_laptop and others) ---
 MQTT_BROKER_LAPTOP = "192.168.3.169" # Or RPi IP, ensure it matches mqtt_sub_laptop
+USE_AGGREGATOR = False # Store every Pi's events durably in AGGREGATOR_DB_FILE and show them once written
+AGGREGATOR_DB_FILE = "aggregated_plates.db"
+DATA_QUEUE_SIZE = 20000 # Messages buffered between the MQTT thread and the GUI; newer ones are dropped beyond this
 # --- End Configuration ---
 
 def main():
@@ -22,29 +25,38 @@ def main():
     logger.info("Starting Laptop Dashboard Application...")
 
     # 1. Create a queue for communication between MQTT thread and Tkinter GUI
-    data_q = queue.Queue()
+    # Bounded, so a burst the GUI can't keep up with costs dropped messages rather than memory
+    data_q = queue.Queue(maxsize=DATA_QUEUE_SIZE)
 
-    # 2. Initialize MQTT Subscriber
-    # Pass the RPi's IP or hostname to the subscriber
-    mqtt_sub_laptop.MQTT_BROKER_HOST = MQTT_BROKER_LAPTOP 
-    subscriber = mqtt_sub_laptop.MQTTSubscriber(data_queue=data_q)
-    
-    # Try to connect MQTT client
-    subscriber.connect() # This attempts connection, logs success/failure
-
-    # 3. Start MQTT client in a separate thread
-    # The subscriber.start() method itself starts a paho-mqtt internal loop thread.
-    # So, we just need to call it.
-    if subscriber.client: # Check if client object was created
-        subscriber.start() # This starts client.loop_start()
-        logger.info("MQTT subscriber thread started.")
+    if USE_AGGREGATOR:
+        # 2./3. Persistent-session subscriber writing to the local store; it feeds the dashboard after each commit
+        subscriber = aggregator.Aggregator(AGGREGATOR_DB_FILE, host=MQTT_BROKER_LAPTOP, data_queue=data_q)
+        if not subscriber.start():
+            logger.error(f"Could not open {AGGREGATOR_DB_FILE}. Aggregator will not run.")
+        dropped_count = lambda: subscriber.dashboard_dropped
     else:
-        logger.error("MQTT client object not created. Subscriber will not run.")
+        # 2. Initialize MQTT Subscriber
+        # Pass the RPi's IP or hostname to the subscriber
+        mqtt_sub_laptop.MQTT_BROKER_HOST = MQTT_BROKER_LAPTOP
+        subscriber = mqtt_sub_laptop.MQTTSubscriber(data_queue=data_q)
+
+        # Try to connect MQTT client
+        subscriber.connect() # This attempts connection, logs success/failure
+
+        # 3. Start MQTT client in a separate thread
+        # The subscriber.start() method itself starts a paho-mqtt internal loop thread.
+        # So, we just need to call it.
+        if subscriber.client: # Check if client object was created
+            subscriber.start() # This starts client.loop_start()
+            logger.info("MQTT subscriber thread started.")
+        else:
+            logger.error("MQTT client object not created. Subscriber will not run.")
+        dropped_count = lambda: subscriber.dropped
 
 
     # 4. Initialize Tkinter Dashboard
     root = tk.Tk()
-    dashboard_app = tkinter_dash.PlateDashboard(root, data_q)
+    dashboard_app = tkinter_dash.PlateDashboard(root, data_q, dropped_count=dropped_count)
     
     def on_app_closing():
         logger.info("Application closing sequence initiated.")
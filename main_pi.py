@@ -2,6 +2,8 @@ import cv2
 import time
 from datetime import datetime
 import logging
+import itertools
+import socket
 import threading
 
 # Import for LED control
@@ -10,44 +12,132 @@ from gpiozero.exc import GPIOZeroError # Broader GPIOZero exceptions
 
 # Import project modules
 import ocr_utils
-import db_utils
+import db_writer
+import retention
+import publisher
 import log_utils
 import mqtt_client_pi
 import tb_client
-import camera_utils
+import source_manager
 import flask_server
+import pipeline
+import motion_gate
+import plate_tracker
+import metrics
+import snapshot_store
+from frame_broadcaster import FrameBroadcaster
+from event_hub import EventHub
 
 # --- Configuration (Copied from previous, ensure consistency) ---
 # mosquitto_pub -d -q 1 -h mqtt.thingsboard.cloud -p 1883 -t v1/devices/me/telemetry -u "aaFRkbzTxvZr8vwbtsBC" -m "{temperature:25}"
 DB_FILE = "detected_plates.db"
+DB_BATCH_SIZE = 100 # Detections per commit at most
+DB_FLUSH_INTERVAL = 1.0 # seconds before a partial batch is committed
+RETENTION_MAX_AGE_DAYS = 90 # Detections older than this are deleted in the background (0 keeps everything)
+RETENTION_MAX_DB_MB = 0 # Oldest detections are deleted while the database is larger than this (0 disables)
+RETENTION_ARCHIVE_DIR = "archive" # Deleted detections are archived here as daily .csv.gz files, None disables
+RETENTION_INTERVAL = 3600 # seconds between retention passes
 LOG_FILE = "app.log"
 MQTT_BROKER = "broker.hivemq.com"
 MQTT_PORT = 1883
 MQTT_PLATE_TOPIC = "rpi/plate_detection/plate"
 THINGSBOARD_HOST_MAIN = "mqtt.thingsboard.cloud"
 THINGSBOARD_TOKEN_MAIN = "aaFRkbzTxvZr8vwbtsBC" # CRITICAL
+THINGSBOARD_TELEMETRY_TOPIC = "v1/devices/me/telemetry"
+# --- Outbound Publisher Configuration ---
+PUBLISH_SPOOL_FILE = "outbound_spool.db" # Messages for MQTT / ThingsBoard wait here while the uplink is down
+TB_BATCH_SIZE = 50 # Telemetry entries per ThingsBoard publish
+TB_BATCH_INTERVAL = 1.0 # seconds a detection may wait to share a ThingsBoard publish with others
 CAMERA_ID = 0
-FRAME_PROCESS_INTERVAL = 1 # seconds, for OCR processing
+# --- Source Configuration ---
+# One entry per camera: {"id": "lane1", "source": 0 | "rtsp://..." | "/path/video.mp4", "weight": 1.0}, optionally
+# with "motion_rois" and "loop" (files). Under load the OCR workers are shared in proportion to the weights.
+# None watches CAMERA_ID alone as source "cam<CAMERA_ID>".
+CAMERA_SOURCES = None
+FRAME_PROCESS_INTERVAL = 1 # seconds, fixed OCR throttle used when the motion gate is off
+# --- Motion Gate Configuration ---
+USE_MOTION_GATE = True # Run OCR only when something moves in the lane
+MOTION_ROIS = None # Regions to watch as (x, y, w, h) fractions of the frame, e.g. [(0.0, 0.4, 1.0, 0.6)]; None = whole frame
+MOTION_OCR_INTERVAL = 0.5 # seconds between OCR runs while there is motion
+MOTION_HOLD_TIME = 2.0 # seconds to keep running OCR after the motion stops
+MOTION_STATIC_RECHECK_INTERVAL = 0 # seconds between OCR runs on a static scene, 0 disables
+# --- Pipeline Configuration ---
+OCR_WORKERS = 2 # Number of parallel OCR workers
+OCR_WORKER_MODE = "thread" # "thread" (shared reader) or "process" (one reader per worker process)
+FRAME_QUEUE_SIZE = 4 # Frames waiting for OCR; the oldest is dropped when full
+USE_SHARED_FRAME_RING = True # Process mode: hand frames to workers via shared memory instead of pickling
+STATS_LOG_INTERVAL = 30 # seconds between pipeline stats log lines
+# --- Plate Localization Configuration ---
+USE_PLATE_LOCALIZER = True # OCR only rectified plate candidates instead of the whole frame
+PLATE_DETECTOR_MODEL = None # Optional path to a single-class ONNX plate detector (used instead of contours)
+LOCALIZER_FULL_FRAME_FALLBACK = False # OCR the whole frame when no plate candidate is found
+# --- OCR Cache Configuration (plate crops only, needs the localizer) ---
+USE_OCR_CACHE = True # Reuse the OCR result of a near-identical plate crop (e.g. a car waiting at the barrier)
+OCR_CACHE_TTL = 5.0 # seconds a cached result is reused before the plate is read again
+OCR_CACHE_MAX_DISTANCE = 4 # pHash bits (of 64) two crops may differ by and still count as the same
+OCR_CACHE_SIZE = 256 # Cached crops per OCR process
+OCR_OPTIONS = {
+    "localizer": {"onnx_model_path": PLATE_DETECTOR_MODEL} if USE_PLATE_LOCALIZER else None,
+    "full_frame_fallback": LOCALIZER_FULL_FRAME_FALLBACK,
+    "cache": {"ttl": OCR_CACHE_TTL, "max_distance": OCR_CACHE_MAX_DISTANCE,
+              "max_entries": OCR_CACHE_SIZE} if USE_OCR_CACHE else None,
+}
+# --- Web Server Configuration ---
+FLASK_SERVER_MODE = "threaded" # "asgi" serves video and event streams from one asyncio loop (needs uvicorn)
+# --- Stream Configuration ---
+STREAM_MAX_FPS = 20 # Frames offered to /video_feed viewers per second
+STREAM_JPEG_QUALITY = 75
 # --- LED Configuration ---
 LED_PIN = 26  # BCM Pin GPIO26 (Physical Pin 37)
 LED_CONFIDENCE_THRESHOLD = 0.60
+# --- Tracker Configuration ---
+TRACK_TIMEOUT = 3.0 # seconds without a reading before a vehicle's track closes and is written out
+TRACK_REPEAT_SUPPRESSION = 30.0 # seconds; the same plate reappearing within this window is not written again
+# --- Snapshot Configuration (served at /snapshots/<hash>) ---
+SAVE_SNAPSHOTS = True # Store a plate crop of every detection, linked from its DB row
+SAVE_SCENE_SNAPSHOTS = True # ... plus the whole scene, downscaled to snapshot_store.SCENE_WIDTH
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_MAX_MB = 256 # The least recently used snapshots are deleted beyond this
+# --- Metrics Configuration (scraped from Flask's /metrics) ---
+DEVICE_ID = socket.gethostname() # Identifies this Pi in MQTT events and metrics
+METRICS_DEVICE_ID = DEVICE_ID # "device" label on every metric, so alerts and dashboards can tell Pis apart
 # --- End Configuration ---
 
-# Global variable for the latest frame for Flask streaming and its lock
-latest_frame_for_flask_stream = None
-frame_stream_lock = threading.Lock()
+# New detections and status changes pushed to the admin panel (/api/plates/stream)
+event_hub = EventHub()
 
 # Global LED object
 plate_detected_led = None
 
-def get_latest_frame_for_flask():
-    """Provides the latest captured frame to Flask, thread-safe."""
-    with frame_stream_lock:
-        if latest_frame_for_flask_stream is not None:
-            # Return a copy to prevent issues if the frame is modified elsewhere
-            # or if Flask holds onto it for too long.
-            return latest_frame_for_flask_stream.copy()
-    return None
+_CLEAN_SECONDS = metrics.STAGE_SECONDS.labels("clean")
+
+def count_reconnects(client, target):
+    """Wraps a paho client's on_connect so that every connection after the current one counts as a reconnect."""
+    previous = client.on_connect
+    state = {"connected_once": client.is_connected()}
+
+    def on_connect(*args, **kwargs):
+        if state["connected_once"]:
+            metrics.RECONNECTS.labels(target).inc()
+        state["connected_once"] = True
+        if previous:
+            previous(*args, **kwargs)
+
+    client.on_connect = on_connect
+    metrics.RECONNECTS.labels(target) # Exported as 0 until the first reconnect, so rate() works from the start
+    metrics.CONNECTED.labels(target).set_function(lambda: 1 if client.is_connected() else 0)
+
+def fixed_interval_gate(interval):
+    """Fixed OCR throttle (USE_MOTION_GATE = False): a submit_fn passing one frame every interval seconds."""
+    last_submit = 0.0
+
+    def should_run_ocr(frame, now):
+        nonlocal last_submit
+        if (now - last_submit) < interval:
+            return False
+        last_submit = now
+        return True
+    return should_run_ocr
 
 def blink_led_on_detection(led_object, times=2, on_time=0.2, off_time=0.2):
     """Blinks the LED a specified number of times."""
@@ -91,16 +181,35 @@ def main():
     if THINGSBOARD_TOKEN_MAIN == "YOUR_RPI_DEVICE_ACCESS_TOKEN":
         logger.error("CRITICAL: THINGSBOARD_DEVICE_TOKEN is not set. ThingsBoard will not work.")
 
-    db_conn = db_utils.create_connection(DB_FILE)
-    if not db_conn:
+    # Started before the writer: enabling incremental vacuum on an older database rebuilds it once
+    retention_engine = retention.RetentionEngine(DB_FILE, max_age_days=RETENTION_MAX_AGE_DAYS,
+                                                 max_db_mb=RETENTION_MAX_DB_MB, archive_dir=RETENTION_ARCHIVE_DIR,
+                                                 interval=RETENTION_INTERVAL)
+    if not retention_engine.start():
+        logger.warning("Failed to start the retention engine. Old detections will not be cleaned up.")
+
+    # The writer thread owns the DB connection; the sink only queues detections
+    plate_writer = db_writer.AsyncPlateWriter(DB_FILE, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL)
+    if not plate_writer.start():
         logger.error("Failed to connect to database. Exiting.")
+        retention_engine.stop()
         if plate_detected_led: plate_detected_led.close()
         return
-    db_utils.create_table(db_conn)
 
-    ocr_reader = ocr_utils.get_ocr_reader()
-    if not ocr_reader:
-        logger.warning("Failed to initialize OCR Reader. OCR will not function.")
+    snapshots = None
+    if SAVE_SNAPSHOTS:
+        try:
+            snapshots = snapshot_store.SnapshotStore(SNAPSHOT_DIR, max_bytes=SNAPSHOT_MAX_MB * 1024 * 1024)
+            flask_server.set_snapshot_store(snapshots)
+        except OSError as e:
+            logger.error(f"Failed to open the snapshot store at {SNAPSHOT_DIR}: {e}. Snapshots are disabled.")
+
+    # In process mode every pool worker loads its own reader (see pipeline.init_ocr_worker)
+    ocr_available = True
+    if OCR_WORKER_MODE == pipeline.WORKER_MODE_THREAD:
+        ocr_available = pipeline.init_ocr_worker(OCR_OPTIONS)
+        if not ocr_available:
+            logger.warning("Failed to initialize OCR Reader. OCR will not function.")
 
     pi_mqtt_client = mqtt_client_pi.create_mqtt_client()
     # ... (set MQTT params if different from defaults in mqtt_client_pi) ...
@@ -111,139 +220,208 @@ def main():
     tb_client.THINGSBOARD_HOST = THINGSBOARD_HOST_MAIN
     tb_client.THINGSBOARD_DEVICE_TOKEN = THINGSBOARD_TOKEN_MAIN
     tb_client.connect_thingsboard(tb_mqtt_client)
-    
-    # --- Crucial: Set the frame provider for Flask BEFORE starting Flask thread ---
-    flask_server.set_frame_provider(get_latest_frame_for_flask)
+    count_reconnects(pi_mqtt_client, "mqtt")
+    count_reconnects(tb_mqtt_client, "thingsboard")
+
+    # Publishing runs on its own thread and spools to disk while a broker is unreachable
+    outbound = publisher.OutboundPublisher(PUBLISH_SPOOL_FILE)
+    outbound.add_target("mqtt", pi_mqtt_client, MQTT_PLATE_TOPIC)
+    outbound.add_target("thingsboard", tb_mqtt_client, THINGSBOARD_TELEMETRY_TOPIC, batch=True,
+                        batch_size=TB_BATCH_SIZE, batch_interval=TB_BATCH_INTERVAL)
+    if not outbound.start():
+        logger.error("Failed to open the publish spool. Detections will not be sent to MQTT / ThingsBoard.")
+    metrics.REGISTRY.const_labels["device"] = METRICS_DEVICE_ID
+
+    # One capture thread per camera source, each with its own OCR gate and stream; the OCR workers are shared
+    ocr_gates = {}
+    sources = []
+    for config in CAMERA_SOURCES or [{"id": f"cam{CAMERA_ID}", "source": CAMERA_ID}]:
+        source_id = str(config["id"])
+        if not ocr_available:
+            submit_fn = lambda frame, now: False
+        elif USE_MOTION_GATE:
+            ocr_gates[source_id] = motion_gate.MotionGate(rois=config.get("motion_rois", MOTION_ROIS),
+                                                          ocr_interval=MOTION_OCR_INTERVAL, hold_time=MOTION_HOLD_TIME,
+                                                          static_recheck_interval=MOTION_STATIC_RECHECK_INTERVAL)
+            submit_fn = ocr_gates[source_id].should_process
+        else:
+            submit_fn = fixed_interval_gate(FRAME_PROCESS_INTERVAL)
+        sources.append(source_manager.VideoSource(
+            source_id, config["source"], weight=config.get("weight", 1.0), submit_fn=submit_fn,
+            broadcaster=FrameBroadcaster(max_fps=STREAM_MAX_FPS, jpeg_quality=STREAM_JPEG_QUALITY),
+            loop=config.get("loop", source_manager.FILE_LOOP)))
+    sources_manager = source_manager.SourceManager(sources, queue_size=FRAME_QUEUE_SIZE,
+                                                   active_fn=lambda: flask_server.app.processing_active)
+
+    # --- Crucial: Set the frame broadcasters for Flask BEFORE starting Flask thread ---
+    # /video_feed shows the first source, /video_feed/<source id> any of them
+    flask_server.set_frame_broadcaster(sources[0].broadcaster)
+    flask_server.set_source_broadcasters(sources_manager.broadcasters())
+    flask_server.set_source_stats(sources_manager.stats)
+    flask_server.set_event_hub(event_hub)
 
     # Start Flask server in a separate thread
     # flask_server.app.processing_active will be the master control.
-    flask_thread = threading.Thread(target=flask_server.run_flask_app, daemon=True)
+    flask_thread = threading.Thread(target=flask_server.run_flask_app, kwargs={"mode": FLASK_SERVER_MODE},
+                                    daemon=True)
     flask_thread.start()
     logger.info("Flask server started in a background thread.")
 
-    cap = camera_utils.init_camera(CAMERA_ID)
-    if not cap:
-        logger.error("Failed to initialize camera. Main loop cannot run effectively.")
+    if not sources_manager.open_all():
+        logger.error("Failed to initialize any camera source. Main loop cannot run effectively.")
         # Attempt to signal flask to stop or show error if this is critical path
-        flask_server.app.processing_active = False # Signal an issue
+        flask_server.set_processing_active(False) # Signal an issue
         # Clean up other resources
-        # ... (db_conn.close(), mqtt disconnects etc.) ...
+        plate_writer.close()
+        retention_engine.stop()
+        outbound.stop()
+        # ... (mqtt disconnects etc.) ...
         return
 
-    logger.info("Main detection loop starting...")
-    last_ocr_processed_time = time.time()
-    global latest_frame_for_flask_stream # Ensure we modify the global one
+    metrics.RECONNECTS.labels("camera")
+
+    boot_id = int(time.time() * 1000) # Sequence numbers restart at 1 with every run
+    event_seq = itertools.count(1)
+    # One tracker per source: the same plate on two lanes is two vehicles
+    plate_trackers = {source_id: plate_tracker.PlateTracker(track_timeout=TRACK_TIMEOUT,
+                                                            repeat_suppression=TRACK_REPEAT_SUPPRESSION)
+                      for source_id in sources_manager.sources}
+
+    def emit_plate_event(event, source_id):
+        """Writes one consolidated plate event to the DB, MQTT and ThingsBoard."""
+        timestamp_str = datetime.fromtimestamp(event.first_seen).isoformat()
+        logger.info(f"Plate: {event.text}, Source: {source_id}, Confidence: {event.peak_confidence:.2f}, "
+                    f"Time: {timestamp_str}, Frames: {event.frame_count}, "
+                    f"Seen for: {event.last_seen - event.first_seen:.1f}s")
+        plate_data_dict = {
+            # device / boot / seq let the laptop aggregator spot lost events (see aggregator.py)
+            "device": DEVICE_ID, "boot": boot_id, "seq": next(event_seq), "source": source_id,
+            "plate": event.text, "timestamp": timestamp_str, "confidence": float(event.peak_confidence),
+            "first_seen": timestamp_str, "last_seen": datetime.fromtimestamp(event.last_seen).isoformat(),
+            "frame_count": event.frame_count,
+        }
+        metrics.DETECTIONS.inc()
+        snapshot_hash = scene_hash = None
+        if snapshots is not None and event.snapshot is not None:
+            snapshot_hash, scene_hash = snapshots.save_detection(*event.snapshot, scene=SAVE_SCENE_SNAPSHOTS)
+            plate_data_dict["snapshot"] = snapshot_hash
+        plate_writer.submit(event.text, timestamp_str, event.peak_confidence, source_id, snapshot_hash, scene_hash)
+        event_hub.publish('plate', {"plate_number": event.text, "timestamp": timestamp_str, "source": source_id,
+                                    "confidence": f"{event.peak_confidence:.2f}",
+                                    "epoch_ms": int(event.first_seen * 1000), "frame_count": event.frame_count,
+                                    "snapshot_hash": snapshot_hash})
+        # Queued, never blocking: sent in order once the broker acknowledges, spooled while it is unreachable
+        outbound.publish("mqtt", plate_data_dict)
+        telemetry_for_tb = {"plate": event.text, "source": source_id, "timestamp": timestamp_str,
+                            "confidence": float(event.peak_confidence), "frame_count": event.frame_count}
+        outbound.publish("thingsboard", telemetry_for_tb, ts_ms=int(event.first_seen * 1000))
+
+    def sink_stage(item, detections):
+        """Sink stage: feeds cleaned readings to the source's tracker and outputs the events of closed tracks."""
+        sources_manager.record_result(item, time.time())
+        tracker = plate_trackers[item.source]
+        readings = []
+        clean_start = time.perf_counter()
+        for (bbox, text, prob) in detections:
+            cleaned_text = ocr_utils.clean_plate_text(text)
+            if cleaned_text:
+                readings.append((bbox, cleaned_text, float(prob)))
+            else:
+                logger.debug(f"Raw text '{text}' rejected by cleaning function.")
+        if detections:
+            _CLEAN_SECONDS.observe(time.perf_counter() - clean_start)
+            metrics.READINGS.labels("accepted").inc(len(readings))
+            metrics.READINGS.labels("rejected").inc(len(detections) - len(readings))
+        if readings:
+            logger.info(f"Detected {len(readings)} plate readings on {item.source}: {', '.join(r[1] for r in readings)}")
+
+        # Keep the frame for the track's snapshot; in process mode it is read back from the frame ring
+        frame = pipeline.resolve_frame(item.frame) if readings and snapshots is not None else None
+        # Use the capture time, not the (possibly seconds later) OCR completion time
+        for event in tracker.update(readings, item.captured_at, frame):
+            emit_plate_event(event, item.source)
 
+        # --- LED Control Logic: blink once per vehicle, as soon as its track is confident ---
+        for track in tracker.active_tracks():
+            if not track.signalled and track.peak_confidence >= LED_CONFIDENCE_THRESHOLD:
+                track.signalled = True
+                logger.info(f"High confidence plate: {track.best_text()[0]} (Conf: {track.peak_confidence:.2f}). Blinking LED.")
+                if plate_detected_led:
+                    # Run blink in a new thread so the sink stage is not blocked
+                    led_thread = threading.Thread(target=blink_led_on_detection, args=(plate_detected_led, 2, 0.15, 0.15))
+                    led_thread.daemon = True # Allows main program to exit even if thread is running
+                    led_thread.start()
+        # --- End LED Control ---
+
+    def sink_idle(now):
+        """Closes tracks of vehicles that left while no OCR results were coming in."""
+        for source_id, tracker in plate_trackers.items():
+            for event in tracker.expire(now):
+                emit_plate_event(event, source_id)
+
+    # No capture_fn: the source threads submit frames, each through its own gate, into the fair queue
+    detection_pipeline = pipeline.DetectionPipeline(
+        None, sink_stage,
+        ocr_workers=OCR_WORKERS,
+        frame_queue=sources_manager.frame_queue,
+        worker_mode=OCR_WORKER_MODE,
+        use_frame_ring=USE_SHARED_FRAME_RING and OCR_WORKER_MODE == pipeline.WORKER_MODE_PROCESS,
+        ocr_options=OCR_OPTIONS,
+        idle_fn=sink_idle,
+    )
+
+    # Gauges and counters kept by the components themselves are read when /metrics is scraped
+    for state, key in (("captured", "frames_captured"), ("submitted", "frames_submitted"),
+                       ("dropped", "frames_dropped"), ("processed", "frames_processed")):
+        metrics.FRAMES.labels(state).set_function(lambda key=key: detection_pipeline.stats()[key])
+    metrics.OCR_ERRORS.set_function(lambda: detection_pipeline.stats()["ocr_errors"])
+    metrics.OCR_BUSY_WORKERS.set_function(lambda: detection_pipeline.stats()["ocr_busy_workers"])
+    metrics.CAPTURE_FPS.set_function(lambda: detection_pipeline.stats()["capture_fps"])
+    metrics.QUEUE_DEPTH.labels("frames").set_function(lambda: detection_pipeline.stats()["queue_depth"])
+    metrics.QUEUE_DEPTH.labels("results").set_function(lambda: detection_pipeline.stats()["results_pending"])
+    metrics.QUEUE_DEPTH.labels("db_writer").set_function(lambda: plate_writer.stats()["queue_depth"])
+    for result in ("written", "dropped", "failed"):
+        metrics.DB_ROWS.labels(result).set_function(lambda result=result: plate_writer.stats()[f"rows_{result}"])
+    metrics.ACTIVE_TRACKS.set_function(lambda: sum(len(t.active_tracks()) for t in plate_trackers.values()))
+
+    logger.info("Main detection loop starting...")
     try:
+        detection_pipeline.start()
+        sources_manager.start(detection_pipeline)
+        # The main thread only supervises; capture, OCR and output run on the pipeline threads.
         while True:
-            # Main loop is controlled by the flag in flask_server.app
-            if not flask_server.app.processing_active:
-                logger.info("Main loop: Processing paused by admin command (via Flask app).")
-                # When paused, ensure camera is released or handled to prevent issues
-                # And clear the frame for streaming so Flask shows "Paused"
-                with frame_stream_lock:
-                    latest_frame_for_flask_stream = None 
-                
-                # Optionally release camera if paused for long, but then re-init is needed
-                # if cap and cap.isOpened():
-                #    logger.info("Releasing camera while paused.")
-                #    camera_utils.release_camera(cap)
-                #    cap = None
-                time.sleep(1) 
-                continue # Skip the rest of the loop
-
-            # If paused and camera was released, try to reinitialize
-            if cap is None or not cap.isOpened():
-                logger.info("Main loop: Camera not open, attempting to re-initialize...")
-                cap = camera_utils.init_camera(CAMERA_ID)
-                if not cap:
-                    logger.error("Main loop: Failed to re-initialize camera. Will retry.")
-                    with frame_stream_lock: # Ensure no stale frame is streamed
-                        latest_frame_for_flask_stream = None
-                    time.sleep(5) # Wait longer before retrying camera
-                    continue
-                logger.info("Main loop: Camera re-initialized.")
-            
-            ret, frame = camera_utils.capture_frame(cap)
-            
-            if not ret or frame is None:
-                logger.warning("Failed to capture frame. Retrying.")
-                with frame_stream_lock: # Clear shared frame on error
-                    latest_frame_for_flask_stream = None
-                # Consider releasing and re-initializing camera on persistent errors
-                camera_utils.release_camera(cap) 
-                cap = None # Signal to re-initialize in next iteration
-                time.sleep(1)
-                continue
-
-            # Update frame for Flask stream (do this for every valid frame)
-            with frame_stream_lock:
-                latest_frame_for_flask_stream = frame # .copy() is done in getter
-
-            # --- OCR Processing (throttled) ---
-            current_time = time.time()
-            if ocr_reader and (current_time - last_ocr_processed_time) >= FRAME_PROCESS_INTERVAL:
-                last_ocr_processed_time = current_time
-                # Process 'frame' for OCR. Consider doing OCR on a copy if frame is large or processing is slow
-                # to avoid holding up the frame_stream_lock for too long if OCR is part of it.
-                # For this setup, OCR is outside the lock of latest_frame_for_flask_stream.
-                detections = ocr_utils.detect_plate_text(frame.copy(), ocr_reader) # Process a copy
-                if detections:
-                    # ... (existing OCR logic, DB save, MQTT publish, TB publish) ...
-                    # (Copied from your original main_pi.py)
-                    logger.info(f"Detected {len(detections)} potential texts.")
-                    for (bbox, text, prob) in detections:
-                        cleaned_text = ocr_utils.clean_plate_text(text)
-                        if cleaned_text:
-                            timestamp_str = datetime.now().isoformat()
-                            # --- LED Control Logic ---
-                            if prob >= LED_CONFIDENCE_THRESHOLD:
-                                logger.info(f"High confidence plate: {cleaned_text} (Conf: {prob:.2f}). Blinking LED.")
-                                if plate_detected_led:
-                                    # Run blink in a new thread to avoid blocking main loop significantly
-                                    # If blink_led_on_detection is very short, direct call might be okay.
-                                    # For responsive system, threading is better for I/O like LED blink sequences.
-                                    led_thread = threading.Thread(target=blink_led_on_detection, args=(plate_detected_led, 2, 0.15, 0.15))
-                                    led_thread.daemon = True # Allows main program to exit even if thread is running
-                                    led_thread.start()
-                            # --- End LED Control ---
-
-                            logger.info(f"Plate: {cleaned_text}, Confidence: {prob:.2f}, Time: {timestamp_str}")
-                            #logger.info(f"plate: {cleaned_text}, confidence: {prob:.2f}, timestamp: {timestamp_str}")
-                            plate_data_dict = {
-                                "plate": cleaned_text, "timestamp": timestamp_str, "confidence": float(prob)
-                            }
-                            db_utils.save_plate(db_conn, cleaned_text, timestamp_str, prob)
-                            if pi_mqtt_client.is_connected():
-                                mqtt_client_pi.publish_plate_data(pi_mqtt_client, plate_data_dict)
-                            if tb_mqtt_client.is_connected():
-                                #telemetry_for_tb = {"plate_number": cleaned_text, "confidence": float(prob)}
-                                telemetry_for_tb = {"plate": cleaned_text, "timestamp": timestamp_str, "confidence": float(prob)}
-                                tb_client.publish_telemetry_to_thingsboard(tb_mqtt_client, telemetry_for_tb)
-                        else:
-                            logger.debug(f"Raw text '{text}' rejected by cleaning function.")
-            elif not ocr_reader and (current_time - last_ocr_processed_time) >= FRAME_PROCESS_INTERVAL:
-                 last_ocr_processed_time = current_time # Still update time to avoid spamming warning
-                 logger.warning("OCR Reader not available, skipping text detection.")
-
-            # No cv2.imshow here for X11, streaming is via Flask.
-            time.sleep(0.01) # Small sleep to yield CPU, actual frame rate driven by camera and stream sleep
+            time.sleep(STATS_LOG_INTERVAL)
+            logger.info(f"Pipeline stats: {pipeline.format_stats(detection_pipeline.stats())}")
+            logger.info(f"Sources: {source_manager.format_stats(sources_manager.stats())}")
+            for source_id, gate in ocr_gates.items():
+                logger.info(f"Motion gate {source_id}: {motion_gate.format_stats(gate.stats())}")
+            for source_id, tracker in plate_trackers.items():
+                logger.info(f"Plate tracker {source_id}: {tracker.stats()}")
+            if pipeline.ocr_cache_stats(): # Thread mode only; process workers keep their own caches
+                logger.info(f"OCR cache: {pipeline.ocr_cache_stats()}")
+            logger.info(f"DB writer: {plate_writer.stats()}")
+            logger.info(f"Retention: {retention_engine.stats()}")
+            logger.info(f"Event hub: {event_hub.stats()}")
+            logger.info(f"Publisher: {outbound.stats()}")
 
     except KeyboardInterrupt:
         logger.info("KeyboardInterrupt received. Shutting down...")
-        flask_server.app.processing_active = False # Signal Flask to stop activities if it checks
+        flask_server.set_processing_active(False) # Signal Flask to stop activities if it checks
     except Exception as e:
         logger.error(f"An unhandled exception occurred in the main loop: {e}", exc_info=True)
-        flask_server.app.processing_active = False
+        flask_server.set_processing_active(False)
     finally:
         logger.info("Cleaning up resources...")
-        with frame_stream_lock: # Ensure no one tries to access it during cleanup
-            latest_frame_for_flask_stream = None
-        if cap:
-            camera_utils.release_camera(cap)
-        if db_conn:
-            db_conn.close()
-            logger.info("Database connection closed.")
+        sources_manager.stop() # Releases the cameras; no one streams a stale frame during cleanup
+        detection_pipeline.stop()
+        for source_id, tracker in plate_trackers.items():
+            for event in tracker.flush(): # Vehicles still in view at shutdown
+                emit_plate_event(event, source_id)
+        plate_writer.close() # Commits everything still queued
+        logger.info("Database writer closed.")
+        retention_engine.stop()
+        outbound.stop() # Sends what it can, spools the rest for the next start
+        logger.info("Publisher stopped.")
         if pi_mqtt_client and pi_mqtt_client.is_connected():
             mqtt_client_pi.disconnect_mqtt(pi_mqtt_client)
         if tb_mqtt_client and tb_mqtt_client.is_connected():
@@ -0,0 +1,275 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Defaults ---
+# Latency buckets in seconds: sub-millisecond DB/encode steps up to multi-second OCR on a busy Pi
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# --- End Defaults ---
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and math.isnan(value):
+        return "NaN"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _call(function):
+    """Value of a scrape-time callback; NaN if it fails, so one broken source doesn't break the scrape."""
+    try:
+        return function()
+    except Exception:
+        return math.nan
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text format; const_labels go on every sample."""
+
+    def __init__(self, const_labels=None):
+        self.const_labels = dict(const_labels or {})
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        const = list(self.const_labels.items())
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(const + labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    """
+    Base for Counter, Gauge and Histogram. A metric declared with labelnames holds
+    one child per label combination (labels(...) returns it, creating it on first
+    use); without labelnames the metric is its own single child. Keep the children
+    of hot-path call sites in module variables so each update is one method call.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, **child_options):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._child_options = child_options
+        self._children = {}
+        self._children_lock = threading.Lock()
+        self._init_child(**child_options)
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._children_lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = type(self).__new__(type(self))
+                    child._init_child(**self._child_options)
+                    self._children[key] = child
+        return child
+
+    def samples(self):
+        if not self.labelnames:
+            return [(suffix, labels, value) for suffix, labels, value in self._child_samples()]
+        with self._children_lock:
+            children = list(self._children.items())
+        samples = []
+        for key, child in children:
+            base = list(zip(self.labelnames, key))
+            samples.extend((suffix, base + labels, value) for suffix, labels, value in child._child_samples())
+        return samples
+
+    def _init_child(self):
+        raise NotImplementedError
+
+    def _child_samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count; set_function() exposes a counter kept elsewhere instead."""
+
+    type = "counter"
+
+    def _init_child(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def set_function(self, function):
+        self._function = function
+
+    def value(self):
+        if self._function is not None:
+            return _call(self._function)
+        with self._lock:
+            return self._value
+
+    def _child_samples(self):
+        return [("", [], self.value())]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; set_function() makes it read a callback at scrape time."""
+
+    type = "gauge"
+
+    def _init_child(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        self._function = function
+
+    def value(self):
+        if self._function is not None:
+            return _call(self._function)
+        with self._lock:
+            return self._value
+
+    def _child_samples(self):
+        return [("", [], self.value())]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in fixed buckets. observe() is a bisect and
+    two additions under a lock, cheap enough for every frame.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames, registry, buckets=tuple(sorted(buckets)))
+
+    def _init_child(self, buckets=LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1) # Last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Observes the duration of the with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        """Returns (cumulative bucket counts including +Inf, sum)."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+    def _child_samples(self):
+        cumulative, total = self.snapshot()
+        samples = [("_bucket", [("le", _format_value(float(bound)))], count)
+                   for bound, count in zip(self._buckets + (math.inf,), cumulative)]
+        samples.append(("_sum", [], total))
+        samples.append(("_count", [], cumulative[-1]))
+        return samples
+
+
+# --- Detection stack metrics (shared by main_pi, pipeline, db_writer, frame_broadcaster, flask_server) ---
+STAGE_SECONDS = Histogram("plate_stage_seconds", "Time spent in one hot-path stage per frame, batch or message.",
+                          ["stage"])
+FRAMES = Counter("plate_frames_total", "Frames by pipeline outcome.", ["state"])
+OCR_ERRORS = Counter("plate_ocr_errors_total", "Frames whose OCR call raised.")
+READINGS = Counter("plate_readings_total", "OCR readings by cleaning outcome.", ["result"])
+DETECTIONS = Counter("plate_detections_total", "Consolidated plate events (one per vehicle).")
+DB_ROWS = Counter("plate_db_rows_total", "Detections handed to the database writer by outcome.", ["result"])
+PUBLISHES = Counter("plate_publish_total", "Outbound messages by target and outcome.", ["target", "result"])
+RECONNECTS = Counter("plate_reconnects_total", "Reconnections after a lost camera or broker connection.",
+                     ["target"])
+CONNECTED = Gauge("plate_connected", "1 while the connection to the target is up.", ["target"])
+QUEUE_DEPTH = Gauge("plate_queue_depth", "Items waiting in an internal queue.", ["queue"])
+OCR_BUSY_WORKERS = Gauge("plate_ocr_busy_workers", "OCR workers currently reading a frame.")
+CAPTURE_FPS = Gauge("plate_capture_fps", "Camera frames captured per second (moving average).")
+ACTIVE_TRACKS = Gauge("plate_active_tracks", "Vehicles currently tracked.")
+STREAM_VIEWERS = Gauge("plate_stream_viewers", "Clients connected to /video_feed.")
+STREAM_BYTES = Counter("plate_stream_bytes_total", "JPEG bytes sent to /video_feed clients, by stream profile.",
+                       ["profile"])
+STREAM_PROFILE_CHANGES = Counter("plate_stream_profile_changes_total",
+                                 "Adaptive /video_feed profile changes (down: the client fell behind).", ["direction"])
+EVENT_SUBSCRIBERS = Gauge("plate_event_subscribers", "Admin panels connected to the live event stream.")
+SOURCE_FPS = Gauge("plate_source_fps", "Frames captured per second by camera source (moving average).", ["source"])
+SOURCE_FRAMES = Counter("plate_source_frames_total", "Frames by camera source and outcome.", ["source", "state"])
+SOURCE_LATENCY = Histogram("plate_source_latency_seconds", "Capture to OCR result, by camera source.", ["source"])
+HTTP_CONNECTIONS = Gauge("plate_http_connections", "Open connections by route group (ASGI server mode).", ["route"])
+HTTP_REJECTED = Counter("plate_http_rejected_total", "Connections turned away at a route's connection limit.",
+                        ["route"])
+SNAPSHOT_BYTES = Gauge("plate_snapshot_bytes", "Disk space used by the plate snapshot store.")
+PROCESSING_ACTIVE = Gauge("plate_processing_active", "1 while detection is running, 0 while paused.")
@@ -0,0 +1,138 @@
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+WORK_WIDTH = 160 # Frames are downscaled to this width before differencing
+DIFF_THRESHOLD = 25 # Per-pixel grey level change that counts as "changed"
+MIN_CHANGED_FRACTION = 0.01 # Fraction of an ROI that must change to count as motion
+BACKGROUND_LEARNING_RATE = 0.05 # How fast the background model absorbs the scene
+OCR_INTERVAL = 0.5 # seconds between OCR submissions while there is motion
+HOLD_TIME = 2.0 # seconds to keep submitting after motion stops (car slowing to a halt)
+STATIC_RECHECK_INTERVAL = 0 # seconds between OCR runs on a static scene, 0 disables
+# --- End Defaults ---
+
+
+class MotionGate:
+    """
+    Change-detection gate in front of OCR.
+
+    Each frame is downscaled, blurred and compared with a running-average
+    background. If enough pixels changed inside any region of interest the lane
+    is "active": the first frame of a motion event is submitted to OCR straight
+    away, then one frame every ocr_interval seconds until hold_time after the
+    motion stops. While the scene is static nothing is submitted (except an
+    optional recheck every static_recheck_interval seconds).
+
+    rois is a list of (x, y, w, h) rectangles in fractions of the frame size,
+    e.g. [(0.0, 0.4, 1.0, 0.6)] for the lower 60% of the image. None watches the
+    whole frame.
+    """
+
+    def __init__(self, rois=None, work_width=WORK_WIDTH, diff_threshold=DIFF_THRESHOLD,
+                 min_changed_fraction=MIN_CHANGED_FRACTION, learning_rate=BACKGROUND_LEARNING_RATE,
+                 ocr_interval=OCR_INTERVAL, hold_time=HOLD_TIME, static_recheck_interval=STATIC_RECHECK_INTERVAL):
+        self.rois = list(rois) if rois else [(0.0, 0.0, 1.0, 1.0)]
+        self.work_width = work_width
+        self.diff_threshold = diff_threshold
+        self.min_changed_fraction = min_changed_fraction
+        self.learning_rate = learning_rate
+        self.ocr_interval = ocr_interval
+        self.hold_time = hold_time
+        self.static_recheck_interval = static_recheck_interval
+
+        self._lock = threading.Lock()
+        self._background = None
+        self._roi_slices = None
+        self._active = False
+        self._last_motion_time = 0.0
+        self._last_submit_time = 0.0
+
+        self.frames_seen = 0
+        self.frames_processed = 0
+        self.frames_gated = 0
+        self.motion_events = 0
+        self.last_changed_fraction = 0.0
+
+    def _prepare(self, small):
+        h, w = small.shape[:2]
+        self._roi_slices = []
+        for (rx, ry, rw, rh) in self.rois:
+            x0, y0 = int(rx * w), int(ry * h)
+            x1, y1 = max(x0 + 1, int((rx + rw) * w)), max(y0 + 1, int((ry + rh) * h))
+            self._roi_slices.append((slice(y0, y1), slice(x0, x1)))
+        self._background = small.astype(np.float32)
+
+    def _downscale(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        scale = self.work_width / float(gray.shape[1])
+        small = cv2.resize(gray, (self.work_width, max(1, int(gray.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def changed_fraction(self, frame):
+        """Updates the background with frame and returns the largest changed fraction over all ROIs."""
+        small = self._downscale(frame)
+        if self._background is None or self._background.shape != small.shape:
+            # First frame (or new resolution) becomes the reference background
+            self._prepare(small)
+            return 0.0
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self._background))
+        changed = diff > self.diff_threshold
+        fraction = max(float(changed[ys, xs].mean()) for ys, xs in self._roi_slices)
+        cv2.accumulateWeighted(small, self._background, self.learning_rate)
+        return fraction
+
+    def should_process(self, frame, now):
+        """Returns True if this frame should be sent to OCR. Matches DetectionPipeline's submit_fn."""
+        with self._lock:
+            self.frames_seen += 1
+            fraction = self.changed_fraction(frame)
+            self.last_changed_fraction = fraction
+            motion = fraction >= self.min_changed_fraction
+
+            submit = False
+            if motion:
+                self._last_motion_time = now
+                if not self._active:
+                    # Motion just started in the lane: OCR immediately
+                    self._active = True
+                    self.motion_events += 1
+                    logger.debug(f"Motion gate: motion started ({fraction:.1%} changed).")
+                    submit = True
+            elif self._active and (now - self._last_motion_time) > self.hold_time:
+                self._active = False
+                logger.debug("Motion gate: scene static again.")
+
+            if not submit:
+                if self._active:
+                    submit = (now - self._last_submit_time) >= self.ocr_interval
+                elif self.static_recheck_interval:
+                    submit = (now - self._last_submit_time) >= self.static_recheck_interval
+
+            if submit:
+                self._last_submit_time = now
+                self.frames_processed += 1
+            else:
+                self.frames_gated += 1
+            return submit
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames_seen": self.frames_seen,
+                "frames_processed": self.frames_processed,
+                "frames_gated": self.frames_gated,
+                "motion_events": self.motion_events,
+                "active": self._active,
+                "last_changed_fraction": self.last_changed_fraction,
+            }
+
+
+def format_stats(stats):
+    """One-line summary of MotionGate.stats() for the log."""
+    return (f"{stats['frames_processed']} frames processed, {stats['frames_gated']} gated, "
+            f"{stats['motion_events']} motion events, lane {'active' if stats['active'] else 'static'}")
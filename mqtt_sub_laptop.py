@@ -14,37 +14,47 @@ CLIENT_ID_SUB = "laptop_plate_subscriber"
 
 class MQTTSubscriber:
     def __init__(self, data_queue):
-        self.client = mqtt.Client(client_id=CLIENT_ID_SUB)
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=CLIENT_ID_SUB)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         self.data_queue = data_queue # Queue to pass data to Tkinter
         self.connected = False
+        self.received = 0
+        self.dropped = 0 # Messages lost because the dashboard fell behind and the queue was full
 
-    def on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if not reason_code.is_failure:
             logger.info(f"Connected to MQTT Broker: {MQTT_BROKER_HOST}")
             client.subscribe(MQTT_TOPIC_PLATE_SUB)
             logger.info(f"Subscribed to topic: {MQTT_TOPIC_PLATE_SUB}")
             self.connected = True
         else:
-            logger.error(f"Failed to connect to MQTT, return code {rc}")
+            logger.error(f"Failed to connect to MQTT: {reason_code}")
             self.connected = False
 
     def on_message(self, client, userdata, msg):
+        # Runs on the paho network thread for every message, so it must never block:
+        # at high rates a blocking put() would stall the socket and back up the broker
         try:
             payload_str = msg.payload.decode('utf-8')
-            logger.info(f"Received message on {msg.topic}: {payload_str}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received message on {msg.topic}: {payload_str}")
             data = json.loads(payload_str)
-            # Put the received data into the queue for Tkinter to process
-            self.data_queue.put(data)
+            self.received += len(data) if isinstance(data, list) else 1
+            # Put the received data (a plate dict, or a list of them) into the queue for Tkinter to process
+            self.data_queue.put_nowait(data)
+        except queue.Full:
+            self.dropped += len(data) if isinstance(data, list) else 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Dashboard queue full, {self.dropped} messages dropped so far.")
         except json.JSONDecodeError:
-            logger.error(f"Error decoding JSON: {msg.payload.decode('utf-8')}")
+            logger.error(f"Error decoding JSON: {msg.payload.decode('utf-8', errors='replace')[:200]}")
         except Exception as e:
             logger.error(f"Error processing message: {e}")
 
-    def on_disconnect(self, client, userdata, rc):
-        logger.warning(f"Disconnected from MQTT Broker with result code {rc}")
+    def on_disconnect(self, client, userdata, flags, reason_code, properties):
+        logger.warning(f"Disconnected from MQTT Broker: {reason_code}")
         self.connected = False
         # Optional: Add reconnection logic here if desired
 
@@ -0,0 +1,144 @@
+import collections
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+MAX_ENTRIES = 256 # Cached crops; the least recently used is evicted beyond this
+TTL = 5.0 # seconds a result is reused before the crop is read again (corrects early misreads)
+MAX_DISTANCE = 4 # Hamming distance (of ~64 bits) at which two crops count as the same view
+HASH_SIZE = 8 # Hash grid; about HASH_SIZE * HASH_SIZE bits
+HASH_METHOD = "phash" # "phash" (DCT, steadier on noisy flat plate backgrounds) or "dhash" (cheaper)
+# --- End Defaults ---
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    Difference hash: the image is shrunk to (hash_size + 1) x hash_size grey pixels and
+    every bit records whether a pixel is brighter than its right-hand neighbour.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _bits_to_int((small[:, 1:] > small[:, :-1]).ravel())
+
+
+def phash(image, hash_size=HASH_SIZE):
+    """
+    Perceptual hash: the lowest hash_size x hash_size DCT frequencies of a 4x larger grey
+    thumbnail (DC term dropped), each compared with their median. Unlike dHash, flat areas
+    such as the plate background don't turn into noise-driven bits.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:hash_size, :hash_size].ravel()[1:]
+    return _bits_to_int(low > np.median(low))
+
+
+HASH_FUNCTIONS = {"phash": phash, "dhash": dhash}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class OCRCache:
+    """
+    Reuses OCR results for crops that look the same as a recently read one.
+
+    Crops are keyed by a perceptual hash (pHash by default, or dHash); a lookup
+    hits when a cached hash is within max_distance bits and younger than ttl
+    seconds. Entries are kept in LRU order and the oldest is evicted beyond
+    max_entries. Thread-safe, so the OCR worker threads can share one cache;
+    in process mode every worker process has its own.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL, max_distance=MAX_DISTANCE, hash_size=HASH_SIZE,
+                 method=HASH_METHOD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self._hash = HASH_FUNCTIONS[method]
+        self._entries = collections.OrderedDict() # hash -> (stored_at, result)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.hash_time_total = 0.0
+
+    def _find(self, key, now):
+        """Returns the cached key nearest to key within max_distance, dropping expired entries."""
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] <= self.ttl:
+            return key
+        best_key, best_distance = None, self.max_distance + 1
+        for cached_key, (stored_at, _) in list(self._entries.items()):
+            if now - stored_at > self.ttl:
+                del self._entries[cached_key]
+                self.expired += 1
+                continue
+            distance = hamming(key, cached_key)
+            if distance < best_distance:
+                best_key, best_distance = cached_key, distance
+        return best_key
+
+    def lookup(self, image, now=None):
+        """Returns (key, result); result is None on a miss. Pass key to store() after reading the crop."""
+        now = time.monotonic() if now is None else now
+        start = time.perf_counter()
+        key = self._hash(image, self.hash_size)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.hash_time_total += elapsed
+            found = self._find(key, now)
+            if found is None:
+                self.misses += 1
+                return key, None
+            self._entries.move_to_end(found)
+            self.hits += 1
+            return key, self._entries[found][1]
+
+    def store(self, key, result, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._entries[key] = (now, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, image, compute, now=None):
+        """Returns the cached result for image, or compute() (which is then cached)."""
+        key, result = self.lookup(image, now)
+        if result is None:
+            result = compute()
+            self.store(key, result, now)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "avg_hash_us": (self.hash_time_total / lookups * 1e6) if lookups else 0.0,
+            }
@@ -0,0 +1,488 @@
+import logging
+import threading
+import time
+import queue
+import collections
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import ocr_utils
+import frame_ring
+import plate_localizer
+import ocr_cache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (main_pi.py overrides these through DetectionPipeline arguments) ---
+DEFAULT_OCR_WORKERS = 2
+DEFAULT_FRAME_QUEUE_SIZE = 4
+MAX_ATTACHED_RINGS = 8 # Frame rings a worker process keeps attached (one per camera source, plus replaced ones)
+WORKER_MODE_THREAD = "thread"
+WORKER_MODE_PROCESS = "process"
+# --- End Defaults ---
+
+# One captured frame travelling through the pipeline. 'frame' is either the
+# pixel array itself or a frame_ring.FrameRef when a shared frame ring is used;
+# 'source' is the id of the camera source it came from (None with a single capture_fn).
+PipelineItem = collections.namedtuple("PipelineItem", ["seq", "captured_at", "frame", "source"], defaults=(None,))
+
+# OCR reader owned by the current process. In thread mode it is shared by all
+# worker threads, in process mode every pool process loads its own copy.
+_ocr_reader = None
+_plate_localizer = None
+_ocr_cache = None
+_ocr_options = {}
+# Frame rings this process has attached to, by shared memory name, least recently used first
+_attached_rings = collections.OrderedDict()
+
+_OCR_SECONDS = metrics.STAGE_SECONDS.labels("ocr")
+
+
+def init_ocr_worker(options=None):
+    """
+    Loads the OCR reader (and optional stages) for this process. Also used as
+    the process pool initializer. Supported options:
+        "localizer":           dict of PlateLocalizer arguments, or None to OCR full frames
+        "full_frame_fallback": OCR the full frame when the localizer finds no candidates
+        "cache":               dict of ocr_cache.OCRCache arguments to reuse results for
+                               near-identical plate crops, or None
+    """
+    global _ocr_reader, _plate_localizer, _ocr_cache, _ocr_options
+    _ocr_options = dict(options or {})
+    if _ocr_reader is None:
+        _ocr_reader = ocr_utils.get_ocr_reader()
+    localizer_options = _ocr_options.get("localizer")
+    if localizer_options is not None and _plate_localizer is None:
+        _plate_localizer = plate_localizer.PlateLocalizer(**localizer_options)
+    cache_options = _ocr_options.get("cache")
+    if cache_options is not None and _ocr_cache is None:
+        _ocr_cache = ocr_cache.OCRCache(**cache_options)
+    return _ocr_reader is not None
+
+
+def ocr_cache_stats():
+    """OCRCache.stats() for this process (thread mode: all workers), or None if the cache is off."""
+    return _ocr_cache.stats() if _ocr_cache is not None else None
+
+
+def _read_crop(crop):
+    """OCRs one plate crop, reusing the result of a recent look-alike crop when the cache is on."""
+    if _ocr_cache is None:
+        return ocr_utils.detect_plate_text(crop, _ocr_reader) or []
+    return _ocr_cache.get_or_compute(crop, lambda: ocr_utils.detect_plate_text(crop, _ocr_reader) or [])
+
+
+def resolve_frame(payload):
+    """Returns the pixels for a pipeline payload, reading FrameRefs from shared memory."""
+    if not isinstance(payload, frame_ring.FrameRef):
+        return payload
+    ring = _attached_rings.get(payload.ring_name)
+    if ring is None:
+        # Every source has its own ring, replaced when its frame size changes; drop the least recently used
+        while len(_attached_rings) >= MAX_ATTACHED_RINGS:
+            _attached_rings.popitem(last=False)[1].close()
+        ring = _attached_rings[payload.ring_name] = frame_ring.SharedFrameRing.attach(payload.ring_name)
+    else:
+        _attached_rings.move_to_end(payload.ring_name)
+    result = ring.read(payload.seq) # One memcpy out of shared memory, no pickling
+    return None if result is None else result[0]
+
+
+def run_ocr(frame):
+    """OCR stage: returns the (bbox, text, prob) detections for one frame."""
+    if _ocr_reader is None:
+        return []
+    frame = resolve_frame(frame)
+    if frame is None:
+        logger.debug("OCR stage: frame was overwritten in the frame ring before it was read.")
+        return []
+    if _plate_localizer is None:
+        return ocr_utils.detect_plate_text(frame, _ocr_reader) or []
+
+    # Only read the rectified plate candidates, best first
+    candidates = _plate_localizer.locate(frame)
+    if not candidates:
+        if _ocr_options.get("full_frame_fallback"):
+            return ocr_utils.detect_plate_text(frame, _ocr_reader) or []
+        return []
+    detections = []
+    for candidate in candidates:
+        for (bbox, text, prob) in _read_crop(candidate.crop):
+            detections.append((plate_localizer.crop_bbox_to_frame(bbox, candidate), text, prob))
+    return detections
+
+
+class DropOldestQueue:
+    """Bounded FIFO that discards its oldest entry instead of blocking the producer."""
+
+    def __init__(self, maxsize):
+        self.maxsize = max(1, int(maxsize))
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        """Adds an item, evicting the oldest one if the queue is full."""
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Returns the oldest item, or None on timeout or once the queue is closed and empty."""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if self._items:
+                return self._items.popleft()
+            return None
+
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+    def task_done(self, item, elapsed):
+        """Called by the OCR worker after an item was processed; nothing to account for here."""
+
+    def close(self):
+        """Wakes up all waiting consumers; remaining items can still be drained."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FairFrameQueue:
+    """
+    Frame queue shared by several camera sources, served by weighted fair queuing.
+
+    Every source gets its own drop-oldest queue of maxsize frames, so a busy
+    lane only ever drops its own frames. Each source also keeps a virtual
+    time that advances by the OCR time it used divided by its weight; get()
+    hands out the queued frame of the source with the lowest virtual time.
+    Over time each backlogged source receives OCR time in proportion to its
+    weight, however many frames it offers. The expected cost (an average of
+    the source's recent OCR times) is charged when a frame is handed out and
+    corrected in task_done(), so concurrent workers don't all pick the same
+    source. A source that was idle restarts at the current virtual time
+    instead of spending credit saved while it had nothing to read.
+    """
+
+    def __init__(self, weights, maxsize=DEFAULT_FRAME_QUEUE_SIZE):
+        self.source_maxsize = max(1, int(maxsize))
+        self.maxsize = self.source_maxsize * len(weights)
+        self._weights = {source: float(weight) for source, weight in weights.items()}
+        if any(w <= 0 for w in self._weights.values()):
+            raise ValueError("Source weights must be positive")
+        self._items = {source: collections.deque() for source in weights}
+        self._vtime = dict.fromkeys(weights, 0.0)
+        self._cost = dict.fromkeys(weights, 0.1) # Expected OCR seconds per frame, refined as frames complete
+        self._charged = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._dropped = dict.fromkeys(weights, 0)
+        self._dispatched = dict.fromkeys(weights, 0)
+        self._ocr_seconds = dict.fromkeys(weights, 0.0)
+
+    @property
+    def dropped(self):
+        with self._cond:
+            return sum(self._dropped.values())
+
+    def put(self, item):
+        """Adds a frame to its source's queue, evicting that source's oldest frame if it is full."""
+        with self._cond:
+            items = self._items[item.source]
+            if not items:
+                # Back from idle: no credit for the time it had nothing queued
+                busy = [self._vtime[s] for s, q in self._items.items() if q]
+                if busy:
+                    self._vtime[item.source] = max(self._vtime[item.source], min(busy))
+            if len(items) >= self.source_maxsize:
+                items.popleft()
+                self._dropped[item.source] += 1
+            items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Returns the next frame by fair order, or None on timeout or once closed and empty."""
+        with self._cond:
+            if not any(self._items.values()) and not self._closed:
+                self._cond.wait(timeout)
+            ready = [s for s, q in self._items.items() if q]
+            if not ready:
+                return None
+            source = min(ready, key=self._vtime.__getitem__)
+            item = self._items[source].popleft()
+            charge = self._cost[source] / self._weights[source]
+            self._vtime[source] += charge
+            self._charged[(source, item.seq)] = charge
+            self._dispatched[source] += 1
+            return item
+
+    def task_done(self, item, elapsed):
+        """Replaces the expected cost charged in get() with the OCR time the frame actually took."""
+        with self._cond:
+            source = item.source
+            charged = self._charged.pop((source, item.seq), 0.0)
+            self._vtime[source] += elapsed / self._weights[source] - charged
+            self._cost[source] += 0.2 * (elapsed - self._cost[source])
+            self._ocr_seconds[source] += elapsed
+
+    def qsize(self):
+        with self._cond:
+            return sum(len(q) for q in self._items.values())
+
+    def close(self):
+        """Wakes up all waiting consumers; remaining items can still be drained."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        """Per source: weight, queued, dropped and dispatched frames and the OCR seconds used."""
+        with self._cond:
+            return {source: {"weight": self._weights[source], "queued": len(self._items[source]),
+                             "dropped": self._dropped[source], "dispatched": self._dispatched[source],
+                             "ocr_seconds": self._ocr_seconds[source]}
+                    for source in self._items}
+
+
+class DetectionPipeline:
+    """
+    Runs capture, OCR and output as separate stages:
+
+        capture thread -> bounded frame queue -> OCR workers -> result queue -> sink thread
+
+    The capture thread never waits for OCR: when the workers fall behind, the
+    oldest queued frame is dropped, so capture FPS (and the Flask stream fed from
+    it) stays flat no matter how slow OCR is.
+
+    capture_fn()               -> frame or None. Called in a loop by the capture thread;
+                                  it is responsible for its own pacing / pause handling.
+                                  None: no capture thread is started, and frames come
+                                  from outside through submit_frame() (several sources,
+                                  see source_manager.SourceManager).
+    sink_fn(item, detections)  -> handles the detections for one PipelineItem. Only ever
+                                  called from the single sink thread.
+    submit_fn(frame, now)      -> optional, returns True if the frame should go to OCR.
+    idle_fn(now)               -> optional, called from the sink thread every idle_interval
+                                  seconds while no results arrive (e.g. to close tracks).
+    ocr_fn(frame)              -> detections; must be a picklable top-level function in
+                                  process mode.
+
+    With use_frame_ring=True (process mode), submitted frames are copied once into
+    a SharedFrameRing (one per source) and only a small FrameRef is sent to the
+    worker processes. ocr_options are passed to init_ocr_worker() in every worker
+    process. frame_queue replaces the default DropOldestQueue(queue_size), e.g.
+    with a FairFrameQueue shared by several sources.
+    """
+
+    def __init__(self, capture_fn, sink_fn, ocr_fn=run_ocr, submit_fn=None,
+                 ocr_workers=DEFAULT_OCR_WORKERS, queue_size=DEFAULT_FRAME_QUEUE_SIZE,
+                 worker_mode=WORKER_MODE_THREAD, use_frame_ring=False, ocr_options=None,
+                 idle_fn=None, idle_interval=0.5, frame_queue=None):
+        if worker_mode not in (WORKER_MODE_THREAD, WORKER_MODE_PROCESS):
+            raise ValueError(f"Unknown OCR worker mode: {worker_mode}")
+        self.capture_fn = capture_fn
+        self.sink_fn = sink_fn
+        self.ocr_fn = ocr_fn
+        self.submit_fn = submit_fn
+        self.idle_fn = idle_fn
+        self.idle_interval = idle_interval
+        self.ocr_workers = max(1, int(ocr_workers))
+        self.worker_mode = worker_mode
+        self.use_frame_ring = use_frame_ring
+        self.ocr_options = ocr_options
+        self.frame_rings = {} # Source id -> SharedFrameRing
+
+        self.frame_queue = frame_queue if frame_queue is not None else DropOldestQueue(queue_size)
+        self._seq = itertools.count(1)
+        self.result_queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._sink_thread = None
+        self._executor = None
+
+        self._stats_lock = threading.Lock()
+        self._frames_captured = 0
+        self._frames_submitted = 0
+        self._frames_processed = 0
+        self._ocr_errors = 0
+        self._ocr_busy = 0
+        self._ocr_time_total = 0.0
+        self._capture_interval_avg = None
+        self._last_capture_time = None
+
+    def start(self):
+        """Starts the process pool (if any) and all stage threads."""
+        if self.worker_mode == WORKER_MODE_PROCESS:
+            # 'spawn' avoids forking a process that already runs camera, Flask and MQTT threads.
+            self._executor = ProcessPoolExecutor(max_workers=self.ocr_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=init_ocr_worker,
+                                                 initargs=(self.ocr_options,))
+        self._stop_event.clear()
+        self._threads = []
+        if self.capture_fn is not None:
+            self._threads.append(threading.Thread(target=self._capture_loop, name="capture", daemon=True))
+        for i in range(self.ocr_workers):
+            self._threads.append(threading.Thread(target=self._ocr_loop, name=f"ocr-{i}", daemon=True))
+        self._sink_thread = threading.Thread(target=self._sink_loop, name="sink", daemon=True)
+        for t in self._threads:
+            t.start()
+        self._sink_thread.start()
+        logger.info(f"Detection pipeline started: {self.ocr_workers} OCR worker(s) in {self.worker_mode} mode, "
+                    f"frame queue size {self.frame_queue.maxsize}.")
+
+    def stop(self, timeout=5.0):
+        """Stops capture, lets in-flight OCR finish and drains pending results through the sink."""
+        self._stop_event.set()
+        self.frame_queue.close()
+        for t in self._threads:
+            t.join(timeout)
+        if self._sink_thread is not None:
+            self.result_queue.put(None)  # Sentinel: everything before it still reaches the sink
+            self._sink_thread.join(timeout)
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for ring in self.frame_rings.values():
+            ring.close()
+        self.frame_rings = {}
+        logger.info("Detection pipeline stopped.")
+
+    def is_running(self):
+        return not self._stop_event.is_set()
+
+    def _capture_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                frame = self.capture_fn()
+            except Exception as e:
+                logger.error(f"Capture stage error: {e}", exc_info=True)
+                time.sleep(1)
+                continue
+            if frame is not None:
+                self.submit_frame(frame, time.time())
+
+    def submit_frame(self, frame, now, source=None, submit_fn=None):
+        """
+        Counts one captured frame and queues it for OCR if submit_fn (default: the
+        pipeline's own) accepts it. Returns True if it was queued. Safe to call from
+        several capture threads, as long as each source only uses one.
+        """
+        with self._stats_lock:
+            self._frames_captured += 1
+            if self._last_capture_time is not None:
+                interval = now - self._last_capture_time
+                if self._capture_interval_avg is None:
+                    self._capture_interval_avg = interval
+                else:
+                    self._capture_interval_avg += 0.1 * (interval - self._capture_interval_avg)
+            self._last_capture_time = now
+
+        submit_fn = submit_fn or self.submit_fn
+        if submit_fn is not None and not submit_fn(frame, now):
+            return False
+        if self.use_frame_ring:
+            frame = self._write_to_ring(frame, now, source)
+        self.frame_queue.put(PipelineItem(next(self._seq), now, frame, source))
+        with self._stats_lock:
+            self._frames_submitted += 1
+        return True
+
+    def _write_to_ring(self, frame, now, source=None):
+        ring = self.frame_rings.get(source)
+        if ring is None or not ring.accepts(frame):
+            if ring is not None:
+                logger.info(f"Frame size changed{f' on {source}' if source else ''}, recreating the shared frame ring.")
+                ring.close()
+            # Enough slots that queued and in-flight frames are not overwritten before they are read
+            slots = self.frame_queue.maxsize + self.ocr_workers + 2
+            ring = self.frame_rings[source] = frame_ring.SharedFrameRing.create(frame.shape, slots=slots,
+                                                                                name=frame_ring.new_ring_name())
+        return ring.write(frame, now)
+
+    def _ocr_loop(self):
+        while True:
+            item = self.frame_queue.get(timeout=0.5)
+            if item is None:
+                if self._stop_event.is_set():
+                    return
+                continue
+
+            start = time.time()
+            with self._stats_lock:
+                self._ocr_busy += 1
+            try:
+                if self._executor is not None:
+                    detections = self._executor.submit(self.ocr_fn, item.frame).result()
+                else:
+                    detections = self.ocr_fn(item.frame)
+            except Exception as e:
+                logger.error(f"OCR stage error on frame {item.seq}: {e}", exc_info=True)
+                detections = None
+            elapsed = time.time() - start
+            self.frame_queue.task_done(item, elapsed)
+
+            with self._stats_lock:
+                self._ocr_busy -= 1
+                if detections is None:
+                    self._ocr_errors += 1
+                else:
+                    self._frames_processed += 1
+                    self._ocr_time_total += elapsed
+            if detections is not None:
+                _OCR_SECONDS.observe(elapsed)
+                self.result_queue.put((item, detections))
+
+    def _sink_loop(self):
+        while True:
+            try:
+                entry = self.result_queue.get(timeout=self.idle_interval if self.idle_fn else None)
+            except queue.Empty:
+                try:
+                    self.idle_fn(time.time())
+                except Exception as e:
+                    logger.error(f"Sink stage idle error: {e}", exc_info=True)
+                continue
+            if entry is None:
+                return
+            item, detections = entry
+            try:
+                self.sink_fn(item, detections)
+            except Exception as e:
+                logger.error(f"Sink stage error on frame {item.seq}: {e}", exc_info=True)
+
+    def stats(self):
+        """Returns a snapshot of the pipeline counters."""
+        with self._stats_lock:
+            processed = self._frames_processed
+            return {
+                "frames_captured": self._frames_captured,
+                "capture_fps": (1.0 / self._capture_interval_avg) if self._capture_interval_avg else 0.0,
+                "frames_submitted": self._frames_submitted,
+                "frames_dropped": self.frame_queue.dropped,
+                "frames_processed": processed,
+                "ocr_errors": self._ocr_errors,
+                "ocr_busy_workers": self._ocr_busy,
+                "avg_ocr_ms": (self._ocr_time_total / processed * 1000.0) if processed else 0.0,
+                "queue_depth": self.frame_queue.qsize(),
+                "queue_capacity": self.frame_queue.maxsize,
+                "results_pending": self.result_queue.qsize(),
+            }
+
+
+def format_stats(stats):
+    """One-line summary of DetectionPipeline.stats() for the log."""
+    return (f"capture {stats['capture_fps']:.1f} FPS ({stats['frames_captured']} frames), "
+            f"queue {stats['queue_depth']}/{stats['queue_capacity']}, "
+            f"submitted {stats['frames_submitted']}, dropped {stats['frames_dropped']}, "
+            f"OCR'd {stats['frames_processed']} (avg {stats['avg_ocr_ms']:.0f} ms, "
+            f"{stats['ocr_busy_workers']} busy, {stats['ocr_errors']} errors), "
+            f"results pending {stats['results_pending']}")
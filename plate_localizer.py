@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+import time
+import collections
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+MIN_ASPECT = 1.5 # Width / height of the character block (two-line plates are squarer)
+MAX_ASPECT = 9.0
+IDEAL_ASPECT = 5.0
+MIN_AREA_FRACTION = 0.001 # Of the (downscaled) frame area
+MAX_AREA_FRACTION = 0.15
+MAX_CANDIDATES = 4
+CROP_HEIGHT = 64 # Rectified crops are resized to this height for OCR
+CROP_PADDING_X = 0.08 # Grow each candidate by these fractions of its width / height so
+CROP_PADDING_Y = 0.35 # the crop keeps the plate border around the character block
+WORK_WIDTH = 960 # Frames wider than this are downscaled for the contour search
+DETECTOR_INPUT_SIZE = 320
+DETECTOR_CONFIDENCE = 0.35
+LOG_EVERY_N_FRAMES = 100
+# --- End Defaults ---
+
+# box is the axis-aligned (x, y, w, h) of the candidate in frame coordinates,
+# quad its 4 corners (rotated rectangle), crop the rectified plate image.
+PlateCandidate = collections.namedtuple("PlateCandidate", ["box", "quad", "score", "crop"])
+
+
+def _order_corners(pts):
+    """Orders 4 points as top-left, top-right, bottom-right, bottom-left."""
+    pts = np.asarray(pts, dtype=np.float32)
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype=np.float32)
+
+
+class PlateLocalizer:
+    """
+    Cheap CPU stage that finds likely licence plate regions so OCR only has to
+    read small rectified crops instead of the whole frame.
+
+    The default finder looks for dark-on-light character strokes (black-hat +
+    horizontal gradient), closes them into blobs and keeps rotated rectangles
+    with plate-like aspect ratio and size. If onnx_model_path is given, a small
+    single-class detector (YOLO-style output) is run through cv2.dnn instead.
+    Candidates are ranked by score, best first.
+
+    One instance may be shared by several OCR threads: each thread loads its
+    own copy of the network (cv2.dnn.Net is not thread-safe), and the counters
+    are updated under a lock.
+    """
+
+    def __init__(self, min_aspect=MIN_ASPECT, max_aspect=MAX_ASPECT, min_area_fraction=MIN_AREA_FRACTION,
+                 max_area_fraction=MAX_AREA_FRACTION, max_candidates=MAX_CANDIDATES, crop_height=CROP_HEIGHT,
+                 onnx_model_path=None, detector_confidence=DETECTOR_CONFIDENCE, log_every=LOG_EVERY_N_FRAMES):
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+        self.min_area_fraction = min_area_fraction
+        self.max_area_fraction = max_area_fraction
+        self.max_candidates = max_candidates
+        self.crop_height = crop_height
+        self.detector_confidence = detector_confidence
+        self.log_every = log_every
+
+        self._model_path = None
+        self._local = threading.local() # .net: this thread's copy of the detector
+        if onnx_model_path:
+            try:
+                self._local.net = cv2.dnn.readNetFromONNX(onnx_model_path)
+                self._model_path = onnx_model_path
+                logger.info(f"Plate localizer: using ONNX detector {onnx_model_path}.")
+            except cv2.error as e:
+                logger.error(f"Plate localizer: could not load ONNX model {onnx_model_path}: {e}. "
+                             f"Falling back to contour search.")
+
+        self._frames = 0
+        self._candidates_total = 0
+        self._frames_without_candidates = 0
+        self._time_total = 0.0
+        self._stats_lock = threading.Lock()
+
+    def locate(self, frame):
+        """Returns a ranked list of PlateCandidate for one BGR (or grayscale) frame."""
+        start = time.perf_counter()
+        if self._model_path is not None:
+            boxes = self._detect_dnn(frame)
+        else:
+            boxes = self._detect_contours(frame)
+        candidates = [self._rectify(frame, quad, score) for quad, score in boxes[:self.max_candidates]]
+        candidates = [c for c in candidates if c is not None]
+        self._record(len(candidates), time.perf_counter() - start)
+        return candidates
+
+    def _detect_contours(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        scale = 1.0
+        if gray.shape[1] > WORK_WIDTH:
+            scale = WORK_WIDTH / gray.shape[1]
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        frame_area = gray.shape[0] * gray.shape[1]
+
+        # Dark characters on a light plate stand out in the black-hat image,
+        # and their vertical strokes give a strong horizontal gradient.
+        rect_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (13, 5))
+        blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, rect_kernel)
+        grad = cv2.Sobel(blackhat, cv2.CV_32F, 1, 0, ksize=-1)
+        grad = cv2.convertScaleAbs(grad)
+        grad = cv2.GaussianBlur(grad, (5, 5), 0)
+        grad = cv2.morphologyEx(grad, cv2.MORPH_CLOSE, rect_kernel)
+        _, mask = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        mask = cv2.erode(mask, None, iterations=2)
+        mask = cv2.dilate(mask, None, iterations=2)
+
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours:
+            rect = cv2.minAreaRect(contour)
+            w, h = rect[1]
+            if w < h:
+                w, h = h, w
+            if h < 1:
+                continue
+            aspect = w / h
+            area_fraction = (w * h) / frame_area
+            if not (self.min_aspect <= aspect <= self.max_aspect):
+                continue
+            if not (self.min_area_fraction <= area_fraction <= self.max_area_fraction):
+                continue
+            # Prefer solid, plate-shaped blobs with strong character edges
+            rectangularity = cv2.contourArea(contour) / (w * h)
+            aspect_score = 1.0 - min(abs(aspect - IDEAL_ASPECT) / IDEAL_ASPECT, 1.0)
+            x, y, bw, bh = cv2.boundingRect(contour)
+            edge_density = float(grad[y:y + bh, x:x + bw].mean()) / 255.0
+            score = 0.4 * rectangularity + 0.3 * aspect_score + 0.3 * edge_density
+            quad = cv2.boxPoints(rect) / scale
+            boxes.append((quad, score))
+        boxes.sort(key=lambda b: b[1], reverse=True)
+        return boxes
+
+    def _detect_dnn(self, frame):
+        img = frame if frame.ndim == 3 else cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        h, w = img.shape[:2]
+        blob = cv2.dnn.blobFromImage(img, 1 / 255.0, (DETECTOR_INPUT_SIZE, DETECTOR_INPUT_SIZE), swapRB=True, crop=False)
+        net = getattr(self._local, "net", None)
+        if net is None:
+            net = self._local.net = cv2.dnn.readNetFromONNX(self._model_path)
+        net.setInput(blob)
+        out = net.forward()
+        out = out.reshape(out.shape[-2], out.shape[-1]) if out.ndim == 3 else out
+        if out.shape[0] < out.shape[1]: # (5+, N) -> (N, 5+)
+            out = out.T
+        rects, scores = [], []
+        sx, sy = w / DETECTOR_INPUT_SIZE, h / DETECTOR_INPUT_SIZE
+        for row in out:
+            # (cx, cy, w, h, conf[, class scores...]) in detector input pixels
+            conf = float(row[4] if len(row) == 5 else row[4:].max())
+            if conf < self.detector_confidence:
+                continue
+            cx, cy, bw, bh = row[:4]
+            rects.append([int((cx - bw / 2) * sx), int((cy - bh / 2) * sy), int(bw * sx), int(bh * sy)])
+            scores.append(conf)
+        keep = cv2.dnn.NMSBoxes(rects, scores, self.detector_confidence, 0.45) if rects else []
+        boxes = []
+        for i in np.array(keep).ravel():
+            x, y, bw, bh = rects[i]
+            quad = np.array([[x, y], [x + bw, y], [x + bw, y + bh], [x, y + bh]], dtype=np.float32)
+            boxes.append((quad, scores[i]))
+        boxes.sort(key=lambda b: b[1], reverse=True)
+        return boxes
+
+    def _rectify(self, frame, quad, score):
+        """Warps the (padded) candidate quad to an upright crop of crop_height pixels."""
+        quad = _order_corners(quad)
+        dx = (quad[1] - quad[0] + quad[2] - quad[3]) / 2 * CROP_PADDING_X
+        dy = (quad[3] - quad[0] + quad[2] - quad[1]) / 2 * CROP_PADDING_Y
+        quad = quad + np.array([-dx - dy, dx - dy, dx + dy, -dx + dy], dtype=np.float32)
+        fh, fw = frame.shape[:2]
+        quad[:, 0] = np.clip(quad[:, 0], 0, fw - 1)
+        quad[:, 1] = np.clip(quad[:, 1], 0, fh - 1)
+
+        width = max(np.linalg.norm(quad[1] - quad[0]), np.linalg.norm(quad[2] - quad[3]))
+        height = max(np.linalg.norm(quad[3] - quad[0]), np.linalg.norm(quad[2] - quad[1]))
+        if width < 8 or height < 4:
+            return None
+        out_h = self.crop_height
+        out_w = int(round(out_h * width / height))
+        target = np.array([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]], dtype=np.float32)
+        matrix = cv2.getPerspectiveTransform(quad, target)
+        crop = cv2.warpPerspective(frame, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR)
+
+        x0, y0 = quad.min(axis=0)
+        x1, y1 = quad.max(axis=0)
+        box = (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+        return PlateCandidate(box, quad, float(score), crop)
+
+    def _record(self, n_candidates, elapsed):
+        with self._stats_lock:
+            self._frames += 1
+            self._candidates_total += n_candidates
+            self._time_total += elapsed
+            if n_candidates == 0:
+                self._frames_without_candidates += 1
+            frames = self._frames
+        if self.log_every and frames % self.log_every == 0:
+            stats = self.stats()
+            logger.info(f"Plate localizer [pid {os.getpid()}]: {stats['frames']} frames, "
+                        f"{stats['avg_candidates']:.2f} candidates/frame, "
+                        f"{stats['frames_without_candidates']} frames without candidates, "
+                        f"avg {stats['avg_ms']:.1f} ms/frame")
+
+    def stats(self):
+        """Counters for this process: frames seen, candidates per frame and time spent."""
+        with self._stats_lock:
+            frames, candidates = self._frames, self._candidates_total
+            without, time_total = self._frames_without_candidates, self._time_total
+        return {
+            "frames": frames,
+            "candidates": candidates,
+            "avg_candidates": (candidates / frames) if frames else 0.0,
+            "frames_without_candidates": without,
+            "avg_ms": (time_total / frames * 1000.0) if frames else 0.0,
+        }
+
+
+def crop_bbox_to_frame(bbox, candidate):
+    """Maps an OCR bbox given in crop pixels back to (approximate) frame pixels."""
+    x, y, w, h = candidate.box
+    crop_h, crop_w = candidate.crop.shape[:2]
+    sx, sy = w / float(crop_w), h / float(crop_h)
+    return [[int(x + px * sx), int(y + py * sy)] for px, py in bbox]
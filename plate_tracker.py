@@ -0,0 +1,200 @@
+import logging
+import itertools
+import collections
+from difflib import SequenceMatcher
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+IOU_THRESHOLD = 0.2 # Minimum box overlap for a position-based match
+TEXT_MATCH_THRESHOLD = 0.75 # Text similarity that matches a track on its own (car moved a lot)
+TEXT_WITH_IOU_THRESHOLD = 0.4 # Text similarity required together with a box overlap
+TRACK_TIMEOUT = 3.0 # seconds without a reading before a track is closed
+MAX_TRACK_DURATION = 120.0 # seconds; long-lived tracks are closed and restarted
+REPEAT_SUPPRESSION = 30.0 # seconds; a closed track repeating the last event's text is merged into it
+MIN_READINGS = 1 # Tracks with fewer readings are discarded instead of emitted
+# --- End Defaults ---
+
+# One consolidated detection, emitted when its track closes. snapshot is (frame, rect) of the
+# highest-confidence reading when the caller passed frames to update(), else None.
+PlateEvent = collections.namedtuple("PlateEvent", [
+    "track_id", "text", "confidence", "peak_confidence", "first_seen", "last_seen", "frame_count", "bbox",
+    "snapshot",
+], defaults=(None,))
+
+
+def _bbox_to_rect(bbox):
+    """EasyOCR quad [[x, y] * 4] (or an (x0, y0, x1, y1) tuple) -> (x0, y0, x1, y1)."""
+    if len(bbox) == 4 and not hasattr(bbox[0], "__len__"):
+        return tuple(float(v) for v in bbox)
+    xs = [float(p[0]) for p in bbox]
+    ys = [float(p[1]) for p in bbox]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def iou(a, b):
+    """Intersection over union of two (x0, y0, x1, y1) rectangles."""
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def text_similarity(a, b):
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class PlateTrack:
+    """All readings of one plate across frames, with confidence-weighted character voting."""
+
+    def __init__(self, track_id, rect, text, prob, now, frame=None):
+        self.track_id = track_id
+        self.rect = rect
+        self.first_seen = now
+        self.last_seen = now
+        self.readings = []
+        self.peak_confidence = 0.0
+        self.snapshot = None # (frame, rect) of the best reading, kept by reference
+        self.signalled = False # Set by the caller once it has reacted to this track (e.g. LED)
+        self.add(rect, text, prob, now, frame)
+
+    def add(self, rect, text, prob, now, frame=None):
+        self.rect = rect
+        self.last_seen = now
+        self.readings.append((text, float(prob)))
+        if frame is not None and (self.snapshot is None or float(prob) > self.peak_confidence):
+            self.snapshot = (frame, rect)
+        self.peak_confidence = max(self.peak_confidence, float(prob))
+
+    @property
+    def frame_count(self):
+        return len(self.readings)
+
+    def best_text(self):
+        """
+        Returns (text, confidence). The plate length is voted first; then every
+        character position is voted among the readings of that length, each
+        reading weighted by its OCR confidence.
+        """
+        length_votes = collections.Counter()
+        for text, prob in self.readings:
+            length_votes[len(text)] += prob
+        length = length_votes.most_common(1)[0][0]
+        same_length = [(t, p) for t, p in self.readings if len(t) == length]
+
+        chars = []
+        for i in range(length):
+            votes = collections.Counter()
+            for text, prob in same_length:
+                votes[text[i]] += prob
+            chars.append(votes.most_common(1)[0][0])
+        best = "".join(chars)
+        confidence = sum(p for _, p in same_length) / len(same_length)
+        return best, confidence
+
+    def match_score(self, rect, text):
+        """Returns a match score (higher is better) or None if the reading does not belong here."""
+        best, _ = self.best_text()
+        sim = text_similarity(best, text)
+        overlap = iou(self.rect, rect)
+        if sim >= TEXT_MATCH_THRESHOLD or (overlap >= IOU_THRESHOLD and sim >= TEXT_WITH_IOU_THRESHOLD):
+            return sim + overlap
+        return None
+
+    def to_event(self):
+        text, confidence = self.best_text()
+        return PlateEvent(self.track_id, text, confidence, self.peak_confidence,
+                          self.first_seen, self.last_seen, self.frame_count, self.rect, self.snapshot)
+
+
+class PlateTracker:
+    """
+    Associates cleaned plate readings across frames by box overlap and text
+    similarity, and emits one PlateEvent per vehicle when its track closes
+    (no reading for track_timeout seconds). Not thread-safe; use it from the
+    pipeline's sink thread only.
+    """
+
+    def __init__(self, track_timeout=TRACK_TIMEOUT, max_track_duration=MAX_TRACK_DURATION,
+                 repeat_suppression=REPEAT_SUPPRESSION, min_readings=MIN_READINGS):
+        self.track_timeout = track_timeout
+        self.max_track_duration = max_track_duration
+        self.repeat_suppression = repeat_suppression
+        self.min_readings = min_readings
+        self._tracks = []
+        self._ids = itertools.count(1)
+        self._last_event = None
+
+        self.readings_total = 0
+        self.events_emitted = 0
+        self.events_suppressed = 0
+
+    def update(self, detections, now, frame=None):
+        """
+        Adds one frame's readings, given as (bbox, cleaned_text, prob), and
+        returns the PlateEvents of tracks that closed. With frame, every track
+        keeps the frame of its highest-confidence reading for a snapshot.
+        """
+        closed = self.expire(now)
+        unmatched = list(self._tracks)
+        for bbox, text, prob in sorted(detections, key=lambda d: d[2], reverse=True):
+            self.readings_total += 1
+            rect = _bbox_to_rect(bbox)
+            best_track, best_score = None, None
+            for track in unmatched:
+                score = track.match_score(rect, text)
+                if score is not None and (best_score is None or score > best_score):
+                    best_track, best_score = track, score
+            if best_track is not None:
+                best_track.add(rect, text, prob, now, frame)
+                unmatched.remove(best_track) # One reading per track per frame
+            else:
+                track = PlateTrack(next(self._ids), rect, text, prob, now, frame)
+                self._tracks.append(track)
+                logger.debug(f"Tracker: new track {track.track_id} for '{text}'.")
+        return closed
+
+    def expire(self, now):
+        """Closes tracks that timed out or ran too long; returns their PlateEvents."""
+        closed = []
+        for track in list(self._tracks):
+            if (now - track.last_seen) > self.track_timeout or (now - track.first_seen) > self.max_track_duration:
+                self._tracks.remove(track)
+                event = self._close(track)
+                if event:
+                    closed.append(event)
+        return closed
+
+    def flush(self):
+        """Closes every open track (shutdown); returns their PlateEvents."""
+        closed = [self._close(track) for track in self._tracks]
+        self._tracks = []
+        return [event for event in closed if event]
+
+    def active_tracks(self):
+        return list(self._tracks)
+
+    def _close(self, track):
+        if track.frame_count < self.min_readings:
+            return None
+        event = track.to_event()
+        last = self._last_event
+        if (last is not None and last.text == event.text
+                and (event.first_seen - last.last_seen) <= self.repeat_suppression):
+            # Same vehicle seen again after a pause (e.g. waiting at the barrier)
+            self._last_event = last._replace(last_seen=event.last_seen, snapshot=None)
+            self.events_suppressed += 1
+            logger.debug(f"Tracker: track {track.track_id} repeats '{event.text}', suppressed.")
+            return None
+        self._last_event = event
+        self.events_emitted += 1
+        return event
+
+    def stats(self):
+        return {
+            "active_tracks": len(self._tracks),
+            "readings": self.readings_total,
+            "events_emitted": self.events_emitted,
+            "events_suppressed": self.events_suppressed,
+        }
@@ -0,0 +1,300 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+import db_utils
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+SPOOL_FILE = "outbound_spool.db" # Kept apart from the detections database so spooling never competes with it
+QUEUE_SIZE = 1000 # Messages waiting in memory for the publisher thread
+ACK_TIMEOUT = 5.0 # seconds to wait for a QoS 1 acknowledgement before the message is spooled
+RETRY_INTERVAL = 5.0 # seconds before publishing is retried after a failure
+REPLAY_BATCH = 100 # Spooled messages read and sent per replay step
+MAX_SPOOL_ROWS = 100000 # Per target; the oldest spooled messages are dropped beyond this
+TB_BATCH_SIZE = 50 # Telemetry entries per ThingsBoard publish
+TB_BATCH_INTERVAL = 1.0 # seconds a live telemetry entry may wait for others to share its publish
+# --- End Defaults ---
+
+_STOP = object()
+
+
+class PublishTarget:
+    """
+    One outbound destination: a paho MQTT client and topic. With batch=True, messages are sent
+    as a JSON array of {"ts", "values"} entries (ThingsBoard telemetry format), up to batch_size
+    per publish; otherwise every message is published on its own as its JSON values.
+    """
+
+    def __init__(self, name, client, topic, qos=1, batch=False, batch_size=TB_BATCH_SIZE,
+                 batch_interval=TB_BATCH_INTERVAL):
+        self.name = name
+        self.client = client
+        self.topic = topic
+        self.qos = qos
+        self.batch = batch
+        self.batch_size = batch_size if batch else 1
+        self.batch_interval = batch_interval if batch else 0.0
+
+        self.pending = [] # (ts_ms, values) not yet sent or spooled, in order
+        self.pending_since = None
+        self.spooled = 0 # Rows in the spool; while > 0 new messages queue up behind them
+        self.retry_at = 0.0
+        self.stage_seconds = metrics.STAGE_SECONDS.labels(f"{name}_publish")
+
+        self.sent = 0
+        self.replayed = 0
+        self.spooled_total = 0
+        self.dropped = 0
+        self.failures = 0
+        self.publishes = 0
+        self.publish_time_total = 0.0
+
+    def connected(self):
+        try:
+            return bool(self.client.is_connected())
+        except Exception:
+            return False
+
+    def payload(self, messages):
+        if self.batch:
+            return json.dumps([{"ts": ts, "values": values} for ts, values in messages], separators=(",", ":"))
+        return json.dumps(messages[0][1], separators=(",", ":"))
+
+
+class OutboundPublisher:
+    """
+    Background MQTT / ThingsBoard publisher with a disk spool.
+
+    publish() only puts the message on an in-memory queue, so the detection
+    loop never waits for the network. The publisher thread sends each message
+    at QoS 1 and waits for the broker's acknowledgement. While a target is
+    disconnected, or a publish is not acknowledged, messages go to a SQLite
+    spool instead. Once the target is back, the spool is replayed oldest first
+    and new messages wait behind it, so the broker sees them in order.
+    Delivery is at least once: a message whose acknowledgement was lost is
+    sent again from the spool.
+
+    Batched targets (ThingsBoard) gather live messages for up to
+    batch_interval seconds and send up to batch_size of them per publish in
+    the [{"ts": ms, "values": {...}}] form, and replay their spool the same way.
+    """
+
+    def __init__(self, spool_file=SPOOL_FILE, queue_size=QUEUE_SIZE, ack_timeout=ACK_TIMEOUT,
+                 retry_interval=RETRY_INTERVAL, replay_batch=REPLAY_BATCH, max_spool_rows=MAX_SPOOL_ROWS):
+        self.spool_file = spool_file
+        self.ack_timeout = ack_timeout
+        self.retry_interval = retry_interval
+        self.replay_batch = replay_batch
+        self.max_spool_rows = max_spool_rows
+        self.targets = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._conn = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.queue_dropped = 0
+
+    def add_target(self, name, client, topic, **options):
+        """Registers a destination before start(); options are PublishTarget arguments."""
+        target = PublishTarget(name, client, topic, **options)
+        self.targets[name] = target
+        metrics.QUEUE_DEPTH.labels(f"spool_{name}").set_function(lambda: target.spooled)
+        for result in ("sent", "replayed", "spooled", "dropped"):
+            metrics.PUBLISHES.labels(name, result).set_function(
+                lambda result=result: getattr(target, "spooled_total" if result == "spooled" else result))
+        return target
+
+    def start(self, timeout=10.0):
+        """Opens the spool and starts the publisher thread; returns False if the spool can't be opened."""
+        metrics.QUEUE_DEPTH.labels("publisher").set_function(self._queue.qsize)
+        self._thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        return self._conn is not None
+
+    def stop(self, timeout=10.0):
+        """Sends (or spools) everything still queued and stops the thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def publish(self, target, values, ts_ms=None):
+        """Queues one message (a JSON-serializable dict) for target. Never blocks; False if dropped."""
+        try:
+            self._queue.put_nowait((target, int(ts_ms if ts_ms is not None else time.time() * 1000), values))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.queue_dropped += 1
+            logger.warning(f"Publisher queue full, dropping a message for {target}.")
+            return False
+
+    # --- Publisher thread ---
+
+    def _open_spool(self):
+        conn = db_utils.create_connection(self.spool_file, check_same_thread=False)
+        if not conn:
+            return None
+        db_utils.configure_connection(conn, cache_size_kb=1024)
+        conn.execute("""CREATE TABLE IF NOT EXISTS spool (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            target TEXT NOT NULL,
+                            ts_ms INTEGER NOT NULL,
+                            payload TEXT NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_target ON spool (target, id)")
+        conn.commit()
+        for name, count in conn.execute("SELECT target, COUNT(*) FROM spool GROUP BY target"):
+            if name in self.targets:
+                self.targets[name].spooled = count
+                logger.info(f"Publisher: {count} spooled messages for {name} from an earlier run.")
+        return conn
+
+    def _run(self):
+        self._conn = self._open_spool()
+        self._ready.set()
+        if self._conn is None:
+            logger.error(f"Publisher: could not open spool {self.spool_file}; publisher not running.")
+            return
+        logger.info(f"Publisher started ({', '.join(self.targets)}; spool {self.spool_file}).")
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self._wait_time())
+            except queue.Empty:
+                item = None
+            while item is not None:
+                if item is _STOP:
+                    stopping = True
+                    break
+                self._add_pending(item)
+                try:
+                    item = self._queue.get_nowait() # Drain what's there so batches can form
+                except queue.Empty:
+                    item = None
+            now = time.monotonic()
+            for target in self.targets.values():
+                self._service(target, now, stopping)
+        self._conn.close()
+        self._conn = None
+        logger.info("Publisher stopped.")
+
+    def _wait_time(self):
+        now = time.monotonic()
+        wait = 1.0
+        for target in self.targets.values():
+            if target.pending:
+                wait = min(wait, target.pending_since + target.batch_interval - now)
+            if target.spooled and target.connected():
+                wait = min(wait, target.retry_at - now)
+        return max(0.0, wait)
+
+    def _add_pending(self, item):
+        name, ts_ms, values = item
+        target = self.targets.get(name)
+        if target is None:
+            logger.warning(f"Publisher: unknown target {name}, message dropped.")
+            return
+        if not target.pending:
+            target.pending_since = time.monotonic()
+        target.pending.append((ts_ms, values))
+
+    def _service(self, target, now, stopping):
+        due = target.pending and (len(target.pending) >= target.batch_size or stopping
+                                  or now - target.pending_since >= target.batch_interval)
+        # Replay first, so live messages never overtake spooled ones
+        if target.spooled and now >= target.retry_at and target.connected() and not stopping:
+            self._replay(target)
+        if due:
+            messages, target.pending, target.pending_since = target.pending, [], None
+            sent = 0
+            if not target.spooled and now >= target.retry_at and target.connected():
+                sent = self._send(target, messages)
+                target.sent += sent
+            if sent < len(messages):
+                self._spool(target, messages[sent:])
+
+    def _send(self, target, messages):
+        """Publishes messages in order and waits for the acks; returns how many from the start were acked."""
+        chunks = [messages[i:i + target.batch_size] for i in range(0, len(messages), target.batch_size)]
+        infos = []
+        start = time.perf_counter()
+        for chunk in chunks:
+            try:
+                infos.append((target.client.publish(target.topic, target.payload(chunk), qos=target.qos), len(chunk)))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Publisher: publish to {target.name} failed: {e}")
+                break
+        acked = 0
+        for info, count in infos:
+            try:
+                info.wait_for_publish(self.ack_timeout)
+            except (ValueError, RuntimeError) as e:
+                logger.warning(f"Publisher: {target.name} publish not accepted: {e}")
+                break
+            if not info.is_published():
+                logger.warning(f"Publisher: no acknowledgement from {target.name} within {self.ack_timeout}s.")
+                break
+            acked += count
+        elapsed = time.perf_counter() - start
+        if infos:
+            target.stage_seconds.observe(elapsed / len(infos))
+            target.publishes += len(infos)
+            target.publish_time_total += elapsed
+        if acked < len(messages):
+            target.failures += 1
+            target.retry_at = time.monotonic() + self.retry_interval
+        return acked
+
+    def _spool(self, target, messages):
+        with self._conn:
+            self._conn.executemany("INSERT INTO spool (target, ts_ms, payload) VALUES (?, ?, ?)",
+                                   [(target.name, ts, json.dumps(values)) for ts, values in messages])
+        target.spooled += len(messages)
+        target.spooled_total += len(messages)
+        if target.spooled > self.max_spool_rows:
+            excess = target.spooled - self.max_spool_rows
+            with self._conn:
+                self._conn.execute("""DELETE FROM spool WHERE id IN (
+                                          SELECT id FROM spool WHERE target = ? ORDER BY id LIMIT ?)""",
+                                   (target.name, excess))
+            target.spooled -= excess
+            target.dropped += excess
+            logger.warning(f"Publisher: spool for {target.name} full, dropped the {excess} oldest messages.")
+
+    def _replay(self, target):
+        """Sends one batch of the oldest spooled messages; deletes the acknowledged ones."""
+        rows = self._conn.execute("SELECT id, ts_ms, payload FROM spool WHERE target = ? ORDER BY id LIMIT ?",
+                                  (target.name, self.replay_batch)).fetchall()
+        if not rows:
+            target.spooled = 0
+            return
+        acked = self._send(target, [(ts, json.loads(payload)) for _, ts, payload in rows])
+        if acked:
+            with self._conn:
+                self._conn.execute("DELETE FROM spool WHERE target = ? AND id <= ?", (target.name, rows[acked - 1][0]))
+            target.spooled -= acked
+            target.replayed += acked
+            if not target.spooled:
+                logger.info(f"Publisher: spool for {target.name} replayed.")
+
+    def stats(self):
+        result = {"queue_depth": self._queue.qsize(), "queue_dropped": self.queue_dropped}
+        for name, t in self.targets.items():
+            result[name] = {
+                "connected": t.connected(),
+                "sent": t.sent,
+                "replayed": t.replayed,
+                "spooled_total": t.spooled_total,
+                "spool_depth": t.spooled,
+                "dropped": t.dropped,
+                "failures": t.failures,
+                "avg_publish_ms": (t.publish_time_total / t.publishes * 1000.0) if t.publishes else 0.0,
+            }
+        return result
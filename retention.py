@@ -0,0 +1,258 @@
+import csv
+import gzip
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import db_utils
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+MAX_AGE_DAYS = 90 # Detections older than this are deleted (0 disables the age limit)
+MAX_DB_MB = 0 # Oldest detections are deleted while the database is larger than this (0 disables)
+ARCHIVE_DIR = None # Directory for gzip CSV archives of deleted rows, None deletes without archiving
+DELETE_BATCH_SIZE = 100 # Rows per delete transaction; keeps each write lock to a few milliseconds
+BATCH_PAUSE = 0.05 # seconds between batches so the detection writer gets the lock in between
+RUN_INTERVAL = 3600 # seconds between retention passes
+VACUUM_PAGES = 256 # Free pages handed back to the filesystem per incremental vacuum step
+# --- End Defaults ---
+
+ARCHIVE_SKIP_COLUMNS = ("plate_norm",) # Derived from plate_number, not worth archiving
+
+
+class RetentionEngine:
+    """
+    Background thread that keeps the detection database bounded.
+
+    Each pass deletes detections older than max_age_days (and those whose
+    timestamp could never be parsed, which have no age) and then, if the file
+    still uses more than max_db_mb, the oldest detections until it fits. Rows
+    are removed oldest first in batches of batch_size, each in its own short
+    transaction with a pause in between, so the detection writer is never held
+    up for more than a batch. Freed pages are returned to the filesystem with
+    incremental vacuum.
+
+    With archive_dir set, every batch is appended to a gzip CSV per day
+    (archive_dir/YYYY/MM/plates_YYYY-MM-DD.csv.gz) before it is deleted. A
+    crash between the two can archive a batch twice, never lose it. Archives
+    hold every column of license_plates; if a migration adds columns during
+    a day, that day continues in plates_YYYY-MM-DD.2.csv.gz and so on, so each
+    file has one header.
+
+    Hourly/daily rollups are kept, but their per-bucket plate lists (only needed
+    while a bucket can still receive detections) are pruned with the rows.
+    """
+
+    def __init__(self, db_file=db_utils.DB_NAME, max_age_days=MAX_AGE_DAYS, max_db_mb=MAX_DB_MB,
+                 archive_dir=ARCHIVE_DIR, batch_size=DELETE_BATCH_SIZE, batch_pause=BATCH_PAUSE,
+                 interval=RUN_INTERVAL, vacuum_pages=VACUUM_PAGES):
+        self.db_file = db_file
+        self.max_age_days = max_age_days
+        self.max_db_mb = max_db_mb
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._columns = None # Archived columns of license_plates, read at the start of every pass
+
+        self.passes = 0
+        self.rows_deleted = 0
+        self.rows_archived = 0
+        self.batches = 0
+        self.max_batch_ms = 0.0
+        self.last_pass_time = None
+        self.last_error = None
+
+    def start(self):
+        """
+        Enables incremental vacuum (a one-time VACUUM on older files, so call this before the
+        detection writer starts) and starts the background thread.
+        """
+        conn = db_utils.create_connection(self.db_file)
+        if not conn:
+            return False
+        try:
+            db_utils.create_table(conn)
+            db_utils.enable_incremental_vacuum(conn)
+        finally:
+            conn.close()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+        logger.info(f"Retention engine started (max age {self.max_age_days} days, max size {self.max_db_mb} MB, "
+                    f"archive {self.archive_dir or 'off'}).")
+        return True
+
+    def stop(self, timeout=10.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        conn = db_utils.create_connection(self.db_file)
+        if not conn:
+            return
+        db_utils.configure_connection(conn)
+        try:
+            while not self._stop_event.is_set():
+                self.run_once(conn)
+                self._stop_event.wait(self.interval)
+        finally:
+            conn.close()
+
+    def run_once(self, conn):
+        """One retention pass on conn. Returns the number of rows deleted."""
+        start = time.monotonic()
+        deleted = 0
+        try:
+            self._columns = [row[1] for row in conn.execute("PRAGMA table_info(license_plates)")
+                             if row[1] not in ARCHIVE_SKIP_COLUMNS]
+            if self.max_age_days:
+                cutoff = int((time.time() - self.max_age_days * 86400) * 1000)
+                deleted += self._delete_older_than(conn, cutoff)
+                self._prune_rollup_plates(conn, cutoff)
+            if self.max_db_mb:
+                deleted += self._shrink_to_size(conn, self.max_db_mb * 1024 * 1024)
+            db_utils.incremental_vacuum(conn)
+            self.last_error = None
+        except (OSError, sqlite3.Error) as e:
+            self.last_error = str(e)
+            logger.error(f"Retention pass failed: {e}")
+        self.passes += 1
+        self.last_pass_time = time.time()
+        if deleted:
+            used, free = db_utils.get_db_size(conn)
+            logger.info(f"Retention: deleted {deleted} rows in {time.monotonic() - start:.1f}s, "
+                        f"database now {used / 1e6:.1f} MB ({free / 1e6:.1f} MB free pages).")
+        return deleted
+
+    def _delete_older_than(self, conn, cutoff):
+        deleted = 0
+        while not self._stop_event.is_set():
+            rows = conn.execute(f"""SELECT {', '.join(self._columns)} FROM license_plates
+                                    WHERE epoch_ms < ? OR epoch_ms IS NULL ORDER BY epoch_ms, id LIMIT ?""",
+                                (cutoff, self.batch_size)).fetchall()
+            if not rows:
+                break
+            deleted += self._delete_batch(conn, rows)
+        return deleted
+
+    def _shrink_to_size(self, conn, max_bytes):
+        deleted = 0
+        while not self._stop_event.is_set():
+            used, _ = db_utils.get_db_size(conn)
+            if used <= max_bytes:
+                break
+            rows = conn.execute(f"""SELECT {', '.join(self._columns)} FROM license_plates
+                                    ORDER BY epoch_ms, id LIMIT ?""", (self.batch_size,)).fetchall()
+            if not rows:
+                break
+            deleted += self._delete_batch(conn, rows)
+        return deleted
+
+    def _delete_batch(self, conn, rows):
+        if self.archive_dir:
+            self._archive(rows) # Raises (and stops the pass) rather than deleting unarchived rows
+        id_index = self._columns.index("id")
+        start = time.perf_counter()
+        with conn:
+            conn.executemany("DELETE FROM license_plates WHERE id = ?", [(row[id_index],) for row in rows])
+        db_utils.incremental_vacuum(conn, self.vacuum_pages)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self.batches += 1
+        self.rows_deleted += len(rows)
+        self.max_batch_ms = max(self.max_batch_ms, elapsed_ms)
+        self._stop_event.wait(self.batch_pause)
+        return len(rows)
+
+    def _archive(self, rows):
+        epoch_index = self._columns.index("epoch_ms")
+        by_day = {}
+        for row in rows:
+            epoch_ms = row[epoch_index]
+            day = datetime.fromtimestamp(epoch_ms / 1000.0).date() if epoch_ms is not None else None
+            by_day.setdefault(day, []).append(row)
+        for day, day_rows in by_day.items():
+            folder = os.path.join(self.archive_dir, f"{day.year:04d}", f"{day.month:02d}") if day else self.archive_dir
+            os.makedirs(folder, exist_ok=True)
+            path = self._archive_path(folder, f"plates_{day.isoformat()}" if day else "plates_undated")
+            new_file = not os.path.exists(path)
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            if new_file:
+                writer.writerow(self._columns)
+            writer.writerows(day_rows)
+            # Appending a gzip member per batch keeps the file a valid .gz (members are concatenated)
+            with gzip.open(path, "at", encoding="utf-8", newline="") as f:
+                f.write(buf.getvalue())
+        self.rows_archived += len(rows)
+
+    def _archive_path(self, folder, base):
+        """The day's archive whose header matches the current columns (or the next unused name)."""
+        header = ",".join(self._columns)
+        part = 1
+        while True:
+            path = os.path.join(folder, f"{base}.csv.gz" if part == 1 else f"{base}.{part}.csv.gz")
+            if not os.path.exists(path):
+                return path
+            with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+                if f.readline().rstrip("\r\n") == header:
+                    return path
+            part += 1
+
+    def _prune_rollup_plates(self, conn, cutoff):
+        """Drops the distinct-plate lists of rollup buckets that ended before cutoff (counts are kept)."""
+        for bucket in db_utils.ROLLUP_BUCKETS:
+            bucket_cutoff = db_utils.bucket_start(cutoff, bucket) # Never prune the bucket cutoff falls in
+            while not self._stop_event.is_set():
+                starts = conn.execute("""SELECT DISTINCT bucket_start FROM plate_rollup_plates
+                                         WHERE bucket = ? AND bucket_start < ? LIMIT 24""",
+                                      (bucket, bucket_cutoff)).fetchall()
+                if not starts:
+                    break
+                with conn:
+                    conn.executemany("DELETE FROM plate_rollup_plates WHERE bucket = ? AND bucket_start = ?",
+                                     [(bucket, s) for (s,) in starts])
+                self._stop_event.wait(self.batch_pause)
+
+    def stats(self):
+        return {
+            "passes": self.passes,
+            "rows_deleted": self.rows_deleted,
+            "rows_archived": self.rows_archived,
+            "batches": self.batches,
+            "max_batch_ms": self.max_batch_ms,
+            "last_pass": datetime.fromtimestamp(self.last_pass_time).isoformat() if self.last_pass_time else None,
+            "last_error": self.last_error,
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Run one retention pass on a detections database.")
+    parser.add_argument("db_file", nargs="?", default=db_utils.DB_NAME)
+    parser.add_argument("--max-age-days", type=float, default=MAX_AGE_DAYS)
+    parser.add_argument("--max-db-mb", type=float, default=MAX_DB_MB)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    engine = RetentionEngine(args.db_file, max_age_days=args.max_age_days, max_db_mb=args.max_db_mb,
+                             archive_dir=args.archive_dir, batch_pause=0)
+    conn = db_utils.create_connection(args.db_file)
+    if conn:
+        db_utils.create_table(conn)
+        db_utils.enable_incremental_vacuum(conn)
+        db_utils.configure_connection(conn)
+        engine.run_once(conn)
+        conn.close()
+        print(engine.stats())
@@ -0,0 +1,272 @@
+import collections
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+import cv2
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_MAX_MB = 256 # The least recently used snapshots are deleted beyond this
+SNAPSHOT_JPEG_QUALITY = 85
+SCENE_WIDTH = 640 # Scene snapshots are downscaled to this width (0 keeps the camera resolution)
+CROP_PADDING = 0.15 # Fraction of the plate box added on every side of the crop
+THUMB_WIDTHS = (80, 160, 320) # Thumbnail widths; a requested width is rounded up to one of these
+THUMB_JPEG_QUALITY = 70
+TOUCH_INTERVAL = 3600 # seconds; a read refreshes the file's mtime (the LRU order after a restart) at most this often
+# --- End Defaults ---
+
+HASH_PATTERN = re.compile(r"[0-9a-f]{32}")
+_FILE_PATTERN = re.compile(r"([0-9a-f]{32})(?:\.w(\d+))?\.jpg")
+
+_SAVE_SECONDS = metrics.STAGE_SECONDS.labels("snapshot_save")
+
+
+class _Entry:
+    """One stored image: bytes on disk (original plus thumbnails), thumbnail widths, last touch and pixel width."""
+
+    __slots__ = ("size", "thumbs", "mtime", "width")
+
+    def __init__(self, size, mtime, width=None):
+        self.size = size
+        self.thumbs = set()
+        self.mtime = mtime
+        self.width = width # Unknown for images found on disk until a thumbnail is asked for
+
+
+class SnapshotStore:
+    """
+    Content-addressed JPEG store for plate crops and scene snapshots.
+
+    Every image is JPEG-encoded and named by the hash of its bytes, so the
+    same crop saved twice (a car waiting at the barrier) is stored once.
+    Files are sharded as <root>/ab/cd/<hash>.jpg to keep directories small.
+    Thumbnails are made on first request and cached next to the original as
+    <hash>.w<width>.jpg.
+
+    The total size is bounded by max_bytes. When a save goes over the limit,
+    the least recently used images are deleted together with their
+    thumbnails. Use order lives in memory and is rebuilt from file mtimes at
+    startup; reads refresh the mtime at most every TOUCH_INTERVAL seconds, to
+    spare the SD card. Detection rows keep their hash after an eviction, and
+    get() then returns None.
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR, max_bytes=SNAPSHOT_MAX_MB * 1024 * 1024,
+                 jpeg_quality=SNAPSHOT_JPEG_QUALITY, scene_width=SCENE_WIDTH):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.jpeg_quality = int(jpeg_quality)
+        self.scene_width = scene_width
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict() # hash -> _Entry, least recently used first
+        self._bytes = 0
+        self.saved = 0
+        self.duplicates = 0
+        self.evicted = 0
+        self.thumbs_made = 0
+        os.makedirs(root, exist_ok=True)
+        self._load()
+        metrics.SNAPSHOT_BYTES.set_function(lambda: self._bytes)
+
+    def _load(self):
+        """Rebuilds the index from the files on disk, oldest mtime first."""
+        found = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                match = _FILE_PATTERN.fullmatch(filename)
+                path = os.path.join(dirpath, filename)
+                if match is None:
+                    if filename.endswith(".tmp"):
+                        os.remove(path) # Left over from a crash in the middle of a write
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot_hash, width = match.groups()
+                entry = found.setdefault(snapshot_hash, _Entry(0, 0.0))
+                entry.size += st.st_size
+                if width:
+                    entry.thumbs.add(int(width))
+                else:
+                    entry.mtime = st.st_mtime
+        for snapshot_hash, entry in sorted(found.items(), key=lambda kv: kv[1].mtime):
+            if not entry.mtime: # Thumbnails whose original is gone
+                self._remove_files(snapshot_hash, entry.thumbs, original=False)
+                continue
+            self._entries[snapshot_hash] = entry
+            self._bytes += entry.size
+        logger.info(f"Snapshot store {self.root}: {len(self._entries)} images, {self._bytes / 1048576:.1f} MB.")
+
+    def _path(self, snapshot_hash, width=None):
+        name = f"{snapshot_hash}.w{width}.jpg" if width else f"{snapshot_hash}.jpg"
+        return os.path.join(self.root, snapshot_hash[:2], snapshot_hash[2:4], name)
+
+    def _write(self, path, data):
+        """Writes atomically, so a reader never sees a partial JPEG."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def put(self, image):
+        """Stores a BGR image; returns its hash, or None if it could not be encoded or written."""
+        start = time.perf_counter()
+        ret_enc, buffer = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+        if not ret_enc:
+            logger.warning("Snapshot store: JPEG encoding failed.")
+            return None
+        data = buffer.tobytes()
+        snapshot_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+        with self._lock:
+            if snapshot_hash in self._entries:
+                self.duplicates += 1
+                self._touch(snapshot_hash)
+                return snapshot_hash
+        try:
+            self._write(self._path(snapshot_hash), data)
+        except OSError as e:
+            logger.error(f"Snapshot store: could not write {snapshot_hash}: {e}")
+            return None
+        with self._lock:
+            if snapshot_hash not in self._entries:
+                self._entries[snapshot_hash] = _Entry(len(data), time.time(), image.shape[1])
+                self._bytes += len(data)
+                self.saved += 1
+            self._evict()
+        _SAVE_SECONDS.observe(time.perf_counter() - start)
+        return snapshot_hash
+
+    def save_detection(self, frame, rect, scene=True):
+        """
+        Stores the plate crop of rect (x0, y0, x1, y1) with CROP_PADDING around
+        it and, if scene is set, the whole frame at scene_width. Returns
+        (crop_hash, scene_hash); either is None if it was not stored.
+        """
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = rect
+        pad_x, pad_y = (x1 - x0) * CROP_PADDING, (y1 - y0) * CROP_PADDING
+        x0, y0 = max(0, int(x0 - pad_x)), max(0, int(y0 - pad_y))
+        x1, y1 = min(width, int(x1 + pad_x + 1)), min(height, int(y1 + pad_y + 1))
+        crop_hash = self.put(frame[y0:y1, x0:x1]) if x1 > x0 and y1 > y0 else None
+        scene_hash = None
+        if scene:
+            if self.scene_width and width > self.scene_width:
+                frame = cv2.resize(frame, (self.scene_width, max(1, round(height * self.scene_width / width))),
+                                   interpolation=cv2.INTER_AREA)
+            scene_hash = self.put(frame)
+        return crop_hash, scene_hash
+
+    def get(self, snapshot_hash):
+        """Path of a stored image, or None if the hash is unknown or was evicted."""
+        if not HASH_PATTERN.fullmatch(snapshot_hash or ""):
+            return None
+        with self._lock:
+            if snapshot_hash not in self._entries:
+                return None
+            self._touch(snapshot_hash)
+        return self._path(snapshot_hash)
+
+    def thumbnail(self, snapshot_hash, width):
+        """
+        Path of a thumbnail of at most width pixels (rounded up to one of
+        THUMB_WIDTHS), made and cached on first request. Returns the original's
+        path when it is not wider than that, or None if the hash is unknown.
+        """
+        width = thumb_width(width)
+        path = self.get(snapshot_hash)
+        if path is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(snapshot_hash)
+            if entry is not None and width in entry.thumbs:
+                return self._path(snapshot_hash, width)
+            if entry is not None and entry.width is not None and entry.width <= width:
+                return path
+        image = cv2.imread(path)
+        if image is None:
+            logger.warning(f"Snapshot store: could not read {path}.")
+            return None
+        if image.shape[1] <= width:
+            with self._lock:
+                if snapshot_hash in self._entries:
+                    self._entries[snapshot_hash].width = image.shape[1]
+            return path
+        height = max(1, round(image.shape[0] * width / image.shape[1]))
+        thumb = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        ret_enc, buffer = cv2.imencode(".jpg", thumb, [int(cv2.IMWRITE_JPEG_QUALITY), THUMB_JPEG_QUALITY])
+        if not ret_enc:
+            return None
+        thumb_path = self._path(snapshot_hash, width)
+        try:
+            self._write(thumb_path, buffer.tobytes())
+        except OSError as e:
+            logger.error(f"Snapshot store: could not write a thumbnail of {snapshot_hash}: {e}")
+            return None
+        with self._lock:
+            entry = self._entries.get(snapshot_hash)
+            if entry is None: # Evicted meanwhile
+                self._remove_files(snapshot_hash, {width}, original=False)
+                return None
+            if width not in entry.thumbs:
+                entry.thumbs.add(width)
+                entry.size += len(buffer)
+                self._bytes += len(buffer)
+                self.thumbs_made += 1
+            self._evict()
+        return thumb_path
+
+    def _touch(self, snapshot_hash):
+        """Marks an image as just used. Called with the lock held."""
+        self._entries.move_to_end(snapshot_hash)
+        entry = self._entries[snapshot_hash]
+        now = time.time()
+        if now - entry.mtime >= TOUCH_INTERVAL:
+            entry.mtime = now
+            try:
+                os.utime(self._path(snapshot_hash))
+            except OSError:
+                pass
+
+    def _evict(self):
+        """Deletes least recently used images until the store fits max_bytes. Called with the lock held."""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            snapshot_hash, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evicted += 1
+            self._remove_files(snapshot_hash, entry.thumbs)
+
+    def _remove_files(self, snapshot_hash, thumbs, original=True):
+        for width in [None, *thumbs] if original else thumbs:
+            try:
+                os.remove(self._path(snapshot_hash, width))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Snapshot store: could not delete {snapshot_hash}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "images": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "saved": self.saved,
+                "duplicates": self.duplicates,
+                "evicted": self.evicted,
+                "thumbnails_made": self.thumbs_made,
+            }
+
+
+def thumb_width(width):
+    """The smallest of THUMB_WIDTHS that is at least width (the largest one for bigger requests)."""
+    return next((w for w in sorted(THUMB_WIDTHS) if w >= width), max(THUMB_WIDTHS))
@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+import collections
+
+import cv2
+
+import camera_utils
+import metrics
+import pipeline
+from frame_broadcaster import FrameBroadcaster
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+REOPEN_DELAY = 5.0 # seconds between attempts to reopen a source that failed
+FILE_LOOP = False # Start video files over at the end instead of stopping that source
+LATENCY_WINDOW = 200 # Recent capture -> OCR result latencies kept per source for the stats percentiles
+# --- End Defaults ---
+
+_CAPTURE_SECONDS = metrics.STAGE_SECONDS.labels("capture")
+
+
+class VideoSource:
+    """
+    One frame source: a local camera (int index, opened through camera_utils), an
+    RTSP/HTTP stream URL or a video file (both through cv2.VideoCapture).
+
+    Its capture thread reads frames, publishes them to the source's own
+    FrameBroadcaster (/video_feed/<source_id>) and hands them to the shared
+    DetectionPipeline, whose submit_fn is this source's own OCR gate (e.g. a
+    MotionGate watching this lane). Video files are paced at their own frame
+    rate, so they behave like a camera.
+    """
+
+    def __init__(self, source_id, spec, weight=1.0, submit_fn=None, broadcaster=None, loop=FILE_LOOP,
+                 reopen_delay=REOPEN_DELAY):
+        self.source_id = str(source_id)
+        self.spec = spec
+        self.weight = float(weight)
+        self.submit_fn = submit_fn
+        self.broadcaster = broadcaster or FrameBroadcaster()
+        self.loop = loop
+        self.reopen_delay = reopen_delay
+        self.is_file = isinstance(spec, str) and "://" not in spec
+        self.cap = None
+        self._frame_interval = 0.0
+        self._next_frame_at = 0.0
+        self.finished = False
+
+        self._stats_lock = threading.Lock()
+        self.frames_captured = 0
+        self.frames_submitted = 0
+        self.frames_processed = 0
+        self.read_errors = 0
+        self.reopens = 0
+        self._interval_avg = None
+        self._last_capture = None
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._latency = metrics.SOURCE_LATENCY.labels(self.source_id)
+        metrics.SOURCE_FPS.labels(self.source_id).set_function(lambda: self.stats()["capture_fps"])
+        for state, attribute in (("captured", "frames_captured"), ("submitted", "frames_submitted"),
+                                 ("processed", "frames_processed")):
+            metrics.SOURCE_FRAMES.labels(self.source_id, state).set_function(
+                lambda attribute=attribute: getattr(self, attribute))
+
+    def open(self):
+        """Opens the source; returns True on success."""
+        if isinstance(self.spec, int):
+            self.cap = camera_utils.init_camera(self.spec) or None
+        else:
+            cap = cv2.VideoCapture(self.spec)
+            self.cap = cap if cap.isOpened() else None
+        if self.cap is None:
+            logger.error(f"Source {self.source_id}: could not open {self.spec!r}.")
+            return False
+        if self.is_file:
+            fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+            self._frame_interval = 1.0 / fps if 0 < fps < 240 else 1.0 / 25
+            self._next_frame_at = time.monotonic()
+        logger.info(f"Source {self.source_id}: opened {self.spec!r}.")
+        return True
+
+    def read(self):
+        """Returns the next frame, or None after a failed read (the source is then reopened)."""
+        if self.is_file:
+            # Pace files at their frame rate; a camera's read() blocks until the next frame anyway
+            delay = self._next_frame_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame_at = max(self._next_frame_at + self._frame_interval, time.monotonic() - 1.0)
+        if isinstance(self.spec, int):
+            ret, frame = camera_utils.capture_frame(self.cap)
+        else:
+            ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        if self.cap is None:
+            return
+        if isinstance(self.spec, int):
+            camera_utils.release_camera(self.cap)
+        else:
+            self.cap.release()
+        self.cap = None
+
+    def run(self, detection_pipeline, active_fn, stop_event):
+        """Capture loop, run on the source's own thread until stop_event is set."""
+        while not stop_event.is_set():
+            if active_fn is not None and not active_fn():
+                self.broadcaster.clear() # Viewers see "Paused"
+                stop_event.wait(1.0)
+                continue
+            if self.cap is None:
+                if self.finished or not self.open():
+                    self.broadcaster.clear() # Ensure no stale frame is streamed
+                    stop_event.wait(self.reopen_delay)
+                    continue
+            capture_start = time.perf_counter()
+            frame = self.read()
+            capture_seconds = time.perf_counter() - capture_start
+            if frame is None:
+                if self.is_file and self.loop and self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                    continue # Rewound to the start
+                self.release()
+                self.broadcaster.clear()
+                if self.is_file:
+                    logger.info(f"Source {self.source_id}: end of {self.spec!r}.")
+                    self.finished = True
+                else:
+                    logger.warning(f"Source {self.source_id}: failed to capture a frame, reopening.")
+                    with self._stats_lock:
+                        self.read_errors += 1
+                        self.reopens += 1
+                    metrics.RECONNECTS.labels("camera").inc()
+                    stop_event.wait(1.0)
+                continue
+
+            now = time.time()
+            _CAPTURE_SECONDS.observe(capture_seconds)
+            with self._stats_lock:
+                self.frames_captured += 1
+                if self._last_capture is not None:
+                    interval = now - self._last_capture
+                    self._interval_avg = interval if self._interval_avg is None else \
+                        self._interval_avg + 0.1 * (interval - self._interval_avg)
+                self._last_capture = now
+            # Hand the frame to this source's stream by reference; it is encoded once for all viewers
+            self.broadcaster.publish(frame)
+            if detection_pipeline.submit_frame(frame, now, self.source_id, self.submit_fn):
+                with self._stats_lock:
+                    self.frames_submitted += 1
+        self.release()
+
+    def record_result(self, item, now):
+        """Called by the sink for every OCR result of this source."""
+        latency = now - item.captured_at
+        self._latency.observe(latency)
+        with self._stats_lock:
+            self.frames_processed += 1
+            self._latencies.append(latency)
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            return {
+                "open": self.cap is not None,
+                "capture_fps": (1.0 / self._interval_avg) if self._interval_avg else 0.0,
+                "frames_captured": self.frames_captured,
+                "frames_submitted": self.frames_submitted,
+                "frames_processed": self.frames_processed,
+                "reopens": self.reopens,
+                "latency_p50_ms": latencies[len(latencies) // 2] * 1000.0 if latencies else 0.0,
+                "latency_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000.0 if latencies else 0.0,
+            }
+
+
+class SourceManager:
+    """
+    Runs several VideoSources into one DetectionPipeline.
+
+    Each source captures on its own thread; frames are tagged with the
+    source id (PipelineItem.source) and queued in a pipeline.FairFrameQueue,
+    so the OCR workers are shared by weighted fair queuing and a busy lane
+    cannot starve a quiet one. Build the pipeline with capture_fn=None and
+    frame_queue=manager.frame_queue, then call start(pipeline).
+
+    sources: list of VideoSource. active_fn() -> bool pauses all capture
+    while it returns False.
+    """
+
+    def __init__(self, sources, queue_size=pipeline.DEFAULT_FRAME_QUEUE_SIZE, active_fn=None):
+        if not sources:
+            raise ValueError("At least one source is needed")
+        self.sources = collections.OrderedDict()
+        for source in sources:
+            if source.source_id in self.sources:
+                raise ValueError(f"Duplicate source id {source.source_id}")
+            self.sources[source.source_id] = source
+        self.active_fn = active_fn
+        self.frame_queue = pipeline.FairFrameQueue({s.source_id: s.weight for s in sources}, queue_size)
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def open_all(self):
+        """Opens every source once up front; returns how many opened (the rest keep retrying once started)."""
+        return sum(1 for source in self.sources.values() if source.open())
+
+    def start(self, detection_pipeline):
+        self._stop_event.clear()
+        self._threads = [threading.Thread(target=source.run, args=(detection_pipeline, self.active_fn, self._stop_event),
+                                          name=f"capture-{source.source_id}", daemon=True)
+                         for source in self.sources.values()]
+        for t in self._threads:
+            t.start()
+        logger.info(f"Source manager started {len(self._threads)} source(s): "
+                    f"{', '.join(f'{s.source_id} (weight {s.weight:g})' for s in self.sources.values())}.")
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        for source in self.sources.values():
+            source.release()
+            source.broadcaster.clear()
+
+    def record_result(self, item, now):
+        source = self.sources.get(item.source)
+        if source is not None:
+            source.record_result(item, now)
+
+    def broadcasters(self):
+        """Source id -> FrameBroadcaster, in configuration order."""
+        return collections.OrderedDict((sid, s.broadcaster) for sid, s in self.sources.items())
+
+    def stats(self):
+        queue_stats = self.frame_queue.stats()
+        return {sid: dict(source.stats(), **queue_stats.get(sid, {})) for sid, source in self.sources.items()}
+
+
+def format_stats(stats):
+    """One-line summary of SourceManager.stats() for the log."""
+    return "; ".join(f"{sid}: {s['capture_fps']:.1f} FPS, OCR'd {s['frames_processed']}/{s['frames_submitted']} "
+                     f"(dropped {s['dropped']}, {s['ocr_seconds']:.1f}s OCR, weight {s['weight']:g}), "
+                     f"latency p50 {s['latency_p50_ms']:.0f} ms / p95 {s['latency_p95_ms']:.0f} ms"
+                     for sid, s in stats.items())
@@ -1,98 +1,314 @@
 import tkinter as tk
-from tkinter import ttk, scrolledtext
+from tkinter import ttk
+import collections
+import itertools
+import logging
 import queue # For receiving data from MQTT subscriber
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults ---
+MAX_ROWS = 5000 # Rows kept in memory; the oldest are dropped beyond this
+VISIBLE_ROWS = 25 # Treeview rows actually created; scrolling re-fills them
+TICK_MS = 100 # UI refresh period
+TICK_BUDGET_MS = 20 # Time per tick spent draining the queue; the rest waits for the next tick
+RATE_WINDOW = 5.0 # seconds over which the messages/s counter is averaged
+# --- End Defaults ---
+
+COLUMNS = (("plate", "Plate", 140), ("timestamp", "Time", 200), ("confidence", "Confidence", 100),
+           ("received", "Received", 100))
+
+
+class PlateRowBuffer:
+    """
+    Bounded ring buffer of received plates with a lazily rebuilt filtered/sorted view.
+    Rows are (seq, plate, timestamp, confidence, received_at); seq orders arrivals.
+    Holds no Tk objects, so it can be used and measured without a display.
+    """
+
+    def __init__(self, max_rows=MAX_ROWS, rate_window=RATE_WINDOW):
+        self.rows = collections.deque(maxlen=max_rows)
+        self.rate_window = rate_window
+        self._seq = itertools.count(1)
+        self.sort_key = None # Column index into a row, None = arrival order
+        self.sort_descending = True # Newest first by default
+        self.filter_text = ""
+        self._view = None # Cached filtered / sorted list, None when it must be rebuilt
+        self._arrivals = collections.deque() # (time, count) per drain, for the rate counter
+
+        self.received = 0
+        self.evicted = 0
+        self.invalid = 0
+
+    def add_many(self, messages, now=None):
+        """Appends decoded plate dicts; returns how many were added."""
+        now = time.time() if now is None else now
+        added = 0
+        for message in messages:
+            try:
+                row = (next(self._seq), str(message.get('plate', 'N/A')), str(message.get('timestamp', '')),
+                       float(message.get('confidence', 0.0)), now)
+            except (AttributeError, TypeError, ValueError):
+                self.invalid += 1
+                continue
+            if len(self.rows) == self.rows.maxlen:
+                self.evicted += 1
+            self.rows.append(row)
+            added += 1
+        if added:
+            self.received += added
+            self._arrivals.append((now, added))
+            self._view = None
+        return added
+
+    def rate(self, now=None):
+        """Messages per second over the last rate_window seconds."""
+        now = time.time() if now is None else now
+        while self._arrivals and self._arrivals[0][0] < now - self.rate_window:
+            self._arrivals.popleft()
+        return sum(count for _, count in self._arrivals) / self.rate_window
+
+    def set_filter(self, text):
+        text = text.strip().upper()
+        if text != self.filter_text:
+            self.filter_text = text
+            self._view = None
+
+    def set_sort(self, key, descending):
+        if (key, descending) != (self.sort_key, self.sort_descending):
+            self.sort_key, self.sort_descending = key, descending
+            self._view = None
+
+    def view(self):
+        """The rows to display, filtered and sorted; rebuilt only after a change."""
+        if self._view is None:
+            rows = self.rows
+            if self.filter_text:
+                rows = [r for r in rows if self.filter_text in r[1]]
+            if self.sort_key is None:
+                view = list(rows)
+                if self.sort_descending:
+                    view.reverse()
+            else:
+                view = sorted(rows, key=lambda r: (r[self.sort_key], r[0]), reverse=self.sort_descending)
+            self._view = view
+        return self._view
+
 
 class PlateDashboard:
-    def __init__(self, root, data_queue):
+    """
+    Tk dashboard for plates received over MQTT.
+
+    Every TICK_MS the queue is drained for at most TICK_BUDGET_MS into a bounded
+    PlateRowBuffer, and the table is redrawn once for everything that arrived.
+    The Treeview only ever holds VISIBLE_ROWS items: scrolling moves a window
+    over the (filtered, sorted) buffer and rewrites those items in place, so a
+    redraw costs the same with 50 rows or MAX_ROWS.
+    """
+
+    def __init__(self, root, data_queue, max_rows=MAX_ROWS, visible_rows=VISIBLE_ROWS, tick_ms=TICK_MS,
+                 tick_budget_ms=TICK_BUDGET_MS, dropped_count=None):
         self.root = root
         self.data_queue = data_queue # Queue to get data from MQTT subscriber
+        self.dropped_count = dropped_count # Optional callable: messages the producer dropped on a full queue
+        self.buffer = PlateRowBuffer(max_rows)
+        self.visible_rows = visible_rows
+        self.tick_ms = tick_ms
+        self.tick_budget = tick_budget_ms / 1000.0
+        self.offset = 0 # Index in the view of the first displayed row
+        self._shown = [None] * visible_rows # Values currently in each Treeview item
+        self._dirty = True
+        self.render_time_ms = 0.0
         self.root.title("License Plate Dashboard")
-        self.root.geometry("600x400")
+        self.root.geometry("640x600")
 
         self.create_widgets()
         self.check_queue_periodically() # Start checking the queue
 
     def create_widgets(self):
-        # Frame for displaying plates
         main_frame = ttk.Frame(self.root, padding="10")
         main_frame.pack(expand=True, fill=tk.BOTH)
 
-        ttk.Label(main_frame, text="Detected License Plates:", font=("Arial", 14)).pack(pady=5)
+        header = ttk.Frame(main_frame)
+        header.pack(fill=tk.X)
+        ttk.Label(header, text="Detected License Plates:", font=("Arial", 14)).pack(side=tk.LEFT, pady=5)
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add("write", lambda *args: self._on_filter())
+        ttk.Entry(header, textvariable=self.filter_var, width=16).pack(side=tk.RIGHT)
+        ttk.Label(header, text="Filter plate:").pack(side=tk.RIGHT, padx=5)
 
-        # Using a ScrolledText widget for easy display and scrolling
-        self.plate_display = scrolledtext.ScrolledText(main_frame, wrap=tk.WORD, height=15, width=70)
-        self.plate_display.pack(expand=True, fill=tk.BOTH, padx=5, pady=5)
-        self.plate_display.configure(state='disabled') # Make it read-only initially
+        table = ttk.Frame(main_frame)
+        table.pack(expand=True, fill=tk.BOTH, pady=5)
+        self.tree = ttk.Treeview(table, columns=[c[0] for c in COLUMNS], show="headings", height=self.visible_rows,
+                                 selectmode="browse")
+        for index, (name, title, width) in enumerate(COLUMNS):
+            self.tree.heading(name, text=title, command=lambda i=index: self._on_sort(i))
+            self.tree.column(name, width=width, anchor=tk.W)
+        # The scrollbar spans the whole buffer, not the few items the Treeview holds
+        self.scrollbar = ttk.Scrollbar(table, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.tree.pack(side=tk.LEFT, expand=True, fill=tk.BOTH)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.items = [self.tree.insert("", tk.END, values=("", "", "", "")) for _ in range(self.visible_rows)]
+        for widget in (self.tree, self.scrollbar):
+            widget.bind("<MouseWheel>", self._on_wheel)
+            widget.bind("<Button-4>", lambda e: self._scroll_to(self.offset - 3)) # X11 wheel up
+            widget.bind("<Button-5>", lambda e: self._scroll_to(self.offset + 3))
 
-        # Status bar (optional)
+        # Status bar
         self.status_var = tk.StringVar()
         self.status_var.set("Awaiting data...")
         status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
-    def add_plate_to_display(self, plate_data):
-        """Adds plate information to the text display."""
+    # --- Input ---
+
+    def _on_filter(self):
+        self.buffer.set_filter(self.filter_var.get())
+        self.offset = 0
+        self._dirty = True
+
+    def _on_sort(self, column_index):
+        key = column_index + 1 if COLUMNS[column_index][0] != "received" else None # None: arrival order
+        if self.buffer.sort_key == key:
+            descending = not self.buffer.sort_descending
+        else:
+            descending = COLUMNS[column_index][0] in ("confidence", "received") # Highest / newest first
+        self.buffer.set_sort(key, descending)
+        for index, (name, title, _) in enumerate(COLUMNS):
+            arrow = ""
+            if index == column_index:
+                arrow = " ▼" if descending else " ▲"
+            self.tree.heading(name, text=title + arrow)
+        self.offset = 0
+        self._dirty = True
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        total = len(self.buffer.view())
+        if action == "moveto":
+            self._scroll_to(int(float(amount) * total))
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self._scroll_to(self.offset + int(amount) * step)
+
+    def _on_wheel(self, event):
+        self._scroll_to(self.offset - (3 if event.delta > 0 else -3))
+        return "break"
+
+    def _scroll_to(self, offset):
+        max_offset = max(0, len(self.buffer.view()) - self.visible_rows)
+        offset = min(max(0, offset), max_offset)
+        if offset != self.offset:
+            self.offset = offset
+            self._dirty = True
+            self.render()
+
+    # --- Periodic update ---
+
+    def drain_queue(self):
+        """Moves queued messages into the buffer for at most the tick budget; returns how many."""
+        deadline = time.perf_counter() + self.tick_budget
+        batch = []
         try:
-            plate = plate_data.get('plate', 'N/A')
-            timestamp = plate_data.get('timestamp', 'N/A')
-            confidence = plate_data.get('confidence', 'N/A')
-            
-            display_text = f"Plate: {plate}, Time: {timestamp}, Confidence: {confidence:.2f}\n"
-            
-            self.plate_display.configure(state='normal') # Enable editing
-            self.plate_display.insert(tk.END, display_text)
-            self.plate_display.see(tk.END) # Scroll to the end
-            self.plate_display.configure(state='disabled') # Disable editing
-            
-            self.status_var.set(f"Last received: {plate} at {timestamp.split('T')[1].split('.')[0]}")
-        except Exception as e:
-            print(f"Error updating dashboard UI: {e}")
-            self.plate_display.configure(state='normal')
-            self.plate_display.insert(tk.END, f"Error processing data: {plate_data}\n")
-            self.plate_display.see(tk.END)
-            self.plate_display.configure(state='disabled')
+            while time.perf_counter() < deadline:
+                for _ in range(100): # Check the clock once per 100 messages
+                    message = self.data_queue.get_nowait()
+                    if isinstance(message, list): # A batched payload
+                        batch.extend(message)
+                    else:
+                        batch.append(message)
+        except queue.Empty:
+            pass
+        if batch:
+            arrival_order = self.buffer.sort_key is None and self.buffer.sort_descending
+            view = self.buffer.view()
+            anchor = view[self.offset][0] if self.offset and arrival_order and self.offset < len(view) else None
+            self.buffer.add_many(batch)
+            if anchor is not None:
+                # Newest-first view scrolled away from the top: keep the same rows in view
+                # (the view is in descending seq order, so the anchor's index is the count of newer rows)
+                self.offset = next((i for i, row in enumerate(self.buffer.view()) if row[0] <= anchor), 0)
+            self._dirty = True
+        return len(batch)
 
+    def render(self):
+        """Writes the visible window of the view into the Treeview items that changed."""
+        start = time.perf_counter()
+        view = self.buffer.view()
+        total = len(view)
+        self.offset = min(self.offset, max(0, total - self.visible_rows))
+        window = view[self.offset:self.offset + self.visible_rows]
+        for i, item in enumerate(self.items):
+            if i < len(window):
+                _, plate, timestamp, confidence, received = window[i]
+                values = (plate, timestamp.replace("T", " ")[:19], f"{confidence:.2f}",
+                          time.strftime("%H:%M:%S", time.localtime(received)))
+            else:
+                values = ("", "", "", "")
+            if self._shown[i] != values:
+                self.tree.item(item, values=values)
+                self._shown[i] = values
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible_rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self._dirty = False
+        self.render_time_ms = (time.perf_counter() - start) * 1000.0
+
+    def update_status(self):
+        b = self.buffer
+        latest = b.rows[-1] if b.rows else None
+        last = f"last {latest[1]}" if latest else "awaiting data"
+        dropped = f" | {self.dropped_count()} dropped" if self.dropped_count else ""
+        self.status_var.set(f"{b.rate():.0f} msg/s | {b.received} received{dropped} | {len(b.rows)} kept,"
+                            f" {b.evicted} rolled off | {self.data_queue.qsize()} queued"
+                            f" | render {self.render_time_ms:.1f} ms | {last}")
 
     def check_queue_periodically(self):
-        """Checks the queue for new messages and updates UI if any."""
+        """Drains the queue within the tick budget and redraws once for everything that arrived."""
         try:
-            while True: # Process all messages currently in queue
-                message = self.data_queue.get_nowait() # Non-blocking get
-                self.add_plate_to_display(message)
-        except queue.Empty:
-            pass # No new messages
+            self.drain_queue()
+            if self._dirty:
+                self.render()
+            self.update_status()
+        except Exception as e:
+            logger.error(f"Error updating dashboard UI: {e}", exc_info=True)
         finally:
-            # Schedule this method to be called again after 100ms
-            self.root.after(100, self.check_queue_periodically)
+            self.root.after(self.tick_ms, self.check_queue_periodically)
 
     def on_closing(self):
         """Handle window close event."""
-        print("Dashboard closing.")
+        logger.info("Dashboard closing.")
         self.root.destroy()
 
 
 if __name__ == '__main__':
-    # For standalone testing of the dashboard UI
-    import logging
-    logging.basicConfig(level=logging.INFO) # For MQTT subscriber if tested here
-    
+    # For standalone testing of the dashboard UI: python tkinter_dash.py [messages per second]
+    import random
+    import sys
+    import threading
+    from datetime import datetime
+    logging.basicConfig(level=logging.INFO)
+
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 1000.0
     root_tk = tk.Tk()
-    test_data_queue = queue.Queue()
+    test_data_queue = queue.Queue(maxsize=50000)
     app = PlateDashboard(root_tk, test_data_queue)
 
-    # Simulate receiving data
+    # Simulate a busy feed from a background thread, like the MQTT subscriber
     def simulate_data_arrival():
-        import random, time
-        from datetime import datetime
-        
-        sim_data = {
-            'plate': f"SIM{random.randint(100,999)}",
-            'timestamp': datetime.now().isoformat(),
-            'confidence': random.uniform(0.7, 0.99)
-        }
-        test_data_queue.put(sim_data)
-        root_tk.after(3000, simulate_data_arrival) # Add new data every 3 seconds
-
-    root_tk.after(1000, simulate_data_arrival) # Start simulation after 1 sec
+        while True:
+            for _ in range(max(1, int(rate / 100))):
+                try:
+                    test_data_queue.put_nowait({
+                        'plate': f"SIM{random.randint(100, 999)}",
+                        'timestamp': datetime.now().isoformat(),
+                        'confidence': random.uniform(0.7, 0.99),
+                    })
+                except queue.Full:
+                    pass
+            time.sleep(0.01)
+
+    threading.Thread(target=simulate_data_arrival, daemon=True).start()
     root_tk.protocol("WM_DELETE_WINDOW", app.on_closing)
-    root_tk.mainloop()
\ No newline at end of file
+    root_tk.mainloop()